@@ -0,0 +1,275 @@
+import math
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from api.association.itemset_engines import FREQUENT_ITEMSET_ENGINES, as_item_matrix, transaction_weights
+from api.association.parallel_counting import (DEFAULT_WORKERS, apriori_candidates, parallel_cooccurrence_counts,
+                                               parallel_itemset_support_counts)
+from api.association.transactions import TransactionMatrix, compact_transactions
+
+# Default error allowed on a sampled support, as a fraction of min_support,
+# and the probability that a single itemset exceeds it.
+DEFAULT_RELATIVE_SUPPORT_ERROR = 0.25
+DEFAULT_DELTA = 0.05
+
+
+def default_support_error(min_support):
+    """
+    Absolute support error used when none is given: a quarter of min_support,
+    so the sampled supports still separate the itemsets around the threshold.
+    """
+    return min_support * DEFAULT_RELATIVE_SUPPORT_ERROR
+
+
+def hoeffding_sample_size(epsilon, delta=DEFAULT_DELTA):
+    """
+    Orders to sample so that a sampled support is within `epsilon` of the true
+    support with probability at least 1 - delta (Hoeffding: n >= ln(2/delta) / (2 epsilon^2)).
+    """
+    return int(math.ceil(math.log(2.0 / delta) / (2.0 * epsilon ** 2)))
+
+
+def hoeffding_error(n, delta=DEFAULT_DELTA):
+    """
+    Support error bound of a sample of `n` orders at confidence 1 - delta.
+    """
+    return math.sqrt(math.log(2.0 / delta) / (2.0 * n)) if n else 1.0
+
+
+def reservoir_sample(n_items, k, seed):
+    """
+    Reservoir sampling (Algorithm R) of `k` positions out of a stream of
+    `n_items`, vectorized: item i >= k draws a slot j in [0, i] and replaces
+    slot j when j < k, so each slot ends up holding the last item that drew it.
+
+    Returns:
+        np.ndarray: Sorted sampled positions.
+    """
+    if n_items <= k:
+        return np.arange(n_items)
+    rng = np.random.default_rng(seed)
+    reservoir = np.arange(k)
+    positions = np.arange(k, n_items)
+    slots = rng.integers(0, positions + 1)
+    hit = slots < k
+    slots, positions = slots[hit][::-1], positions[hit][::-1]
+    # After reversing, the first occurrence of a slot is its last replacement.
+    taken, first = np.unique(slots, return_index=True)
+    reservoir[taken] = positions[first]
+    return np.sort(reservoir)
+
+
+def sample_transactions(transactions, k, seed):
+    """
+    Reservoir sample of `k` orders. Weighted (compacted) rows are sampled as
+    the orders they stand for; the sample is returned compacted.
+    """
+    weights = transaction_weights(transactions)
+    matrix, _ = as_item_matrix(transactions)
+    if weights is None:
+        rows = reservoir_sample(matrix.shape[0], k, seed)
+        sample_weights = None
+    else:
+        picked = np.repeat(np.arange(matrix.shape[0]), weights)[reservoir_sample(int(weights.sum()), k, seed)]
+        rows, sample_weights = np.unique(picked, return_counts=True)
+    sample = TransactionMatrix(matrix=matrix[rows], vocabulary=transactions.vocabulary,
+                               order_ids=transactions.order_ids[:0], weights=sample_weights)
+    return compact_transactions(sample)
+
+
+def negative_border(frequent, n_columns):
+    """
+    Toivonen's negative border: the minimal itemsets that are not frequent
+    although all of their subsets are (the candidates one level above that
+    the sample rejected).
+
+    Args:
+        frequent (set): Frequent itemsets as sorted tuples of column indices,
+                        including the single items.
+        n_columns (int): Number of items; every infrequent single item is on the border.
+
+    Returns:
+        list: Border itemsets as sorted tuples.
+    """
+    by_length = {}
+    for itemset in frequent:
+        by_length.setdefault(len(itemset), []).append(itemset)
+    border = [(column,) for column in range(n_columns) if (column,) not in frequent]
+    for length in sorted(by_length):
+        border.extend(candidate for candidate in apriori_candidates(by_length[length])
+                      if candidate not in frequent)
+    return border
+
+
+def exact_support_counts(matrix, itemsets, weights=None, workers=DEFAULT_WORKERS):
+    """
+    Counts the given itemsets over all orders in one pass: single items and
+    pairs (most of the candidates and of the border) from the sparse
+    co-occurrence counts, longer itemsets with the candidate product.
+
+    Returns:
+        np.ndarray: int64 count per itemset.
+    """
+    counts = np.zeros(len(itemsets), dtype=np.int64)
+    lengths = np.fromiter((len(itemset) for itemset in itemsets), dtype=np.int64, count=len(itemsets))
+    item_counts, pair_counts = parallel_cooccurrence_counts(matrix, workers=workers, weights=weights)
+
+    singles = np.flatnonzero(lengths == 1)
+    counts[singles] = item_counts[[itemsets[i][0] for i in singles]]
+    pairs = np.flatnonzero(lengths == 2)
+    if len(pairs):
+        # Itemsets are sorted tuples, so (first, second) is in the upper triangle.
+        rows = np.fromiter((itemsets[i][0] for i in pairs), dtype=np.int64, count=len(pairs))
+        columns = np.fromiter((itemsets[i][1] for i in pairs), dtype=np.int64, count=len(pairs))
+        counts[pairs] = np.asarray(pair_counts[rows, columns]).ravel()
+    longer = np.flatnonzero(lengths > 2)
+    if len(longer):
+        counts[longer] = parallel_itemset_support_counts(matrix, [itemsets[i] for i in longer],
+                                                         workers=workers, weights=weights)
+    return counts
+
+
+@dataclass
+class ApproximateResult:
+    """
+    Rules of an approximate run plus what is needed to judge and reproduce them.
+    """
+    rules: pd.DataFrame
+    seed: int
+    sample_size: int
+    n_transactions: int
+    epsilon: float
+    delta: float
+    lowered_support: float
+    verified: bool
+    border_misses: int
+
+    def report(self, title='Approximate mining'):
+        """
+        Prints and logs the sampling parameters (including the seed to reproduce the run).
+        """
+        lines = [
+            f"seed={self.seed} sample={self.sample_size}/{self.n_transactions} orders "
+            f"epsilon={self.epsilon:.6g} delta={self.delta:.6g}",
+            f"sample threshold={self.lowered_support:.6g} verified={self.verified} rules={len(self.rules)}",
+        ]
+        if self.border_misses:
+            lines.append(f"{self.border_misses} negative-border itemsets are frequent in the full data: "
+                         "some rules may be missing, rerun with a larger sample")
+        print(f"🎲 {title}:")
+        for line in lines:
+            print(f"   {line}")
+            logging.info(f"{title} - {line}")
+
+
+def approximate_rules(transactions, min_support, min_confidence, epsilon=None,
+                      delta=DEFAULT_DELTA, seed=None, max_len=None, verify=True, workers=DEFAULT_WORKERS):
+    """
+    Mines association rules on a reservoir sample of the orders.
+
+    The sample size comes from the Hoeffding bound for `epsilon` / `delta`. The
+    sample is mined with Eclat at the lowered threshold min_support - epsilon
+    (Toivonen; at least min_support / 2), so itemsets that are frequent in the full data are very likely
+    among the candidates. With `verify`, one sharded counting pass over all
+    orders then computes the exact support of the candidates and of their
+    negative border: the returned supports and confidences are exact, and a
+    frequent border itemset signals possibly missed rules.
+
+    Args:
+        transactions (TransactionMatrix): All orders (compacted or not).
+        min_support (float): Minimum support of the rules' itemsets.
+        min_confidence (float): Minimum confidence of the rules.
+        epsilon (float): Allowed support error of the sample (default: see
+                         default_support_error()). Must be below min_support.
+        delta (float): Probability that one itemset's sampled support is off by more than epsilon.
+        seed (int): Sampling seed; a random one is drawn (and reported) when None.
+        max_len (int): Optional maximum itemset length.
+        verify (bool): Count the candidates over the full data.
+        workers (int): Processes for the verification pass.
+
+    Returns:
+        ApproximateResult: The rules and the sampling parameters. Rules carry
+                           'sample support' and 'support error': the observed
+                           |sample - exact| difference when verified, otherwise the
+                           epsilon bound (with a matching 'confidence error' bound).
+    """
+    from mlxtend.frequent_patterns import association_rules
+
+    if epsilon is None:
+        epsilon = default_support_error(min_support)
+    if not 0 < epsilon < min_support:
+        raise ValueError(f"The support error must be between 0 and min_support ({min_support}), got {epsilon}.")
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+    n_transactions = getattr(transactions, 'n_transactions', transactions.shape[0])
+    sample_size = min(hoeffding_sample_size(epsilon, delta), n_transactions)
+    sample = sample_transactions(transactions, sample_size, seed)
+    epsilon = hoeffding_error(sample_size, delta) if sample_size < n_transactions else 0.0
+    # Toivonen's lowered threshold, floored at half of min_support so a loose
+    # epsilon cannot turn the sample mining into an enumeration of everything.
+    lowered_support = max(min_support - epsilon, min_support / 2)
+
+    # Mine with column indices; they are mapped to product IDs at the end.
+    sampled = FREQUENT_ITEMSET_ENGINES['eclat'](sample.matrix, lowered_support, max_len=max_len, weights=sample.weights)
+    sample_supports = {tuple(sorted(itemset)): support
+                       for itemset, support in zip(sampled['itemsets'], sampled['support'])}
+
+    border_misses = 0
+    if verify and epsilon > 0:
+        candidates = list(sample_supports)
+        border = negative_border(set(candidates), sample.matrix.shape[1])
+        if max_len is not None:
+            border = [itemset for itemset in border if len(itemset) <= max_len]
+        matrix, _ = as_item_matrix(transactions)
+        counts = exact_support_counts(matrix, candidates + border, weights=transaction_weights(transactions),
+                                      workers=workers)
+        supports = counts / n_transactions
+        border_misses = int(np.sum(supports[len(candidates):] >= min_support))
+        if border_misses:
+            logging.warning(f"Approximate mining (seed={seed}): {border_misses} negative-border itemsets "
+                            "are frequent in the full data.")
+        keep = supports[:len(candidates)] >= min_support
+        itemsets = [candidate for candidate, kept in zip(candidates, keep) if kept]
+        frequent = pd.DataFrame({'support': supports[:len(candidates)][keep],
+                                 'itemsets': [frozenset(itemset) for itemset in itemsets]})
+    else:
+        itemsets = [itemset for itemset, support in sample_supports.items() if support >= min_support]
+        frequent = pd.DataFrame({'support': [sample_supports[itemset] for itemset in itemsets],
+                                 'itemsets': [frozenset(itemset) for itemset in itemsets]})
+
+    verified = verify or epsilon == 0
+    if frequent.empty:
+        rules = pd.DataFrame(columns=['antecedents', 'consequents', 'support', 'confidence'])
+    else:
+        rules = association_rules(frequent, n_transactions, metric='confidence', min_threshold=min_confidence)
+
+    if not rules.empty:
+        union = [tuple(sorted(a | c)) for a, c in zip(rules['antecedents'], rules['consequents'])]
+        rules['sample support'] = [sample_supports[itemset] for itemset in union]
+        if verified:
+            rules['support error'] = (rules['sample support'] - rules['support']).abs()
+            rules['confidence error'] = 0.0
+        else:
+            # conf = s(XY) / s(X) with both supports within +-epsilon.
+            antecedent_support = np.maximum(rules['antecedent support'].to_numpy() - epsilon, 1e-12)
+            rules['support error'] = epsilon
+            rules['confidence error'] = epsilon * (1.0 + rules['confidence'].to_numpy()) / antecedent_support
+        labels = transactions.vocabulary.product_ids
+        for column in ('antecedents', 'consequents'):
+            rules[column] = [frozenset(labels[list(itemset)].tolist()) for itemset in rules[column]]
+
+    return ApproximateResult(
+        rules=rules,
+        seed=seed,
+        sample_size=sample_size,
+        n_transactions=n_transactions,
+        epsilon=epsilon,
+        delta=delta,
+        lowered_support=lowered_support,
+        verified=verified,
+        border_misses=border_misses,
+    )
+
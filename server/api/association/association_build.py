@@ -3,6 +3,27 @@ import numpy as np
 import mysql.connector
 import logging
 import sys
+import threading
+import weakref
+
+from api.catalog_cache import catalog_cache
+from api.db import make_connection_with_db
+from api.association.approximate import approximate_rules, default_support_error
+from api.association.baskets import fetch_baskets_fingerprint, load_order_baskets
+from api.association.budget import MiningBudget, plan_mining
+from api.association.checkpoints import DEFAULT_CHECKPOINT_DIR, PIPELINE_STAGES, CheckpointStore, content_hash
+from api.association.decay import decay_weights
+from api.association.incremental import DEFAULT_STATE_PATH, AssociationCounts
+from api.association.itemset_engines import MAXIMAL_ONLY_ENGINES, UNWEIGHTED_ENGINES, mine_frequent_itemsets
+from api.association.pairwise import pairwise_rules
+from api.association.parallel_counting import DEFAULT_WORKERS
+from api.association.partitioned import partitioned_frequent_itemsets
+from api.association.pruning import DEFAULT_TOP_K, TOP_K_METRICS, top_k_pairs
+from api.association.recommendation_index import RecommendationIndex, get_live_index, publish_index, reload_index
+from api.association.rule_index import RuleIndex
+from api.association.stage_stats import StageStats
+from api.association.transactions import baskets_from_dataframe, build_transaction_matrix, compact_transactions
+
 sys.stdout.reconfigure(encoding='utf-8')
 # Set up error logging
 # Errors will be written to 'export_errors.log' with a timestamp, level, and message.
@@ -12,35 +33,18 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-def make_connection_with_db():
-    """
-    Establishes a connection to the MySQL database.
-
-    Returns:
-        tuple: A tuple containing the connection object and cursor object,
-               or (None, None) if the connection fails.
-    """
-    connection = None
-    cursor = None
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",       # Database host (e.g., 'localhost' or an IP address)
-            user="root",            # Database username
-            password="",            # Database password (leave empty if no password)
-            database="wp_ecommerce" # Name of the database to connect to
-        )
-        # Use dictionary=True to fetch results as dictionaries (column_name: value)
-        cursor = connection.cursor(dictionary=True)
-        return connection, cursor
-    except mysql.connector.Error as err:
-        logging.error(f"Error connecting to database: {err}", exc_info=True)
-        print(f"Error connecting to database: {err}")
-        return None, None
+# The bit-packed Eclat engine finds the same itemsets as Apriori without
+# level-wise candidate generation or a dense one-hot frame, which matters at
+# the low min_support used below (see benchmark_engines.py).
+DEFAULT_ITEMSET_ENGINE = 'eclat'
 
+# Rows per executemany() / IN (...) batch when writing rules.
+EXPORT_BATCH_SIZE = 1000
 
 def get_product_name_from_id(product_id):
     """
     Retrieves the product title from the 'wp_posts' table given a product ID.
+    Served from the shared product catalog cache.
 
     Args:
         product_id (int): The ID of the product.
@@ -48,7 +52,36 @@ def get_product_name_from_id(product_id):
     Returns:
         str: The title of the product, or 'Not Found' if not found or an error occurs.
     """
-    product_name = 'Not Found' # Initialize with default value
+    return catalog_cache.get_product_title(product_id)
+
+def get_product_names_from_ids(product_ids):
+    """
+    Retrieves the titles of many products at once. Misses in the shared
+    product catalog cache are loaded with chunked IN (...) queries.
+
+    Args:
+        product_ids (list): Product IDs to resolve.
+
+    Returns:
+        dict: product ID -> product title, for the IDs that were found.
+    """
+    return catalog_cache.get_product_titles(product_ids)
+
+def load_baskets_from_db(stats=None, after_order_id=None, with_dates=False):
+    """
+    Loads every order basket with one ordered, streamed query on
+    'wp_wc_order_product_lookup' (see baskets.load_order_baskets).
+
+    Args:
+        stats (StageStats): Optional collector for per-stage row counts and timings.
+        after_order_id (int): Only load orders after this order_id (incremental runs).
+        with_dates (bool): Also load the order dates (for time-decayed supports).
+
+    Returns:
+        Baskets: The baskets ordered by order_id (empty if there are no orders),
+                 or None if the connection or the query failed.
+    """
+    baskets = None
     connection = None
     cursor = None
 
@@ -57,182 +90,143 @@ def get_product_name_from_id(product_id):
 
         # Check if database connection was successful
         if connection is None or cursor is None:
-            print("Database connection failed for get_product_name_from_id.")
-            return product_name
+            print("Database connection failed for load_baskets_from_db.")
+            return baskets
 
-        # SQL query to select the post_title (product title) from wp_posts
-        # %s is used as a placeholder for secure parameter binding
-        sql = 'SELECT wp_posts.post_title as product_title FROM wp_posts WHERE wp_posts.ID = %s;'
-
-        # Execute the query with the product_id passed as a tuple
-        cursor.execute(sql, (product_id,))
-        results = cursor.fetchall()
-
-        if results: # If results are found (list is not empty)
-            product_name = results[0]['product_title'] # Extract the product title
+        baskets = load_order_baskets(connection, stats=stats, after_order_id=after_order_id, with_dates=with_dates)
 
     except mysql.connector.Error as err:
-        logging.error(f"Database error in get_product_name_from_id for ID {product_id}: {err}", exc_info=True)
-        print(f"Database error: {err}. Could not retrieve product name for ID: {product_id}")
+        logging.error(f"Database error in load_baskets_from_db: {err}", exc_info=True)
+        print(f"Database error: {err}. Could not retrieve product associations.")
     except Exception as e:
-        logging.error(f"An unexpected error occurred in get_product_name_from_id for ID {product_id}: {e}", exc_info=True)
-        print(f"An unexpected error occurred: {e}. Could not retrieve product name for ID: {product_id}")
+        logging.error(f"An unexpected error occurred in load_baskets_from_db: {e}", exc_info=True)
+        print(f"An unexpected error occurred: {e}. Could not retrieve product associations.")
     finally:
-        # Ensure cursor and connection are closed in all cases to release resources
+        # Ensure cursor and connection are closed in all cases
         if cursor:
             cursor.close()
         if connection:
             connection.close()
-
-    return product_name
+    return baskets
 
 def build_dataframe_associated_products():
     """
     Builds a DataFrame where each row represents an order and contains a list
     of product IDs purchased in that order.
 
-    This function iterates through all orders and for each order,
-    queries the associated products. This can be inefficient for large datasets
-    (N+1 query problem).
+    All (order_id, product_id) pairs are pulled in one ordered query and grouped
+    into baskets in a single vectorized step, instead of one query per order.
 
     Returns:
         pd.DataFrame: A DataFrame of product IDs per order. Columns are
                       dynamically numbered (0, 1, 2, ...).
                       Returns an empty DataFrame if no data or connection fails.
     """
-    # Initialize an empty DataFrame. Columns are pre-defined, assuming max 10 products.
-    # If an order has fewer than 10 products, the remaining columns will be NaN.
-    df = pd.DataFrame(columns=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
-    connection = None # Initialize connection variable
-    cursor = None     # Initialize cursor variable
-
-    try:
-        connection, cursor = make_connection_with_db()
-
-        # Check if database connection was successful
-        if connection is None or cursor is None:
-            print("Database connection failed for build_dataframe_associated_products.")
-            return df # Return the empty DataFrame on failure
-
-        # Select all order statistics, ordered by order_id
-        sql = 'SELECT * FROM `wp_wc_order_stats` order by order_id ;'
-        cursor.execute(sql)
-        orders_results = cursor.fetchall() # Fetch all orders
-
-        if orders_results: # If orders are found
-            # Loop through each order
-            for order in orders_results:
-                order_id = order['order_id']
-                # Query for products associated with the current order_id
-                sql_products = 'SELECT product_id FROM `wp_wc_order_product_lookup` where order_id=%s ;'
-                cursor.execute(sql_products, (order_id,))
-                results_products = cursor.fetchall() # Fetch products for this order
-
-                products_ids = []
-                # Extract product_ids for the current order
-                for product in results_products:
-                    product_id = product['product_id']
-                    if product_id > 0: # Ensure valid product IDs (e.g., exclude variations if necessary)
-                        products_ids.append(product_id)
-
-                if len(products_ids) > 0:
-                    # Create a temporary DataFrame from the current order's products_ids
-                    # and concatenate it to the main DataFrame.
-                    # This approach can be inefficient for many small concatenations.
-                    df = pd.concat([df, pd.DataFrame([products_ids])], ignore_index=True)
-
-    except mysql.connector.Error as err:
-        logging.error(f"Database error in build_dataframe_associated_products: {err}", exc_info=True)
-        print(f"Database error: {err}. Could not retrieve product associations.")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred in build_dataframe_associated_products: {e}", exc_info=True)
-        print(f"An unexpected error occurred: {e}. Could not retrieve product associations.")
-    finally:
-        # Ensure cursor and connection are closed in all cases
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+    stats = StageStats()
+    baskets = load_baskets_from_db(stats=stats)
+    if baskets is None or baskets.empty:
+        # Keep the historical empty shape (assumes max 10 products per order).
+        return pd.DataFrame(columns=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+
+    with stats.stage('dataframe') as stage:
+        df = baskets.to_dataframe()
+        stage['rows'] = len(df)
+    stats.report("Basket extraction")
     return df
 
 
-def prepare_transactoins(df):
+def prepare_transactoins(df, vocabulary=None):
     """
-    Prepares the DataFrame of associated products into a one-hot encoded
-    transactional DataFrame suitable for association rule mining (e.g., Apriori).
+    Prepares the associated products into a sparse one-hot transaction matrix
+    suitable for association rule mining (e.g., Apriori).
 
     Args:
-        df (pd.DataFrame): A DataFrame where each row is an order and columns
-                           contain product IDs (can have NaNs).
+        df (pd.DataFrame | Baskets): Either the ragged DataFrame where each row is
+                                     an order (columns contain product IDs, can have
+                                     NaNs) or the Baskets from load_baskets_from_db().
+        vocabulary (ProductVocabulary): Optional product ID -> column index mapping
+                                        to reuse; new products are appended to it.
 
     Returns:
-        pd.DataFrame: A one-hot encoded DataFrame where columns are unique
-                      product IDs and rows are transactions (orders).
-                      Values are True if the product was in the order, False otherwise.
-    """
-    # Transpose the DataFrame: rows become columns and columns become rows.
-    # This aligns the data for TransactionEncoder.
-    df = df.T
-    # Apply a lambda function to each column (original order) to drop NaNs
-    # and convert to a list of product IDs.
-    transactions = df.apply(lambda x : x.dropna().tolist())
-    # Convert the pandas Series of lists into a list of lists,
-    # which is the format required by TransactionEncoder.
-    transactions_list = transactions.values.tolist()
-
-    # Import TransactionEncoder from mlxtend for one-hot encoding of transactions
-    from mlxtend.preprocessing import TransactionEncoder
-
-    te = TransactionEncoder()
-    # Fit the TransactionEncoder to learn all unique items (product IDs)
-    te_model = te.fit(transactions_list)
-    # Transform the transactions list into a one-hot encoded numpy array
-    rows = te_model.transform(transactions_list)
-
-    # Convert the numpy array back to a Pandas DataFrame
-    # Columns are named after the unique product IDs found by TransactionEncoder.
-    df_transactions = pd.DataFrame(rows, columns=te_model.columns_)
-    return df_transactions
-
-def generate_association_rules(df_transaction, support, confidence):
-    """
-    Generates association rules from a one-hot encoded transactional DataFrame
-    using the Apriori algorithm.
+        TransactionMatrix: A boolean CSR matrix (rows are orders, columns are the
+                           compact int32 indices of the products) plus the vocabulary
+                           to map columns back to product IDs.
+    """
+    if isinstance(df, pd.DataFrame):
+        # Convert the ragged DataFrame back into baskets (NaNs dropped).
+        df = baskets_from_dataframe(df)
+    return build_transaction_matrix(df, vocabulary=vocabulary)
+
+def generate_association_rules(df_transaction, support, confidence, engine='apriori', max_len=None):
+    """
+    Generates association rules from one-hot encoded transactions
+    using the selected frequent-itemset engine.
 
     Args:
-        df_transaction (pd.DataFrame): One-hot encoded DataFrame of transactions.
+        df_transaction (TransactionMatrix | scipy.sparse matrix | pd.DataFrame):
+            The transactions. A TransactionMatrix is mined in sparse form and its
+            itemsets are mapped back to product IDs; a bare sparse matrix uses the
+            column indices as items; a one-hot DataFrame uses its column names.
         support (float): The minimum support threshold for frequent itemsets (e.g., 0.01).
         confidence (float): The minimum confidence threshold for association rules (e.g., 0.5).
+        engine (str): Frequent-itemset miner: 'apriori' (default), 'fpgrowth' or 'eclat'.
+                      'fpmax' only returns maximal itemsets and cannot produce rules.
+        max_len (int): Optional maximum itemset length.
 
     Returns:
         pd.DataFrame: A DataFrame containing the generated association rules,
                       with columns like 'antecedents', 'consequents', 'confidence', etc.
     """
-    # Import Apriori algorithm for finding frequent itemsets
-    from mlxtend.frequent_patterns import apriori
     # Import association_rules for generating rules from frequent itemsets
     from mlxtend.frequent_patterns import association_rules
 
-    # Find frequent itemsets using the Apriori algorithm
+    if engine in MAXIMAL_ONLY_ENGINES:
+        raise ValueError(f"Engine '{engine}' returns only maximal itemsets; "
+                         "association rules need the support of every subset.")
+
+    # Find frequent itemsets with the selected engine.
     # min_support filters out itemsets that appear less frequently than the threshold.
-    # use_colnames=True means output uses actual item names (product IDs) instead of indices.
-    frequent_itemsets = apriori(df_transaction, min_support=support, use_colnames=True)
+    frequent_itemsets = mine_frequent_itemsets(df_transaction, support, engine=engine, max_len=max_len)
 
     # Generate association rules from the frequent itemsets
     # metric='confidence' uses confidence as the primary metric.
     # min_threshold filters out rules with confidence below the threshold.
-    rules = association_rules(frequent_itemsets, metric='confidence', min_threshold=confidence)
+    n_transactions = getattr(df_transaction, 'n_transactions', df_transaction.shape[0])
+    rules = association_rules(frequent_itemsets, n_transactions, metric='confidence', min_threshold=confidence)
 
     return rules
 
+# Last compiled rules, so repeated predict() calls on the same DataFrame
+# do not recompile the index. The DataFrame is held by a weak reference, so
+# the cache does not keep it alive; the lock guards it across request threads.
+_compiled_rules = {'rules': None, 'index': None}
+_compiled_rules_lock = threading.Lock()
+
+def compile_rules(rules):
+    """
+    Returns the RuleIndex of a rules DataFrame (cached for the last DataFrame seen).
+    """
+    if isinstance(rules, RuleIndex):
+        return rules
+    with _compiled_rules_lock:
+        cached = _compiled_rules['rules']
+        if cached is not None and cached() is rules:
+            return _compiled_rules['index']
+    index = RuleIndex.from_rules(rules)
+    with _compiled_rules_lock:
+        _compiled_rules['rules'] = weakref.ref(rules)
+        _compiled_rules['index'] = index
+    return index
+
 def predict(rules, items, max_results=6):
     """
     Predicts consequent items based on given antecedent items using association rules.
 
     Args:
-        rules (pd.DataFrame): A DataFrame containing association rules.
-                              Expected columns: 'antecedents', 'consequents', 'confidence'.
-                              'antecedents' and 'consequents' columns should contain frozensets.
+        rules (pd.DataFrame | RuleIndex): Association rules, either the DataFrame
+                              (columns 'antecedents', 'consequents', 'confidence' with
+                              frozensets) or a RuleIndex compiled from it. A DataFrame
+                              is compiled once and reused on the next calls.
         items (set): A set of items (antecedents) for which to find predictions.
         max_results (int): The maximum number of top predictions to return,
                            sorted by confidence in descending order.
@@ -242,133 +236,150 @@ def predict(rules, items, max_results=6):
                       sorted by confidence, up to max_results.
                       Returns an empty DataFrame if no rules match.
     """
-    # Ensure 'items' is a frozenset for correct comparison with rule antecedents.
-    # Association rule libraries typically store antecedents/consequents as frozensets.
-    items_frozenset = frozenset(items)
-
-    # Filter rules where the antecedents exactly match the given items.
-    preds = rules[rules['antecedents'] == items_frozenset]
-
-    # Select only the relevant columns: 'consequents' and 'confidence'.
-    preds = preds[['consequents', 'confidence']]
-
-    # Sort the predictions by 'confidence' in descending order.
-    # .sort_values() returns a *new* DataFrame, so re-assign the result.
-    preds = preds.sort_values('confidence', ascending=False)
+    # Exact antecedent match: one dict lookup, consequents already sorted by confidence.
+    return compile_rules(rules).predict(items, max_results=max_results)
+
+# Live table read by the shop and the staging table the export fills before swapping it in.
+ASSOCIATION_TABLE = 'custom_products_association'
+ASSOCIATION_STAGING_TABLE = 'custom_products_association_staging'
+ASSOCIATION_OLD_TABLE = 'custom_products_association_old'
+
+ASSOCIATION_TABLE_SQL = """
+    CREATE TABLE {table} (
+        ID INT(11) NOT NULL AUTO_INCREMENT,
+        product_id_in INT(11) NOT NULL,    -- ID of the antecedent product
+        post_title_in TEXT NOT NULL,       -- Title of the antecedent product
+        product_id_out INT(11) NOT NULL,   -- ID of the consequent product
+        post_title_out TEXT NOT NULL,      -- Title of the consequent product
+        confidence DOUBLE NOT NULL,        -- Confidence of the association rule
+        PRIMARY KEY(ID)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+ASSOCIATION_INSERT_SQL = """
+    INSERT INTO {table}
+    (product_id_in, post_title_in, product_id_out, post_title_out, confidence)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+def best_confidence_pairs(rules: pd.DataFrame, metric='confidence'):
+    """
+    Splits every rule into single (antecedent product, consequent product) pairs
+    and keeps the strongest confidence for each pair.
 
-    # Return the top 'max_results' predictions.
-    return preds.head(max_results)
+    Args:
+        rules (pd.DataFrame): Rules with 'antecedents', 'consequents' (frozensets)
+                              and 'confidence' columns, or a pairwise rule table
+                              ('product_id_in', 'product_id_out', 'confidence').
+        metric (str): Extra rule column to carry over (its best value per pair),
+                      for ranking with pruning.top_k_pairs().
 
-def export_to_db_with_logging(rules: pd.DataFrame):
+    Returns:
+        pd.DataFrame: Columns 'product_id_in', 'product_id_out' and 'confidence'
+                      (as a percentage), plus `metric` when it is not 'confidence',
+                      one row per distinct pair.
+    """
+    extra = [metric] if metric != 'confidence' else []
+    if rules.empty:
+        return pd.DataFrame(columns=['product_id_in', 'product_id_out', 'confidence'] + extra)
+
+    if 'product_id_in' in rules.columns:
+        # Pairwise rules are already one row per distinct pair.
+        pairs = rules[['product_id_in', 'product_id_out']].astype(np.int64)
+        pairs = pairs.assign(confidence=rules['confidence'].to_numpy() * 100)
+        for column in extra:
+            pairs[column] = rules[column].to_numpy()
+        return pairs.reset_index(drop=True)
+
+    pairs = pd.DataFrame({
+        'product_id_in': rules['antecedents'].map(list),
+        'product_id_out': rules['consequents'].map(list),
+        'confidence': rules['confidence'].to_numpy() * 100, # Convert confidence to percentage
+        **{column: rules[column].to_numpy() for column in extra},
+    })
+    pairs = pairs.explode('product_id_in').explode('product_id_out')
+    pairs = pairs.astype({'product_id_in': np.int64, 'product_id_out': np.int64, 'confidence': float})
+    return pairs.groupby(['product_id_in', 'product_id_out'], as_index=False, sort=False)[
+        ['confidence'] + extra].max()
+
+def association_rows(pairs: pd.DataFrame):
+    """
+    Builds the (product_id_in, post_title_in, product_id_out, post_title_out, confidence)
+    tuples for executemany(), resolving every distinct product title once.
     """
-    Exports association rules to a MySQL database table named 'custom_products_association'.
-    The table is dropped and recreated on each run, ensuring a clean export.
-    Includes logic to prevent inserting weaker associations if stronger ones already exist
-    for the same antecedent-consequent pair.
+    product_ids = np.unique(np.concatenate([pairs['product_id_in'].to_numpy(), pairs['product_id_out'].to_numpy()]))
+    titles = get_product_names_from_ids(product_ids.tolist())
+    return [
+        (int(product_in), titles.get(int(product_in), 'Not Found'),
+         int(product_out), titles.get(int(product_out), 'Not Found'), float(confidence))
+        for product_in, product_out, confidence in zip(
+            pairs['product_id_in'], pairs['product_id_out'], pairs['confidence'])
+    ]
+
+def export_to_db_with_logging(rules: pd.DataFrame, pairs: pd.DataFrame = None):
+    """
+    Exports association rules to the MySQL table 'custom_products_association'.
+
+    The strongest confidence per (product_id_in, product_id_out) pair is computed
+    in memory, bulk-inserted with executemany() into a staging table, indexed, and
+    then swapped over the live table with a single atomic RENAME TABLE. Readers
+    always see either the previous rules or the new ones, never an empty table.
 
     Args:
         rules (pd.DataFrame): A DataFrame containing association rules,
                               expected to have 'antecedents', 'consequents', and 'confidence' columns.
                               'antecedents' and 'consequents' should be frozensets of product IDs.
+        pairs (pd.DataFrame): Optional precomputed best_confidence_pairs(rules).
+
+    Returns:
+        bool: True if the export completed, False otherwise.
     """
     connection = None
     cursor = None
+    exported = False
     try:
+        if pairs is None:
+            pairs = best_confidence_pairs(rules)
+        rows = association_rows(pairs)
+
         print("🔌 Connecting to the database...")
         connection, cursor = make_connection_with_db()
 
         if connection is None or cursor is None:
             print("❌ Failed to establish database connection. Aborting export.")
             logging.error("Failed to establish database connection for export.")
-            return
-
-        print("🧹 Dropping existing table if it exists...")
-        cursor.execute("DROP TABLE IF EXISTS custom_products_association")
-        connection.commit() # Commit the DDL (Data Definition Language) statement
-
-        print("🛠️ Creating the table...")
-        create_sql = """
-            CREATE TABLE custom_products_association (
-                ID INT(11) NOT NULL AUTO_INCREMENT,
-                product_id_in INT(11) NOT NULL,    -- ID of the antecedent product
-                post_title_in TEXT NOT NULL,       -- Title of the antecedent product
-                product_id_out INT(11) NOT NULL,   -- ID of the consequent product
-                post_title_out TEXT NOT NULL,      -- Title of the consequent product
-                confidence DOUBLE NOT NULL,        -- Confidence of the association rule
-                PRIMARY KEY(ID)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """
-        cursor.execute(create_sql)
-        connection.commit() # Commit the table creation
-
-        print(f"🚀 Exporting {len(rules)} rules to the database...")
-        # Iterate through DataFrame rows using .iterrows() to get index and row data
-        for index, row_data in rules.iterrows():
-            print(f"📦 Processing rule {index + 1} of {len(rules)}...")
-            # Extract antecedents, consequents (frozensets), and confidence from the row
-            antecedents = row_data['antecedents']
-            consequents = row_data['consequents']
-            confidence = row_data['confidence'] * 100 # Convert confidence to percentage
-
-            # Loop through each antecedent in the frozenset
-            for product_in in antecedents:
-                # Get the product title for the antecedent
-                post_title_in = get_product_name_from_id(product_in)
-                # Loop through each consequent in the frozenset
-                for product_out in consequents:
-                    # Get the product title for the consequent
-                    post_title_out = get_product_name_from_id(product_out)
-
-                    print(f"🔁 Checking association: {product_in} ({post_title_in}) ➡ {product_out} ({post_title_out}) (Confidence: {confidence:.2f}%)")
-
-                    # Delete weaker relationships for the same product_in/product_out pair
-                    delete_sql = """
-                        DELETE FROM custom_products_association
-                        WHERE product_id_in = %s AND product_id_out = %s AND confidence <= %s
-                    """
-                    try:
-                        cursor.execute(delete_sql, (product_in, product_out, confidence))
-                    except Exception as e:
-                        logging.error(f"Error deleting old association for ({product_in}, {product_out}): {e}", exc_info=True)
-                        print(f"❗ Error deleting: {e}")
-
-                    # Check if a stronger or equal association already exists
-                    select_sql = """
-                        SELECT * FROM custom_products_association
-                        WHERE product_id_in = %s AND product_id_out = %s AND confidence >= %s
-                    """
-                    try:
-                        cursor.execute(select_sql, (product_in, product_out, confidence))
-                        results = cursor.fetchall()
-                    except Exception as e:
-                        logging.error(f"Error selecting existing association for ({product_in}, {product_out}): {e}", exc_info=True)
-                        print(f"❗ Error selecting: {e}")
-                        results = [] # Assume no results on error to attempt insert
-
-                    if not results: # If no stronger association exists
-                        # Insert the new or updated association
-                        insert_sql = """
-                            INSERT INTO custom_products_association
-                            (product_id_in, post_title_in, product_id_out, post_title_out, confidence)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """
-                        try:
-                            cursor.execute(insert_sql, (product_in, post_title_in, product_out, post_title_out, confidence))
-                            print("✅ Inserted new association.")
-                        except Exception as e:
-                            logging.error(f"Error inserting new association for ({product_in}, {product_out}): {e}", exc_info=True)
-                            print(f"❗ Error inserting: {e}")
-                    else:
-                        print("⏩ Skipped (stronger association exists).")
-            connection.commit() # Commit changes after processing each rule (or a batch of rules)
+            return exported
+
+        print(f"🛠️ Creating staging table '{ASSOCIATION_STAGING_TABLE}'...")
+        cursor.execute(f"DROP TABLE IF EXISTS {ASSOCIATION_STAGING_TABLE}")
+        cursor.execute(ASSOCIATION_TABLE_SQL.format(table=ASSOCIATION_STAGING_TABLE))
+
+        print(f"🚀 Exporting {len(rows)} product pairs from {len(rules)} rules...")
+        insert_sql = ASSOCIATION_INSERT_SQL.format(table=ASSOCIATION_STAGING_TABLE)
+        for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+            cursor.executemany(insert_sql, rows[start:start + EXPORT_BATCH_SIZE])
+        connection.commit()
+
+        print("🗂️ Building indexes...")
+        cursor.execute(f"ALTER TABLE {ASSOCIATION_STAGING_TABLE} "
+                       "ADD INDEX idx_product_in_confidence (product_id_in, confidence)")
+
+        print("🔁 Swapping the staging table in...")
+        # First run: make sure there is a live table to swap with.
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {ASSOCIATION_TABLE} LIKE {ASSOCIATION_STAGING_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {ASSOCIATION_OLD_TABLE}")
+        cursor.execute(f"RENAME TABLE {ASSOCIATION_TABLE} TO {ASSOCIATION_OLD_TABLE}, "
+                       f"{ASSOCIATION_STAGING_TABLE} TO {ASSOCIATION_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {ASSOCIATION_OLD_TABLE}")
 
         print("✅ Export completed successfully.")
+        exported = True
 
     except Exception as e:
         logging.error("An error occurred during export_to_db_with_logging", exc_info=True)
         if connection:
-            connection.rollback() # Rollback all changes if an error occurs
-        print("❌ An error occurred. Check 'export_errors.log' for details. Changes rolled back.")
+            connection.rollback() # The live table is untouched until the RENAME succeeds
+        print("❌ An error occurred. Check 'export_errors.log' for details. Live rules left unchanged.")
 
     finally:
         # Ensure cursor and connection are always closed
@@ -377,95 +388,521 @@ def export_to_db_with_logging(rules: pd.DataFrame):
         if connection:
             connection.close()
         print("🔒 Connection closed.")
+    return exported
 
-def start_generate_association():
+def export_changed_rules(rules: pd.DataFrame, product_ids, pairs: pd.DataFrame = None):
+    """
+    Replaces the rows of 'custom_products_association' whose antecedent is one
+    of `product_ids` with the given rules, in a single transaction.
+    Rows of other antecedents are left untouched.
+
+    Args:
+        rules (pd.DataFrame): Rules with 'antecedents'/'consequents' frozensets
+                              and a 'confidence' column.
+        product_ids (list): Antecedent product IDs whose rules are being replaced.
+        pairs (pd.DataFrame): Optional precomputed (e.g. top-k pruned) best_confidence_pairs(rules).
+
+    Returns:
+        bool: True if the rows were replaced, False otherwise.
+    """
+    connection = None
+    cursor = None
+    exported = False
+    product_ids = [int(product_id) for product_id in product_ids]
+    try:
+        if pairs is None:
+            pairs = best_confidence_pairs(rules)
+        rows = association_rows(pairs)
+
+        connection, cursor = make_connection_with_db()
+        if connection is None or cursor is None:
+            logging.error("Failed to establish database connection for incremental export.")
+            return exported
+
+        delete_sql = f"DELETE FROM {ASSOCIATION_TABLE} WHERE product_id_in IN ({{}})"
+        for start in range(0, len(product_ids), EXPORT_BATCH_SIZE):
+            chunk = product_ids[start:start + EXPORT_BATCH_SIZE]
+            cursor.execute(delete_sql.format(', '.join(['%s'] * len(chunk))), chunk)
+
+        insert_sql = ASSOCIATION_INSERT_SQL.format(table=ASSOCIATION_TABLE)
+        for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+            cursor.executemany(insert_sql, rows[start:start + EXPORT_BATCH_SIZE])
+        connection.commit()
+        print(f"✅ Replaced the rules of {len(product_ids)} products ({len(rows)} rows).")
+        exported = True
+
+    except Exception as e:
+        logging.error("An error occurred during export_changed_rules", exc_info=True)
+        if connection:
+            connection.rollback()
+        print("❌ An error occurred. Check 'export_errors.log' for details. Changes rolled back.")
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+    return exported
+
+def load_baskets_fingerprint():
+    """
+    Returns the summary row of the basket query (see baskets.BASKET_FINGERPRINT_SQL),
+    or None if it could not be read.
+    """
+    connection = None
+    cursor = None
+    try:
+        connection, cursor = make_connection_with_db()
+        if connection is None or cursor is None:
+            return None
+        return fetch_baskets_fingerprint(connection)
+    except mysql.connector.Error as err:
+        logging.error(f"Database error in load_baskets_fingerprint: {err}", exc_info=True)
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+def mine_rules(transactions_df, min_support, min_confidence, stats, engine=DEFAULT_ITEMSET_ENGINE, pairwise=True,
+               max_len=None, memory_budget_mb=None, time_budget_seconds=None, workers=DEFAULT_WORKERS,
+               approximate=False, support_error=None, seed=None, partition_by_category=False,
+               cross_min_support=None):
+    """
+    The mining stage of start_generate_association (see its arguments).
+
+    Returns:
+        pd.DataFrame: The rules (mlxtend frozenset layout, or a pair table in pairwise mode).
+    """
+    if approximate:
+        if support_error is None:
+            support_error = default_support_error(min_support)
+        print(f"3. Generating approximate rules with min_support={min_support}, min_confidence={min_confidence} "
+              f"and support_error={support_error}...")
+        with stats.stage('approximate') as stage:
+            result = approximate_rules(transactions_df, min_support, min_confidence, epsilon=support_error, seed=seed,
+                                       max_len=2 if pairwise and max_len is None else max_len, workers=workers)
+            stage['rows'] = len(result.rules)
+        result.report()
+        return result.rules
+
+    if pairwise:
+        print(f"3. Generating pairwise rules with min_support={min_support} and min_confidence={min_confidence}...")
+        with stats.stage('pairwise') as stage:
+            rules = pairwise_rules(transactions_df, min_support, min_confidence, workers=workers)
+            stage['rows'] = len(rules)
+        return rules
+
+    if memory_budget_mb is not None or time_budget_seconds is not None:
+        budget = MiningBudget()
+        if memory_budget_mb is not None:
+            budget.max_memory_mb = memory_budget_mb
+        if time_budget_seconds is not None:
+            budget.max_seconds = time_budget_seconds
+        with stats.stage('plan') as stage:
+            plan = plan_mining(transactions_df, min_support, max_len=max_len, budget=budget, engine=engine)
+            stage['rows'] = plan.estimated_itemsets
+        plan.report("Mining budget")
+        min_support, max_len = plan.min_support, plan.max_len
+    if partition_by_category:
+        from mlxtend.frequent_patterns import association_rules
+
+        print(f"3. Generating association rules per category partition with min_support={min_support}, "
+              f"cross_min_support={cross_min_support or min_support} and min_confidence={min_confidence} "
+              f"(engine={engine}, max_len={max_len}, workers={workers})...")
+        with stats.stage('categories') as stage:
+            categories = catalog_cache.get_product_categories(transactions_df.vocabulary.product_ids.tolist())
+            stage['rows'] = len(categories)
+        with stats.stage('mine') as stage:
+            frequent_itemsets = partitioned_frequent_itemsets(
+                transactions_df, min_support, categories, max_len=max_len, engine=engine, workers=workers,
+                cross_min_support=cross_min_support)
+            rules = association_rules(frequent_itemsets, transactions_df.n_transactions, metric='confidence',
+                                      min_threshold=min_confidence)
+            stage['rows'] = len(rules)
+        return rules
+
+    print(f"3. Generating association rules with min_support={min_support} and min_confidence={min_confidence} "
+          f"(engine={engine}, max_len={max_len})...")
+    with stats.stage('mine') as stage:
+        rules = generate_association_rules(transactions_df, min_support, min_confidence, engine=engine, max_len=max_len)
+        stage['rows'] = len(rules)
+    return rules
+
+def start_generate_association(engine=DEFAULT_ITEMSET_ENGINE, pairwise=True, max_len=None,
+                               memory_budget_mb=None, time_budget_seconds=None, workers=DEFAULT_WORKERS,
+                               approximate=False, support_error=None, seed=None,
+                               checkpoint_dir=DEFAULT_CHECKPOINT_DIR, from_stage=None, half_life_days=None,
+                               top_k=DEFAULT_TOP_K, top_k_metric='confidence', partition_by_category=False,
+                               cross_min_support=None, stats=None):
     """
     Orchestrates the entire process of building transactions, generating
     association rules, and exporting them to the database.
+
+    Every stage output is checkpointed in `checkpoint_dir`, keyed by a content
+    hash of its inputs: the baskets by a fingerprint of the order tables, the
+    transactions by the baskets, the rules by the transactions and the mining
+    parameters. A rerun reuses the checkpoints whose inputs did not change, so
+    e.g. a failed export is retried without querying or mining again.
+
+    Args:
+        engine (str): Frequent-itemset miner to use (see itemset_engines.FREQUENT_ITEMSET_ENGINES)
+                      when `pairwise` is False.
+        pairwise (bool): Compute the 1 -> 1 rules directly from sparse co-occurrence
+                         counts (the export only stores single-product pairs). Set to
+                         False to mine full itemsets; their multi-item rules are then
+                         split into pairs at export time.
+        max_len (int): Optional maximum itemset length for itemset mining.
+        memory_budget_mb (float): Optional memory budget for itemset mining. With a
+                                  budget (memory and/or time), min_support and max_len
+                                  are raised/capped from a sample estimate so the run
+                                  fits it (see budget.plan_mining).
+        time_budget_seconds (float): Optional time budget for itemset mining.
+        workers (int): Processes that count the pairwise supports over row shards
+                       (1 = in this process). The counts are identical either way.
+        approximate (bool): Mine a reservoir sample sized for `support_error` and
+                            verify the candidates with one counting pass over all
+                            orders (see approximate.approximate_rules). With
+                            `pairwise`, itemsets are limited to pairs.
+        support_error (float): Target support error of the approximate sample; below
+                               min_support (default: a quarter of it, see
+                               approximate.default_support_error).
+        seed (int): Sampling seed of the approximate mode (random and reported when None).
+        checkpoint_dir (str): Checkpoint directory; None disables checkpoints.
+        from_stage (str): Resume from this stage (one of checkpoints.PIPELINE_STAGES):
+                          the earlier stages are loaded from their latest checkpoint
+                          without checking the database, this stage and the later
+                          ones are recomputed.
+        half_life_days (float): Weight every order by its age so that an order
+                                this many days older than the newest one counts
+                                half (see decay.decay_weights). Pairwise and
+                                exact-count modes only: the itemset engines and
+                                the approximate sampler count whole orders.
+        top_k (int): Keep only the `top_k` best consequents of every product
+                     before the export (None keeps every rule). The rules
+                     checkpoint is not pruned, so changing it does not re-mine.
+        top_k_metric (str): Rule metric the top-k ranks by (see pruning.TOP_K_METRICS).
+        partition_by_category (bool): Itemset mining only: mine the products of
+                                      every group of 'product_cat' categories
+                                      separately, in parallel, then recover the
+                                      cross-partition itemsets in one pass (see
+                                      partitioned.partitioned_frequent_itemsets).
+        cross_min_support (float): Support threshold of that cross pass; the
+                                   rules equal a global run when it is min_support
+                                   (the default).
+        stats (StageStats): Optional collector for the stage timings (e.g. one
+                            reporting job progress).
+
+    Returns:
+        dict: Rules mined and product pairs exported.
+
+    Raises:
+        RuntimeError: If the orders could not be loaded, nothing could be mined
+                      from them, or the export failed (the live rules are then unchanged).
     """
     min_support = 0.001    # Minimum support threshold for frequent itemsets
     min_confidence = 0.001 # Minimum confidence threshold for association rules
 
+    if from_stage is not None and from_stage not in PIPELINE_STAGES:
+        raise ValueError(f"from_stage must be one of {PIPELINE_STAGES}")
+    if from_stage is not None and checkpoint_dir is None:
+        raise ValueError("from_stage needs checkpoints (checkpoint_dir is None).")
+    if top_k_metric not in TOP_K_METRICS:
+        raise ValueError(f"top_k_metric must be one of {TOP_K_METRICS}")
+    if partition_by_category and (pairwise or approximate):
+        raise ValueError("partition_by_category needs itemset mining (pairwise=False, approximate=False).")
+    if half_life_days and (approximate or not pairwise):
+        raise ValueError("half_life_days is only supported for pairwise, non-approximate rules.")
+    if approximate and support_error is not None and not 0 < support_error < min_support:
+        raise ValueError(f"support_error must be between 0 and min_support ({min_support}).")
+    store = CheckpointStore(checkpoint_dir) if checkpoint_dir else None
+
+    def resumed(stage):
+        # Stages before from_stage come from their latest checkpoint.
+        return from_stage is not None and PIPELINE_STAGES.index(stage) < PIPELINE_STAGES.index(from_stage)
+
+    # Without from_stage, any stage whose key matches a checkpoint is skipped.
+    reuse = store is not None and from_stage is None
+
     print("\n--- Starting Association Rule Generation ---")
-    print("1. Building DataFrame of associated products...")
-    df = build_dataframe_associated_products()
-    if df.empty:
-        print("No associated products data found. Aborting rule generation.")
-        return
-
-    print("2. Preparing transactions for mining...")
-    transactions_df = prepare_transactoins(df)
-    if transactions_df.empty:
-        print("No transactions prepared. Aborting rule generation.")
-        return
-
-    print(f"3. Generating association rules with min_support={min_support} and min_confidence={min_confidence}...")
-    rules = generate_association_rules(transactions_df, min_support, min_confidence)
+    stats = stats if stats is not None else StageStats()
+    baskets = transactions_df = rules = None
+    transactions_key = None
+
+    if resumed('rules'):
+        rules = store.load_frame('rules')
+        if rules is None:
+            raise RuntimeError("No rules checkpoint to resume from.")
+        print(f"Resuming with the rules checkpoint {store.latest_key('rules')} ({len(rules)} rules).")
+    elif resumed('transactions'):
+        transactions_key = store.latest_key('transactions')
+        transactions_df = store.load_transactions(transactions_key)
+        if transactions_df is None:
+            raise RuntimeError("No transactions checkpoint to resume from.")
+        print(f"Resuming with the transactions checkpoint {transactions_key}.")
+    elif resumed('baskets'):
+        baskets = store.load_baskets()
+        if baskets is None:
+            raise RuntimeError("No baskets checkpoint to resume from.")
+        print(f"Resuming with the baskets checkpoint {store.latest_key('baskets')}.")
+
+    if rules is None and transactions_df is None:
+        if baskets is None:
+            print("1. Loading order baskets...")
+            fingerprint = load_baskets_fingerprint() if reuse else None
+            baskets_key = content_hash('baskets', fingerprint, bool(half_life_days)) if fingerprint is not None else None
+            if baskets_key is not None:
+                baskets = store.load_baskets(baskets_key)
+                if baskets is not None:
+                    print(f"   Orders unchanged; reusing the baskets checkpoint {baskets_key}.")
+            if baskets is None:
+                baskets = load_baskets_from_db(stats=stats, with_dates=bool(half_life_days))
+                if baskets is None:
+                    raise RuntimeError("Could not load the order baskets from the database.")
+                if store is not None and not baskets.empty:
+                    store.save_baskets(baskets_key or content_hash('baskets', baskets.order_ids, baskets.indptr,
+                                                                   baskets.product_ids, bool(half_life_days)), baskets)
+        if baskets.empty:
+            raise RuntimeError("No associated products data found. Aborting rule generation.")
+
+        print("2. Preparing transactions for mining...")
+        transactions_key = content_hash('transactions', baskets.order_ids, baskets.indptr, baskets.product_ids,
+                                        half_life_days)
+        if half_life_days and baskets.order_times is None:
+            raise RuntimeError("The baskets checkpoint has no order dates; rerun from the 'baskets' stage.")
+        if reuse:
+            transactions_df = store.load_transactions(transactions_key)
+        if transactions_df is not None:
+            print(f"   Reusing the transactions checkpoint {transactions_key}.")
+        else:
+            with stats.stage('encode') as stage:
+                transactions_df = prepare_transactoins(baskets)
+                if half_life_days:
+                    # Relative to the newest order, which keeps weight 1.
+                    transactions_df.weights = decay_weights(baskets.order_times, half_life_days,
+                                                            landmark=float(baskets.order_times.max()))
+                stage['rows'] = transactions_df.matrix.nnz
+            if transactions_df.empty:
+                raise RuntimeError("No transactions prepared. Aborting rule generation.")
+            if pairwise or approximate or engine not in UNWEIGHTED_ENGINES:
+                with stats.stage('compact') as stage:
+                    # Identical baskets become one weighted row that the counters weigh.
+                    transactions_df = compact_transactions(transactions_df)
+                    stage['rows'] = transactions_df.shape[0]
+            else:
+                print(f"   Skipping basket compaction: engine '{engine}' has no row weights.")
+            if store is not None:
+                store.save_transactions(transactions_key, transactions_df)
+        stats.report("Transaction preparation")
+
+    if rules is None:
+        mining = dict(min_support=min_support, min_confidence=min_confidence, engine=engine, pairwise=pairwise,
+                      max_len=max_len, memory_budget_mb=memory_budget_mb, time_budget_seconds=time_budget_seconds,
+                      approximate=approximate, support_error=support_error, seed=seed,
+                      partition_by_category=partition_by_category, cross_min_support=cross_min_support)
+        rules_key = content_hash('rules', transactions_key, mining, half_life_days)
+        if reuse:
+            rules = store.load_frame('rules', rules_key)
+        if rules is not None:
+            print(f"3. Reusing the rules checkpoint {rules_key} ({len(rules)} rules).")
+        else:
+            rules = mine_rules(transactions_df, stats=stats, workers=workers, **mining)
+            if store is not None:
+                store.save_frame('rules', rules_key, rules)
     if rules.empty:
-        print("No association rules generated. Aborting export.")
-        return
+        raise RuntimeError("No association rules generated. Aborting export.")
     print(f"Found {len(rules)} association rules.")
 
     print("4. Exporting rules to database...")
-    export_to_db_with_logging(rules)
+    with stats.stage('prune') as stage:
+        pairs = top_k_pairs(best_confidence_pairs(rules, metric=top_k_metric), k=top_k, metric=top_k_metric)
+        stage['rows'] = len(pairs)
+    if top_k is not None:
+        print(f"   Kept the top {top_k} consequents by {top_k_metric}: {len(pairs)} product pairs.")
+    with stats.stage('export') as stage:
+        exported = export_to_db_with_logging(rules, pairs=pairs)
+        stage['rows'] = len(pairs)
+    if not exported:
+        stats.report("Association rule generation")
+        if store is not None:
+            raise RuntimeError("Export failed; rerun with from_stage='export' to retry from the rules checkpoint.")
+        raise RuntimeError("Export failed; the live rules are unchanged.")
+    print("5. Publishing the recommendation index...")
+    publish_index(RecommendationIndex.from_frame(pairs))
+    stats.report("Association rule generation")
     print("--- Association Rule Generation Completed ---")
+    return {'rules': len(rules), 'pairs': len(pairs)}
+
+def start_incremental_association(state_path=DEFAULT_STATE_PATH, workers=DEFAULT_WORKERS, half_life_days=None,
+                                  top_k=DEFAULT_TOP_K, top_k_metric='confidence', stats=None):
+    """
+    Refreshes the 1 -> 1 association rules using only the orders placed since
+    the last run. Item and pair counts are kept in `state_path` together with
+    the last processed order_id; only the rules of products whose counts changed
+    are regenerated and re-exported.
+
+    The first run (no state file yet) counts every order and does a full export.
+    Its counting is sharded over `workers` processes.
+
+    With `half_life_days`, the counts are time-decayed (see
+    incremental.AssociationCounts): new orders are added with a weight relative
+    to a fixed landmark, so a refresh still only touches the new orders. The
+    half-life is fixed when the state file is created.
+
+    Every regenerated product keeps its `top_k` best consequents by
+    `top_k_metric`, as in start_generate_association. `stats` optionally
+    collects the stage timings.
+
+    Ranked by confidence (the default), only the changed products are
+    rewritten: the confidences of the other products are exact, since their
+    counts did not move, but their pairs passed min_support against the order
+    count of the run that last touched them. Lift and support also depend on
+    the total order count and the consequents' counts, so ranking by them
+    regenerates and re-exports the rules of every product.
+
+    Returns:
+        dict: New orders folded in and products whose rules were rewritten
+              (both 0 when there were no new orders).
+
+    Raises:
+        RuntimeError: If the orders could not be loaded or the export failed
+                      (the watermark is then not advanced).
+    """
+    min_support = 0.001    # Minimum support threshold for product pairs
+    min_confidence = 0.001 # Minimum confidence threshold for association rules
+
+    print("\n--- Starting Incremental Association Rule Refresh ---")
+    stats = stats if stats is not None else StageStats()
+    counts = AssociationCounts.load(state_path)
+    first_run = counts.empty
+    if first_run and half_life_days:
+        counts = AssociationCounts(half_life_days=half_life_days)
+    elif (counts.half_life_days or None) != (half_life_days or None):
+        raise RuntimeError(f"The counts in {state_path} use half_life_days={counts.half_life_days}, "
+                           f"not {half_life_days}; delete the state file to rebuild them with the new setting.")
+    print(f"1. Loading orders after order_id={counts.last_order_id}...")
+    baskets = load_baskets_from_db(stats=stats, after_order_id=counts.last_order_id,
+                                   with_dates=bool(half_life_days))
+    if baskets is None:
+        raise RuntimeError("Could not load the new order baskets from the database.")
+    if baskets.empty:
+        print("No new orders since the last run. Nothing to refresh.")
+        return {'orders': 0, 'products': 0}
+
+    print("2. Folding the new orders into the item and pair counts...")
+    with stats.stage('count') as stage:
+        transactions = prepare_transactoins(baskets, vocabulary=counts.vocabulary)
+        if half_life_days:
+            transactions.weights = counts.order_weights(baskets.order_times)
+        transactions = compact_transactions(transactions)
+        changed = counts.fold_in(transactions, workers=workers)
+        stage['rows'] = len(changed)
+
+    rewrite_all = first_run or top_k_metric != 'confidence'
+    if rewrite_all:
+        print("3. Regenerating rules for all products...")
+    else:
+        print(f"3. Regenerating rules for {len(changed)} changed products...")
+    with stats.stage('rules') as stage:
+        rules = counts.pair_rules(min_support, min_confidence, antecedents=None if rewrite_all else changed)
+        pairs = top_k_pairs(best_confidence_pairs(rules, metric=top_k_metric), k=top_k, metric=top_k_metric)
+        stage['rows'] = len(pairs)
 
-def get_recommandation_products_ids(product_id):
+    print("4. Exporting rules to database...")
+    with stats.stage('export') as stage:
+        if rewrite_all:
+            exported = export_to_db_with_logging(rules, pairs=pairs)
+        else:
+            exported = export_changed_rules(rules, counts.vocabulary.decode(changed), pairs=pairs)
+        stage['rows'] = len(pairs)
+    stats.report("Incremental refresh")
+
+    # Only move the watermark once the rules are in the database, so a
+    # failed export is retried with the same orders on the next run.
+    if not exported:
+        raise RuntimeError("Export failed; the watermark was not advanced.")
+    counts.save(state_path)
+    # The table now merges old and new rows; rebuild the index from it.
+    reload_index(from_db=True)
+    print(f"--- Incremental refresh completed (watermark order_id={counts.last_order_id}) ---")
+    return {'orders': len(baskets), 'products': len(counts.vocabulary) if rewrite_all else len(changed)}
+
+def get_recommandation_products_ids(product_id, max_results=None):
     """
-    Retrieves recommended products for a given product ID from the
-    'custom_products_association' table in the database.
+    Retrieves recommended products for a given product ID.
+
+    Served from the in-process RecommendationIndex (loaded once from the
+    snapshot file or the 'custom_products_association' table and swapped
+    atomically when an association job finishes); titles come from the
+    shared product catalog cache, so the hot path does not reach MySQL.
 
     Args:
         product_id (int): The ID of the product for which to get recommendations.
+        max_results (int): Optional maximum number of recommendations.
 
     Returns:
         pd.DataFrame: A DataFrame of recommended products with their ID, title,
                       and confidence, sorted by confidence in descending order.
                       Returns an empty DataFrame if no recommendations or an error occurs.
     """
-    connection = None
-    cursor = None
     # Initialize an empty DataFrame to store recommendations
     products_recommandations = pd.DataFrame(columns=['product_id', 'post_title', 'confidence'])
 
     try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            print("Database connection failed for get_recommandation_products_ids.")
-            return products_recommandations
-
-        # SQL query to select associations where product_id_in matches the given product_id,
-        # ordered by confidence in descending order.
-        sql = """
-            SELECT product_id_out, post_title_out, confidence
-            FROM custom_products_association
-            WHERE product_id_in = %s
-            ORDER BY confidence DESC;
-        """
-        params = (product_id,) # Parameter as a tuple
-        cursor.execute(sql, params)
-        results = cursor.fetchall() # Fetch all matching recommendations
-
-        if results:
-            # Efficiently create DataFrame from list of dictionaries
-            products_recommandations = pd.DataFrame(results)
-            # Rename columns to match expected output names
-            products_recommandations.rename(columns={
-                'product_id_out': 'product_id',
-                'post_title_out': 'post_title'
-            }, inplace=True)
-
-    except mysql.connector.Error as err:
-        logging.error(f"Database error in get_recommandation_products_ids for ID {product_id}: {err}", exc_info=True)
-        print(f"Database error: {err}. Could not retrieve recommendations for ID: {product_id}")
+        consequent_ids, confidences = get_live_index().lookup(product_id, k=max_results)
+        if len(consequent_ids):
+            titles = catalog_cache.get_product_titles(consequent_ids.tolist())
+            products_recommandations = pd.DataFrame({
+                'product_id': consequent_ids,
+                'post_title': [titles.get(int(i), 'Not Found') for i in consequent_ids],
+                'confidence': confidences.astype(float),
+            })
     except Exception as e:
         logging.error(f"An unexpected error occurred in get_recommandation_products_ids for ID {product_id}: {e}", exc_info=True)
         print(f"An unexpected error occurred: {e}. Could not retrieve recommendations for ID: {product_id}")
-    finally:
-        # Ensure cursor and connection are closed
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
 
-    return products_recommandations
\ No newline at end of file
+    return products_recommandations
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate and export the product association rules.")
+    parser.add_argument('--from-stage', choices=PIPELINE_STAGES,
+                        help="Resume from this stage using the latest checkpoints of the earlier ones.")
+    parser.add_argument('--engine', default=DEFAULT_ITEMSET_ENGINE, help="Itemset engine (with --itemsets).")
+    parser.add_argument('--itemsets', action='store_true', help="Mine full itemsets instead of pairwise rules.")
+    parser.add_argument('--max-len', type=int, default=None)
+    parser.add_argument('--approximate', action='store_true', help="Mine a sample of the orders.")
+    parser.add_argument('--seed', type=int, default=None, help="Sampling seed of --approximate.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument('--no-checkpoints', action='store_true')
+    parser.add_argument('--partition-by-category', action='store_true',
+                        help="With --itemsets: mine category partitions in parallel plus a cross-partition pass.")
+    parser.add_argument('--cross-min-support', type=float, default=None)
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+                        help="Consequents kept per product (0 keeps every rule).")
+    parser.add_argument('--top-k-metric', choices=TOP_K_METRICS, default='confidence')
+    parser.add_argument('--half-life-days', type=float, default=None,
+                        help="Time-decay the supports with this half-life (pairwise rules only).")
+    args = parser.parse_args()
+
+    try:
+        start_generate_association(
+            engine=args.engine,
+            pairwise=not args.itemsets,
+            max_len=args.max_len,
+            workers=args.workers,
+            approximate=args.approximate,
+            seed=args.seed,
+            checkpoint_dir=None if args.no_checkpoints else args.checkpoint_dir,
+            from_stage=args.from_stage,
+            half_life_days=args.half_life_days,
+            top_k=args.top_k or None,
+            top_k_metric=args.top_k_metric,
+            partition_by_category=args.partition_by_category,
+            cross_min_support=args.cross_min_support,
+        )
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,214 @@
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from api.association.stage_stats import StageStats
+
+# One query for every (order_id, product_id) pair, already ordered so that the
+# rows of an order are contiguous. The JOIN keeps the old behaviour of only
+# looking at orders that exist in wp_wc_order_stats, and product_id > 0 drops
+# the same rows the per-order loop used to skip.
+BASKET_PAIRS_SQL = """
+    SELECT lookup.order_id, lookup.product_id
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0
+    ORDER BY lookup.order_id, lookup.order_item_id
+"""
+
+# Same rows, restricted to orders after a watermark (incremental refresh).
+NEW_BASKET_PAIRS_SQL = """
+    SELECT lookup.order_id, lookup.product_id
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0 AND lookup.order_id > %s
+    ORDER BY lookup.order_id, lookup.order_item_id
+"""
+
+# Same rows with the order date (seconds since the epoch, GMT) as a third
+# column, for time-decayed counting.
+DATED_BASKET_PAIRS_SQL = """
+    SELECT lookup.order_id, lookup.product_id, UNIX_TIMESTAMP(stats.date_created_gmt)
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0
+    ORDER BY lookup.order_id, lookup.order_item_id
+"""
+
+NEW_DATED_BASKET_PAIRS_SQL = """
+    SELECT lookup.order_id, lookup.product_id, UNIX_TIMESTAMP(stats.date_created_gmt)
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0 AND lookup.order_id > %s
+    ORDER BY lookup.order_id, lookup.order_item_id
+"""
+
+# Cheap summary of the rows BASKET_PAIRS_SQL would return; it changes when
+# orders or order lines are added, removed or edited.
+BASKET_FINGERPRINT_SQL = """
+    SELECT COUNT(*), COALESCE(MAX(lookup.order_id), 0), COALESCE(SUM(lookup.order_id), 0),
+           COALESCE(SUM(lookup.product_id), 0), COALESCE(SUM(lookup.order_item_id), 0)
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0
+"""
+
+DEFAULT_FETCH_SIZE = 50000
+
+
+@dataclass
+class Baskets:
+    """
+    Orders grouped into baskets, stored CSR style:
+    the products of basket `i` are `product_ids[indptr[i]:indptr[i + 1]]`.
+    `order_times` (seconds since the epoch) is only loaded for time decay.
+    """
+    order_ids: np.ndarray
+    indptr: np.ndarray
+    product_ids: np.ndarray
+    order_times: np.ndarray = None
+
+    def __len__(self):
+        return len(self.order_ids)
+
+    @property
+    def empty(self):
+        return len(self.order_ids) == 0
+
+    def basket(self, i):
+        return self.product_ids[self.indptr[i]:self.indptr[i + 1]]
+
+    def to_lists(self):
+        """
+        Returns the baskets as a list of lists of product IDs.
+        """
+        return [chunk.tolist() for chunk in np.split(self.product_ids, self.indptr[1:-1])] if len(self) else []
+
+    def to_dataframe(self, min_columns=10):
+        """
+        Returns the ragged "one row per order" DataFrame that
+        build_dataframe_associated_products has always produced:
+        columns 0, 1, 2, ... hold the product IDs and short orders are NaN padded.
+        """
+        df = pd.DataFrame(self.to_lists())
+        width = max(min_columns, df.shape[1])
+        return df.reindex(columns=range(width))
+
+
+def empty_baskets():
+    return Baskets(
+        order_ids=np.empty(0, dtype=np.int64),
+        indptr=np.zeros(1, dtype=np.int64),
+        product_ids=np.empty(0, dtype=np.int64),
+    )
+
+
+def fetch_order_product_pairs(connection, sql=BASKET_PAIRS_SQL, params=None, fetch_size=DEFAULT_FETCH_SIZE,
+                              n_columns=2):
+    """
+    Streams (order_id, product_id[, order time]) rows from the database with an
+    unbuffered cursor and fetchmany(), so the full result set never sits in
+    Python tuples.
+
+    Returns:
+        tuple: One int64 numpy array per column (order_ids, product_ids, ...), in query order.
+    """
+    cursor = connection.cursor(buffered=False)
+    chunks = []
+    try:
+        cursor.execute(sql, params or ())
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunks.append(np.asarray(rows, dtype=np.int64).reshape(-1, n_columns))
+    finally:
+        cursor.close()
+
+    if not chunks:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(n_columns))
+    values = np.concatenate(chunks)
+    return tuple(values[:, column] for column in range(n_columns))
+
+
+def fetch_baskets_fingerprint(connection):
+    """
+    Returns:
+        list: The BASKET_FINGERPRINT_SQL row as ints (used as a checkpoint key).
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(BASKET_FINGERPRINT_SQL)
+        return [int(value) for value in cursor.fetchone()]
+    finally:
+        cursor.close()
+
+
+def group_baskets(order_ids, product_ids, order_times=None):
+    """
+    Groups (order_id, product_id) pairs into baskets in one vectorized step.
+    The input must already be ordered by order_id (as BASKET_PAIRS_SQL is).
+
+    Args:
+        order_times (np.ndarray): Optional order time of every pair (one value per order).
+
+    Returns:
+        Baskets: one basket per distinct order_id.
+    """
+    order_ids = np.asarray(order_ids, dtype=np.int64)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    if len(order_ids) == 0:
+        baskets = empty_baskets()
+        if order_times is not None:
+            baskets.order_times = np.empty(0, dtype=np.int64)
+        return baskets
+
+    if np.any(order_ids[1:] < order_ids[:-1]):
+        # Not ordered (e.g. pairs coming from somewhere else): a stable sort keeps
+        # the product order inside each order.
+        order = np.argsort(order_ids, kind='stable')
+        order_ids = order_ids[order]
+        product_ids = product_ids[order]
+        if order_times is not None:
+            order_times = np.asarray(order_times)[order]
+
+    starts = np.flatnonzero(np.r_[True, order_ids[1:] != order_ids[:-1]])
+    indptr = np.append(starts, len(order_ids)).astype(np.int64)
+    return Baskets(order_ids=order_ids[starts], indptr=indptr, product_ids=product_ids,
+                   order_times=np.asarray(order_times, dtype=np.int64)[starts] if order_times is not None else None)
+
+
+def load_order_baskets(connection, fetch_size=DEFAULT_FETCH_SIZE, stats=None, after_order_id=None, with_dates=False):
+    """
+    Loads every order basket with a single streamed query.
+
+    Args:
+        connection: An open MySQL connection.
+        fetch_size (int): Rows per fetchmany() call.
+        stats (StageStats): Optional collector for row counts and timings.
+        after_order_id (int): Only load orders with a greater order_id (watermark).
+        with_dates (bool): Also load the order dates into Baskets.order_times.
+
+    Returns:
+        Baskets: The baskets, ordered by order_id.
+    """
+    stats = stats if stats is not None else StageStats()
+
+    with stats.stage('query') as stage:
+        if after_order_id is None:
+            sql, params = (DATED_BASKET_PAIRS_SQL if with_dates else BASKET_PAIRS_SQL), None
+        else:
+            sql, params = (NEW_DATED_BASKET_PAIRS_SQL if with_dates else NEW_BASKET_PAIRS_SQL), (int(after_order_id),)
+        columns = fetch_order_product_pairs(connection, sql=sql, params=params, fetch_size=fetch_size,
+                                            n_columns=3 if with_dates else 2)
+        order_ids, product_ids = columns[0], columns[1]
+        stage['rows'] = len(order_ids)
+
+    with stats.stage('group') as stage:
+        baskets = group_baskets(order_ids, product_ids, order_times=columns[2] if with_dates else None)
+        stage['rows'] = len(baskets)
+
+    logging.info(f"Loaded {len(order_ids)} order/product rows into {len(baskets)} baskets.")
+    return baskets
@@ -0,0 +1,100 @@
+"""
+Compares the frequent-itemset engines on synthetic basket data.
+
+Each engine runs in its own process so the reported peak RSS belongs to that
+engine alone. Run from the `server` directory:
+
+    python -m api.association.benchmark_engines --orders 200000 --products 5000 --min-support 0.001
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+import numpy as np
+
+from api.association.baskets import group_baskets
+from api.association.itemset_engines import FREQUENT_ITEMSET_ENGINES, mine_frequent_itemsets
+from api.association.transactions import build_transaction_matrix
+
+
+def synthetic_baskets(n_orders, n_products, mean_basket_size=2.5, n_bundles=50, seed=42):
+    """
+    Generates baskets with Zipf-like product popularity plus a set of small
+    bundles that are often bought together, so there are itemsets to find.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = np.maximum(1, rng.poisson(mean_basket_size - 1, n_orders) + 1)
+    popularity = 1.0 / np.arange(1, n_products + 1) ** 1.1
+    popularity /= popularity.sum()
+    product_ids = rng.choice(n_products, size=int(sizes.sum()), p=popularity) + 1
+    order_ids = np.repeat(np.arange(1, n_orders + 1), sizes)
+
+    bundles = rng.choice(n_products, size=(n_bundles, 3), replace=True) + 1
+    bundle_orders = rng.choice(n_orders, size=n_orders // 10, replace=False) + 1
+    bundle_items = bundles[rng.integers(0, n_bundles, len(bundle_orders))]
+    order_ids = np.concatenate([order_ids, np.repeat(bundle_orders, 3)])
+    product_ids = np.concatenate([product_ids, bundle_items.ravel()])
+    return group_baskets(order_ids, product_ids)
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_engine(engine, args, results):
+    transactions = build_transaction_matrix(synthetic_baskets(args.orders, args.products, seed=args.seed))
+    rss_before = _peak_rss_mb()
+    started = time.perf_counter()
+    itemsets = mine_frequent_itemsets(transactions, args.min_support, engine=engine, max_len=args.max_len)
+    seconds = time.perf_counter() - started
+    results.put({
+        'engine': engine,
+        'seconds': seconds,
+        'itemsets': len(itemsets),
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_before_mb': rss_before,
+    })
+
+
+def run_benchmark(args):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    rows = []
+    for engine in args.engines:
+        process = context.Process(target=_run_engine, args=(engine, args, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            rows.append({'engine': engine, 'error': f"exit code {process.exitcode}"})
+        else:
+            rows.append(results.get())
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark frequent-itemset engines on synthetic baskets.")
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--min-support', type=float, default=0.001)
+    parser.add_argument('--max-len', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--engines', nargs='+', default=list(FREQUENT_ITEMSET_ENGINES),
+                        choices=list(FREQUENT_ITEMSET_ENGINES))
+    args = parser.parse_args(argv)
+
+    print(f"Benchmark: {args.orders} orders, {args.products} products, min_support={args.min_support}")
+    print(f"{'engine':<10} {'seconds':>10} {'itemsets':>10} {'peak RSS MB':>12} {'mining MB':>10}")
+    for row in run_benchmark(args):
+        if 'error' in row:
+            print(f"{row['engine']:<10} failed ({row['error']})")
+            continue
+        print(f"{row['engine']:<10} {row['seconds']:>10.3f} {row['itemsets']:>10} "
+              f"{row['peak_rss_mb']:>12.1f} {row['peak_rss_mb'] - row['rss_before_mb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import time
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from api.association.itemset_engines import (as_item_matrix, pack_item_bitsets, popcount, transaction_weights,
+                                             weighted_bit_layout, weighted_item_counts)
+
+# Orders sampled to estimate how many itemsets a threshold produces.
+DEFAULT_SAMPLE_ROWS = 20000
+# Rough in-memory cost of one frequent itemset (frozenset + support row) and of
+# one association rule (two frozensets + seven metric columns) in pandas.
+BYTES_PER_ITEMSET = 400
+BYTES_PER_RULE = 800
+# Cost of each engine relative to Eclat, measured with benchmark_engines.py
+# (20k orders, 1k products, min_support=0.002).
+ENGINE_COST_FACTORS = {'eclat': 1.0, 'apriori': 30.0, 'fpgrowth': 200.0, 'fpmax': 200.0}
+# Factor applied to min_support each time the estimate is still over budget.
+SUPPORT_STEP = 1.5
+# Never raise min_support above this; a plan that still does not fit is reported as such.
+MAX_MIN_SUPPORT = 0.2
+
+
+@dataclass
+class MiningBudget:
+    """
+    Limits for one frequent-itemset mining run.
+
+    Args:
+        max_memory_mb (float): Memory allowed for the itemsets and rules.
+        max_seconds (float): Wall-clock time allowed for mining.
+        min_max_len (int): Never cap max_len below this (2 keeps the pair rules).
+        sample_rows (int): Orders sampled for the estimate.
+        seed (int): Sampling seed, so a plan can be reproduced.
+    """
+    max_memory_mb: float = 1024.0
+    max_seconds: float = 600.0
+    min_max_len: int = 2
+    sample_rows: int = DEFAULT_SAMPLE_ROWS
+    seed: int = 0
+
+
+@dataclass
+class MiningPlan:
+    """
+    The thresholds chosen for a budget and the estimate behind them.
+    """
+    min_support: float
+    max_len: int
+    requested_min_support: float
+    requested_max_len: int
+    itemsets_per_length: dict
+    estimated_itemsets: int
+    estimated_rules: int
+    estimated_memory_mb: float
+    estimated_seconds: float
+    fits: bool
+    adjustments: list = field(default_factory=list)
+
+    def report(self, title='Mining plan'):
+        """
+        Prints and logs the effective thresholds and why they were chosen.
+        """
+        lines = [
+            f"min_support={self.min_support:.6g} (requested {self.requested_min_support:.6g}), "
+            f"max_len={self.max_len} (requested {self.requested_max_len})",
+            f"estimated {self.estimated_itemsets} itemsets, {self.estimated_rules} rules, "
+            f"{self.estimated_memory_mb:.1f} MB, {self.estimated_seconds:.1f}s",
+        ]
+        lines.extend(self.adjustments)
+        if not self.fits:
+            lines.append("the estimate is still over budget at the highest allowed min_support")
+        print(f"📐 {title}:")
+        for line in lines:
+            print(f"   {line}")
+            logging.info(f"{title} - {line}")
+
+
+def count_itemsets(matrix, min_support, max_len, limit=None, weights=None):
+    """
+    Counts the frequent itemsets per length with the Eclat search of
+    itemset_engines, without materializing them.
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): Boolean transactions.
+        min_support (float): Minimum support.
+        max_len (int): Longest itemset counted.
+        limit (int): Stop as soon as more itemsets than this were found.
+        weights (np.ndarray): Optional number of orders behind each row.
+
+    Returns:
+        tuple: (counts, complete) where counts[k] is the number of frequent
+               itemsets of length k and complete is False if `limit` was hit.
+    """
+    n_rows = matrix.shape[0] if weights is None else int(weights.sum())
+    counts = {}
+    if n_rows == 0:
+        return counts, True
+
+    row_positions, byte_weights, n_bits = None, None, None
+    if weights is not None:
+        row_positions, byte_weights = weighted_bit_layout(weights)
+        n_bits = len(byte_weights) * 8
+
+    item_counts = weighted_item_counts(matrix, weights)
+    frequent_items = np.flatnonzero(item_counts / n_rows >= min_support)
+    frequent_items = frequent_items[np.argsort(item_counts[frequent_items], kind='stable')]
+    total = 0
+
+    stack = [(1, pack_item_bitsets(matrix, frequent_items, row_positions=row_positions, n_bits=n_bits))]
+    while stack:
+        length, item_bits = stack.pop()
+        counts[length] = counts.get(length, 0) + len(item_bits)
+        total += len(item_bits)
+        if limit is not None and total > limit:
+            return counts, False
+        if length >= max_len:
+            continue
+        for position in range(len(item_bits) - 1):
+            joined = np.bitwise_and(item_bits[position + 1:], item_bits[position])
+            keep = popcount(joined, byte_weights) / n_rows >= min_support
+            if np.any(keep):
+                stack.append((length + 1, joined[keep]))
+    return counts, True
+
+
+def sample_rows(matrix, n_rows, seed=0, weights=None):
+    """
+    Samples `n_rows` orders (all of them if there are fewer).
+
+    Weighted rows are sampled as orders: a multinomial draw gives how many of
+    the sampled orders fall on each row, which becomes the sample's weights.
+
+    Returns:
+        tuple: (sample matrix, sample weights or None)
+    """
+    rng = np.random.default_rng(seed)
+    if weights is not None:
+        if weights.sum() <= n_rows:
+            return matrix, weights
+        drawn = rng.multinomial(n_rows, weights / weights.sum())
+        rows = np.flatnonzero(drawn)
+        return matrix[rows], drawn[rows].astype(np.int64)
+    if matrix.shape[0] <= n_rows:
+        return matrix, None
+    rows = np.sort(rng.choice(matrix.shape[0], size=n_rows, replace=False))
+    return matrix[rows], None
+
+
+def _estimate(counts, n_rows, n_sample_rows, sample_seconds, engine):
+    n_itemsets = sum(counts.values())
+    # An itemset of length k yields up to 2^k - 2 rules.
+    n_rules = sum(count * (2 ** length - 2) for length, count in counts.items())
+    memory_mb = (n_itemsets * BYTES_PER_ITEMSET + n_rules * BYTES_PER_RULE) / 2 ** 20
+    # The bitset intersections scale with the number of matrix rows.
+    seconds = sample_seconds * (n_rows / max(n_sample_rows, 1)) * ENGINE_COST_FACTORS.get(engine, 1.0)
+    return n_itemsets, n_rules, memory_mb, seconds
+
+
+def plan_mining(transactions, min_support, max_len=None, budget=None, engine='eclat'):
+    """
+    Chooses min_support and max_len so that mining `transactions` fits `budget`.
+
+    Itemset counts are measured on a sample of the orders. While the estimate
+    is over budget, max_len is first capped to the longest length that fits
+    (down to budget.min_max_len), then min_support is raised by SUPPORT_STEP.
+
+    Args:
+        transactions (TransactionMatrix | scipy.sparse matrix | pd.DataFrame): The transactions.
+        min_support (float): Requested minimum support.
+        max_len (int): Requested maximum itemset length (None = unlimited).
+        budget (MiningBudget): The limits (defaults to MiningBudget()).
+        engine (str): Engine that will mine, used to scale the time estimate.
+
+    Returns:
+        MiningPlan: The effective thresholds and their estimate.
+    """
+    budget = budget or MiningBudget()
+    matrix, _ = as_item_matrix(transactions)
+    weights = transaction_weights(transactions)
+    sample, sample_weights = sample_rows(matrix, budget.sample_rows, seed=budget.seed, weights=weights)
+    longest_basket = int(np.diff(sample.indptr).max()) if sample.shape[0] else 1
+    requested_max_len = max_len
+    max_len = min(max_len or longest_basket, longest_basket) if longest_basket else 1
+    adjustments = []
+
+    # Enough itemsets to blow the memory budget on their own: stop counting there.
+    limit = int(budget.max_memory_mb * 2 ** 20 / BYTES_PER_ITEMSET) + 1
+    support = min_support
+    while True:
+        started = time.perf_counter()
+        counts, complete = count_itemsets(sample, support, max_len, limit=limit, weights=sample_weights)
+        sample_seconds = time.perf_counter() - started
+
+        fits = False
+        if complete:
+            full_itemsets = max(sum(counts.values()), 1)
+            # Longest length that fits; time is taken as proportional to the itemsets counted.
+            for length in range(max_len, min(budget.min_max_len, max_len) - 1, -1):
+                capped = {k: v for k, v in counts.items() if k <= length}
+                share = sum(capped.values()) / full_itemsets
+                n_itemsets, n_rules, memory_mb, seconds = _estimate(
+                    capped, matrix.shape[0], sample.shape[0], sample_seconds * share, engine)
+                if memory_mb <= budget.max_memory_mb and seconds <= budget.max_seconds:
+                    fits = True
+                    break
+            if length < max_len:
+                adjustments.append(f"capped max_len {max_len} -> {length}")
+                max_len = length
+            counts = capped
+        else:
+            n_itemsets, n_rules, memory_mb, seconds = _estimate(
+                counts, matrix.shape[0], sample.shape[0], sample_seconds, engine)
+            if max_len > budget.min_max_len:
+                # Counting was cut short: retry with the shortest allowed length first.
+                adjustments.append(f"capped max_len {max_len} -> {budget.min_max_len}")
+                max_len = budget.min_max_len
+                continue
+
+        if fits or support >= MAX_MIN_SUPPORT:
+            break
+        new_support = min(support * SUPPORT_STEP, MAX_MIN_SUPPORT)
+        adjustments.append(f"raised min_support {support:.6g} -> {new_support:.6g}")
+        support = new_support
+
+    return MiningPlan(
+        min_support=support,
+        max_len=max_len,
+        requested_min_support=min_support,
+        requested_max_len=requested_max_len,
+        itemsets_per_length=dict(sorted(counts.items())),
+        estimated_itemsets=n_itemsets,
+        estimated_rules=n_rules,
+        estimated_memory_mb=memory_mb,
+        estimated_seconds=seconds,
+        fits=fits,
+        adjustments=adjustments,
+    )
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.baskets import Baskets
+from api.association.transactions import ProductVocabulary, TransactionMatrix
+
+# Local directory holding the stage outputs of start_generate_association.
+DEFAULT_CHECKPOINT_DIR = 'association_checkpoints'
+
+# Stages of the full pipeline, in order. 'export' writes to MySQL and has no checkpoint.
+PIPELINE_STAGES = ('baskets', 'transactions', 'rules', 'export')
+
+# Checkpoints kept per stage; older ones are deleted when a new one is written.
+KEEP_PER_STAGE = 2
+
+# Columns holding frozensets in mlxtend rule frames (stored as sorted lists in Parquet).
+FROZENSET_COLUMNS = ('antecedents', 'consequents', 'itemsets')
+
+
+def content_hash(*parts):
+    """
+    Stable hex digest of numpy arrays and plain values (numbers, strings, None,
+    tuples, dicts), used as checkpoint keys.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            array = np.ascontiguousarray(part)
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=repr).encode())
+        digest.update(b'\x00')
+    return digest.hexdigest()[:20]
+
+
+class CheckpointStore:
+    """
+    Stage outputs on local disk, one file per (stage, key):
+    baskets and transactions as compressed .npz, rule frames as Parquet.
+    A manifest records the latest key of every stage, so a run can resume
+    from the last checkpoint of a stage without recomputing its key.
+    """
+
+    def __init__(self, directory=DEFAULT_CHECKPOINT_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+
+    # ---- manifest ----
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def latest_key(self, stage):
+        """
+        Key of the last checkpoint written for `stage`, or None.
+        """
+        entries = self._read_manifest().get(stage, [])
+        return entries[-1]['key'] if entries else None
+
+    def _path(self, stage, key, suffix):
+        return os.path.join(self.directory, f"{stage}-{key}{suffix}")
+
+    def find(self, stage, key):
+        """
+        Path of the checkpoint of `stage` for `key` (latest when key is None), or None.
+        """
+        key = key or self.latest_key(stage)
+        if key is None:
+            return None
+        for entry in self._read_manifest().get(stage, []):
+            if entry['key'] == key and os.path.exists(entry['path']):
+                return entry['path']
+        return None
+
+    def _record(self, stage, key, path):
+        manifest = self._read_manifest()
+        entries = [entry for entry in manifest.get(stage, []) if entry['key'] != key]
+        entries.append({'key': key, 'path': path, 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+        for old in entries[:-KEEP_PER_STAGE]:
+            if os.path.exists(old['path']):
+                os.remove(old['path'])
+        manifest[stage] = entries[-KEEP_PER_STAGE:]
+        self._write_manifest(manifest)
+        logging.info(f"Checkpoint written: {stage} {key} -> {path}")
+
+    def _atomic_write(self, stage, key, suffix, write):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(stage, key, suffix)
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        self._record(stage, key, path)
+        return path
+
+    # ---- typed save / load ----
+
+    def save_baskets(self, key, baskets):
+        def write(path):
+            arrays = {'order_ids': baskets.order_ids, 'indptr': baskets.indptr, 'product_ids': baskets.product_ids}
+            if baskets.order_times is not None:
+                arrays['order_times'] = baskets.order_times
+            with open(path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+        return self._atomic_write('baskets', key, '.npz', write)
+
+    def load_baskets(self, key=None):
+        path = self.find('baskets', key)
+        if path is None:
+            return None
+        with np.load(path) as data:
+            return Baskets(order_ids=data['order_ids'], indptr=data['indptr'], product_ids=data['product_ids'],
+                           order_times=data['order_times'] if 'order_times' in data.files else None)
+
+    def save_transactions(self, key, transactions):
+        matrix = transactions.matrix.tocsr()
+
+        def write(path):
+            arrays = {
+                'indptr': matrix.indptr, 'indices': matrix.indices, 'shape': np.array(matrix.shape),
+                'product_ids': transactions.vocabulary.product_ids, 'order_ids': transactions.order_ids,
+            }
+            if transactions.weights is not None:
+                arrays['weights'] = transactions.weights
+            with open(path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+        return self._atomic_write('transactions', key, '.npz', write)
+
+    def load_transactions(self, key=None):
+        path = self.find('transactions', key)
+        if path is None:
+            return None
+        with np.load(path) as data:
+            indices = data['indices']
+            matrix = sp.csr_matrix((np.ones(len(indices), dtype=bool), indices, data['indptr']),
+                                   shape=tuple(data['shape']))
+            return TransactionMatrix(
+                matrix=matrix,
+                vocabulary=ProductVocabulary(data['product_ids']),
+                order_ids=data['order_ids'],
+                weights=data['weights'] if 'weights' in data.files else None,
+            )
+
+    def save_frame(self, stage, key, frame):
+        """
+        Writes a DataFrame as Parquet; frozenset columns become sorted lists.
+        """
+        frame = frame.copy()
+        for column in FROZENSET_COLUMNS:
+            if column in frame.columns:
+                frame[column] = [sorted(int(item) for item in value) for value in frame[column]]
+        return self._atomic_write(stage, key, '.parquet', lambda path: frame.to_parquet(path, index=False))
+
+    def load_frame(self, stage, key=None):
+        path = self.find(stage, key)
+        if path is None:
+            return None
+        frame = pd.read_parquet(path)
+        for column in FROZENSET_COLUMNS:
+            if column in frame.columns:
+                frame[column] = [frozenset(int(item) for item in value) for value in frame[column]]
+        return frame
@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+# Forward-decay weights grow as exp(rate * (t - landmark)); past this exponent
+# the landmark is moved forward so the float64 counts stay far from overflow.
+MAX_FORWARD_EXPONENT = 500.0
+
+
+def decay_rate(half_life_days):
+    """
+    Exponential decay rate per second for a half-life given in days.
+    """
+    return math.log(2.0) / (half_life_days * SECONDS_PER_DAY)
+
+
+def decay_weights(order_times, half_life_days, landmark):
+    """
+    Weight of each order: exp(-rate * (landmark - t)), i.e. 1 for an order
+    placed at the landmark, 0.5 for one a half-life older.
+
+    Orders newer than the landmark get weights above 1 ("forward decay"): the
+    ratios between weights are the same as with the newest order as reference,
+    and supports and confidences are ratios of weighted counts, so counts kept
+    relative to a fixed landmark never need to be rescaled when time moves on.
+
+    Args:
+        order_times (np.ndarray): Order times in seconds since the epoch.
+        half_life_days (float): Age after which an order counts half.
+        landmark (float): Reference time in seconds since the epoch.
+
+    Returns:
+        np.ndarray: float64 weight per order.
+    """
+    return np.exp(-decay_rate(half_life_days) * (landmark - np.asarray(order_times, dtype=np.float64)))
+
+
+def forward_exponent(order_times, half_life_days, landmark):
+    """
+    Largest exponent decay_weights() would use for `order_times`.
+    """
+    if len(order_times) == 0:
+        return 0.0
+    return decay_rate(half_life_days) * (float(np.max(order_times)) - landmark)
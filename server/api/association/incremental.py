@@ -0,0 +1,174 @@
+import os
+import logging
+
+import numpy as np
+import scipy.sparse as sp
+
+from api.association.decay import MAX_FORWARD_EXPONENT, decay_rate, decay_weights, forward_exponent
+from api.association.pairwise import pair_table
+from api.association.parallel_counting import parallel_cooccurrence_counts
+from api.association.transactions import ProductVocabulary
+
+# Local file holding the running item/pair counts and the order_id watermark.
+DEFAULT_STATE_PATH = 'association_state.npz'
+
+
+class AssociationCounts:
+    """
+    Running item and pair support counts for 1 -> 1 association rules,
+    persisted together with the last processed order_id.
+
+    A refresh folds only the orders after `last_order_id` into the counts, so
+    its cost follows the number of new orders instead of the whole history.
+
+    With `half_life_days`, every order is weighted by exp(-rate * age) and the
+    counts are float64. They are kept relative to `landmark` (forward decay,
+    see decay.decay_weights): new orders are added with their weight relative
+    to the landmark and the existing counts stay untouched, which is the same
+    as multiplying them by the decay factor since supports and confidences
+    are ratios. The landmark only moves (and the counts are multiplied once)
+    when the weights get too large for float64.
+    """
+
+    def __init__(self, vocabulary=None, item_counts=None, pair_counts=None, n_transactions=0, last_order_id=0,
+                 half_life_days=None, landmark=None):
+        self.vocabulary = vocabulary if vocabulary is not None else ProductVocabulary()
+        size = len(self.vocabulary)
+        dtype = np.float64 if half_life_days else np.int64
+        self.item_counts = item_counts if item_counts is not None else np.zeros(size, dtype=dtype)
+        self.pair_counts = pair_counts if pair_counts is not None else sp.csr_matrix((size, size), dtype=dtype)
+        self.n_transactions = n_transactions
+        self.last_order_id = last_order_id
+        self.half_life_days = half_life_days
+        self.landmark = landmark
+
+    @property
+    def empty(self):
+        return self.n_transactions == 0
+
+    def _grow(self, size):
+        if size > len(self.item_counts):
+            self.item_counts = np.concatenate([
+                self.item_counts, np.zeros(size - len(self.item_counts), dtype=self.item_counts.dtype)])
+            self.pair_counts.resize((size, size))
+
+    def order_weights(self, order_times):
+        """
+        Decay weights of new orders relative to the landmark (set to the newest
+        order on the first call). Moves the landmark forward first if these
+        orders would push the weights past MAX_FORWARD_EXPONENT.
+        """
+        if not self.half_life_days:
+            raise ValueError("These counts are not time-decayed (half_life_days is not set).")
+        if self.landmark is None:
+            self.landmark = float(np.max(order_times)) if len(order_times) else 0.0
+        if forward_exponent(order_times, self.half_life_days, self.landmark) > MAX_FORWARD_EXPONENT:
+            self.rebase(float(np.max(order_times)))
+        return decay_weights(order_times, self.half_life_days, self.landmark)
+
+    def rebase(self, landmark):
+        """
+        Moves the landmark and multiplies the counts by the decay between the two.
+        """
+        factor = np.exp(-decay_rate(self.half_life_days) * (landmark - self.landmark))
+        self.item_counts = self.item_counts * factor
+        self.pair_counts = (self.pair_counts * factor).tocsr()
+        self.n_transactions = self.n_transactions * factor
+        self.landmark = landmark
+        logging.info(f"Moved the decay landmark of the association counts (factor {factor:.3g}).")
+
+    def fold_in(self, transactions, workers=1):
+        """
+        Adds the counts of new transactions (built with this object's vocabulary).
+
+        Args:
+            transactions (TransactionMatrix): The new orders only (compacted or not).
+            workers (int): Processes counting row shards of large batches.
+
+        Returns:
+            np.ndarray: Column indices of the items whose counts changed.
+        """
+        if transactions.vocabulary is not self.vocabulary:
+            raise ValueError("Transactions must be built with the counts' vocabulary.")
+
+        size = len(self.vocabulary)
+        matrix = transactions.matrix
+        if matrix.shape[1] < size:
+            matrix = sp.csr_matrix(matrix, copy=True)
+            matrix.resize((matrix.shape[0], size))
+        self._grow(size)
+
+        item_counts, pair_counts = parallel_cooccurrence_counts(matrix, workers=workers, weights=transactions.weights)
+        self.item_counts += item_counts
+        self.pair_counts = (self.pair_counts + pair_counts).tocsr()
+        self.n_transactions += transactions.n_transactions
+        if len(transactions.order_ids):
+            self.last_order_id = max(self.last_order_id, int(transactions.order_ids.max()))
+
+        changed = np.flatnonzero(item_counts)
+        logging.info(f"Folded {transactions.n_transactions} orders into association counts; {len(changed)} items changed.")
+        return changed
+
+    def pair_rules(self, min_support, min_confidence, antecedents=None):
+        """
+        Derives the 1 -> 1 rules from the counts.
+
+        Args:
+            min_support (float): Minimum support of the pair.
+            min_confidence (float): Minimum confidence of the rule.
+            antecedents (np.ndarray): Optional column indices; only rules whose
+                                      antecedent is one of them are returned
+                                      (the rules whose counts changed).
+
+        Returns:
+            pd.DataFrame: One row per rule with pairwise.PAIR_COLUMNS.
+        """
+        return pair_table(self.item_counts, self.pair_counts, self.n_transactions, self.vocabulary.product_ids,
+                          min_support, min_confidence, antecedents=antecedents)
+
+    def save(self, path=DEFAULT_STATE_PATH):
+        """
+        Writes the counts to `path` atomically (temporary file + rename), so a
+        crash never leaves a half-written state behind.
+        """
+        pairs = self.pair_counts.tocoo()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                product_ids=self.vocabulary.product_ids,
+                item_counts=self.item_counts,
+                pair_rows=pairs.row.astype(np.int32),
+                pair_cols=pairs.col.astype(np.int32),
+                pair_counts=pairs.data,
+                n_transactions=np.array(self.n_transactions),
+                last_order_id=np.array(self.last_order_id, dtype=np.int64),
+                half_life_days=np.array(self.half_life_days or 0.0),
+                landmark=np.array(self.landmark if self.landmark is not None else np.nan),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATE_PATH):
+        """
+        Reads counts saved by save(); returns empty counts if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            vocabulary = ProductVocabulary(data['product_ids'])
+            size = len(vocabulary)
+            pair_counts = sp.csr_matrix(
+                (data['pair_counts'], (data['pair_rows'], data['pair_cols'])), shape=(size, size))
+            # States written before time decay existed have neither field.
+            half_life_days = float(data['half_life_days']) if 'half_life_days' in data.files else 0.0
+            landmark = float(data['landmark']) if 'landmark' in data.files else np.nan
+            return cls(
+                vocabulary=vocabulary,
+                item_counts=data['item_counts'],
+                pair_counts=pair_counts,
+                n_transactions=data['n_transactions'].item(),
+                last_order_id=int(data['last_order_id']),
+                half_life_days=half_life_days or None,
+                landmark=None if np.isnan(landmark) else landmark,
+            )
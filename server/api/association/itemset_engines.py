@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.transactions import TransactionMatrix, mlxtend_frame
+
+# Popcount of every byte value, used when numpy has no bitwise_count (numpy < 2.0).
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(bits, byte_weights=None):
+    """
+    Counts the set bits of a packed uint8 array along its last axis. With
+    `byte_weights` every bit of byte i counts byte_weights[i] times (see
+    weighted_bit_layout()).
+    """
+    if hasattr(np, 'bitwise_count'):
+        counts = np.bitwise_count(bits)
+    else:
+        counts = _POPCOUNT_TABLE[bits]
+    if byte_weights is not None:
+        return counts @ byte_weights
+    return counts.sum(axis=-1, dtype=np.int64)
+
+
+def weighted_bit_layout(weights):
+    """
+    Places weighted rows in a bitset so that each byte holds rows of a single
+    weight: rows are grouped by weight and every group starts on a byte
+    boundary (padding at most 7 bits per distinct weight).
+
+    Returns:
+        tuple: (row_positions, byte_weights) - the bit position of every row and
+               the int64 weight of every byte.
+    """
+    order = np.argsort(weights, kind='stable')
+    sorted_weights = weights[order]
+    starts = np.flatnonzero(np.r_[True, sorted_weights[1:] != sorted_weights[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    group_bytes = (sizes + 7) // 8
+    byte_offsets = np.r_[0, np.cumsum(group_bytes)[:-1]]
+    group = np.repeat(np.arange(len(starts)), sizes)
+
+    row_positions = np.empty(len(order), dtype=np.int64)
+    row_positions[order] = byte_offsets[group] * 8 + (np.arange(len(order)) - starts[group])
+    byte_weights = np.repeat(sorted_weights[starts], group_bytes).astype(np.int64)
+    return row_positions, byte_weights
+
+
+def transaction_weights(transactions):
+    """
+    Returns the row weights of compacted transactions (None when every row is one order).
+    """
+    return transactions.weights if isinstance(transactions, TransactionMatrix) else None
+
+
+def weighted_item_counts(matrix, weights=None):
+    """
+    Number of orders containing each column.
+    """
+    if weights is None:
+        return np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64)
+    return np.asarray(matrix.T @ weights).ravel().astype(np.int64)
+
+
+def as_item_matrix(transactions):
+    """
+    Normalizes the accepted transaction inputs into a boolean CSR matrix and the
+    labels of its columns.
+
+    Args:
+        transactions (TransactionMatrix | scipy.sparse matrix | pd.DataFrame):
+            A TransactionMatrix (labels are product IDs), a bare sparse matrix
+            (labels are the column indices) or a one-hot DataFrame (labels are
+            the column names).
+
+    Returns:
+        tuple: (csr_matrix, labels) where labels is an array indexed by column.
+    """
+    if isinstance(transactions, TransactionMatrix):
+        return transactions.matrix.astype(bool).tocsr(), transactions.vocabulary.product_ids
+    if sp.issparse(transactions):
+        matrix = sp.csr_matrix(transactions, dtype=bool)
+        return matrix, np.arange(matrix.shape[1])
+    if isinstance(transactions, pd.DataFrame):
+        if all(isinstance(dtype, pd.SparseDtype) for dtype in transactions.dtypes):
+            matrix = sp.csr_matrix(transactions.sparse.to_coo(), dtype=bool)
+        else:
+            matrix = sp.csr_matrix(transactions.to_numpy(dtype=bool))
+        return matrix, np.asarray(transactions.columns)
+    raise TypeError(f"Unsupported transactions type: {type(transactions).__name__}")
+
+
+def _mine_apriori(matrix, min_support, max_len=None, weights=None):
+    from mlxtend.frequent_patterns import apriori
+    return apriori(mlxtend_frame(matrix, weights), min_support=min_support, use_colnames=True, max_len=max_len)
+
+
+def _mine_fpgrowth(matrix, min_support, max_len=None, weights=None):
+    from mlxtend.frequent_patterns import fpgrowth
+    return fpgrowth(mlxtend_frame(matrix, weights), min_support=min_support, use_colnames=True, max_len=max_len)
+
+
+def _mine_fpmax(matrix, min_support, max_len=None, weights=None):
+    from mlxtend.frequent_patterns import fpmax
+    return fpmax(mlxtend_frame(matrix, weights), min_support=min_support, use_colnames=True, max_len=max_len)
+
+
+def pack_item_bitsets(matrix, columns, row_positions=None, n_bits=None):
+    """
+    Builds the vertical representation used by Eclat: one bit per transaction
+    for each of the given columns, packed 8 transactions per byte.
+
+    Args:
+        row_positions (np.ndarray): Optional bit position of each row (weighted layout).
+        n_bits (int): Bits per bitset when row_positions is given.
+
+    Returns:
+        np.ndarray: uint8 array of shape (len(columns), ceil(n_bits / 8)).
+    """
+    csc = matrix.tocsc()
+    if row_positions is None:
+        n_bits = matrix.shape[0]
+    bitsets = np.zeros((len(columns), (n_bits + 7) // 8), dtype=np.uint8)
+    row_flags = np.zeros(n_bits, dtype=bool)
+    for position, column in enumerate(columns):
+        rows = csc.indices[csc.indptr[column]:csc.indptr[column + 1]]
+        if row_positions is not None:
+            rows = row_positions[rows]
+        row_flags[rows] = True
+        bitsets[position] = np.packbits(row_flags)
+        row_flags[rows] = False
+    return bitsets
+
+
+def _mine_eclat(matrix, min_support, max_len=None, weights=None):
+    """
+    Vertical Eclat: every item is a packed bitset over the transactions, the
+    support of an itemset is the popcount of the AND of its items' bitsets.
+    The search is depth-first over prefix classes and each class extends all
+    of its candidates with one vectorized np.bitwise_and + popcount.
+    Weighted rows are laid out by weight so the popcount becomes a dot product
+    with the per-byte weights.
+    """
+    n_rows = matrix.shape[0] if weights is None else int(weights.sum())
+    if n_rows == 0:
+        return pd.DataFrame(columns=['support', 'itemsets'])
+
+    row_positions, byte_weights, n_bits = None, None, None
+    if weights is not None:
+        row_positions, byte_weights = weighted_bit_layout(weights)
+        n_bits = len(byte_weights) * 8
+
+    item_counts = weighted_item_counts(matrix, weights)
+    frequent_items = np.flatnonzero(item_counts / n_rows >= min_support)
+    # Most frequent items last keeps the intermediate intersections small.
+    frequent_items = frequent_items[np.argsort(item_counts[frequent_items], kind='stable')]
+
+    supports = []
+    itemsets = []
+    bitsets = pack_item_bitsets(matrix, frequent_items, row_positions=row_positions, n_bits=n_bits)
+    counts = item_counts[frequent_items]
+
+    # Stack of prefix classes: (prefix items, candidate items, candidate bitsets, candidate counts)
+    stack = [((), frequent_items, bitsets, counts)]
+    while stack:
+        prefix, items, item_bits, item_counts_ = stack.pop()
+        for position in range(len(items)):
+            itemset = prefix + (int(items[position]),)
+            supports.append(item_counts_[position] / n_rows)
+            itemsets.append(frozenset(itemset))
+
+            if max_len is not None and len(itemset) >= max_len:
+                continue
+            rest = slice(position + 1, None)
+            if len(items[rest]) == 0:
+                continue
+            joined = np.bitwise_and(item_bits[rest], item_bits[position])
+            joined_counts = popcount(joined, byte_weights)
+            keep = joined_counts / n_rows >= min_support
+            if np.any(keep):
+                stack.append((itemset, items[rest][keep], joined[keep], joined_counts[keep]))
+
+    return pd.DataFrame({'support': np.asarray(supports, dtype=float), 'itemsets': itemsets})
+
+
+def _mine_sharded(matrix, min_support, max_len=None, weights=None):
+    # Imported here: parallel_counting builds on pairwise, which imports this module.
+    from api.association.parallel_counting import mine_sharded
+    return mine_sharded(matrix, min_support, max_len=max_len, weights=weights)
+
+
+# Registry of the available frequent-itemset miners. Each engine receives a
+# boolean CSR matrix (plus optional row weights) and returns a DataFrame with the mlxtend schema:
+# 'support' (float) and 'itemsets' (frozenset of column indices).
+FREQUENT_ITEMSET_ENGINES = {
+    'apriori': _mine_apriori,
+    'fpgrowth': _mine_fpgrowth,
+    'fpmax': _mine_fpmax,
+    'eclat': _mine_eclat,
+    'sharded': _mine_sharded,
+}
+
+# Engines backed by mlxtend, which has no row weights (compacted rows are
+# expanded back into one row per order before mining).
+UNWEIGHTED_ENGINES = {'apriori', 'fpgrowth', 'fpmax'}
+
+# Engines that only return maximal itemsets (their subsets are missing, so
+# association rules cannot be derived from their output).
+MAXIMAL_ONLY_ENGINES = {'fpmax'}
+
+
+def mine_frequent_itemsets(transactions, min_support, engine='apriori', max_len=None):
+    """
+    Finds frequent itemsets with the selected engine.
+
+    Args:
+        transactions (TransactionMatrix | scipy.sparse matrix | pd.DataFrame): The transactions.
+        min_support (float): The minimum support threshold (e.g., 0.001).
+        engine (str): One of FREQUENT_ITEMSET_ENGINES ('apriori', 'fpgrowth', 'fpmax', 'eclat', 'sharded').
+        max_len (int): Optional maximum itemset length.
+
+    Returns:
+        pd.DataFrame: Columns 'support' and 'itemsets'; itemsets are frozensets of
+                      product IDs (or column labels for non-TransactionMatrix input).
+    """
+    if engine not in FREQUENT_ITEMSET_ENGINES:
+        raise ValueError(f"Unknown frequent itemset engine '{engine}'. "
+                         f"Choose one of: {', '.join(FREQUENT_ITEMSET_ENGINES)}")
+
+    matrix, labels = as_item_matrix(transactions)
+    weights = transaction_weights(transactions)
+    frequent_itemsets = FREQUENT_ITEMSET_ENGINES[engine](matrix, min_support, max_len=max_len, weights=weights)
+    frequent_itemsets = frequent_itemsets[['support', 'itemsets']].reset_index(drop=True)
+
+    frequent_itemsets['itemsets'] = [
+        frozenset(labels[list(itemset)].tolist()) for itemset in frequent_itemsets['itemsets']
+    ]
+    return frequent_itemsets
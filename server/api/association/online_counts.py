@@ -0,0 +1,444 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from api.association.incremental import DEFAULT_STATE_PATH, AssociationCounts
+from api.association.recommendation_index import get_live_index, publish_index
+from api.association.transactions import ProductVocabulary
+
+# Count-Min sketch shape: a pair estimate exceeds the true count by at most
+# e / SKETCH_WIDTH of all pair occurrences, except with probability e^-SKETCH_DEPTH.
+SKETCH_WIDTH = 2 ** 20
+SKETCH_DEPTH = 4
+# Consequents tracked per antecedent (the heavy hitters of its sketch row).
+DEFAULT_CANDIDATES = 40
+# Recommendations published per antecedent.
+DEFAULT_TOP_K = 20
+# Seconds between two publications of the touched products to the live index.
+DEFAULT_PUBLISH_INTERVAL = 2.0
+# Recently ingested order IDs kept to drop duplicate events.
+RECENT_ORDERS = 100000
+
+# Order lines of orders completed after a (date_completed, order_id) watermark,
+# ordered so that every order is contiguous and the watermark only moves forward.
+COMPLETED_ORDER_PAIRS_SQL = """
+    SELECT lookup.order_id, lookup.product_id, UNIX_TIMESTAMP(stats.date_completed)
+    FROM wp_wc_order_product_lookup lookup
+    JOIN wp_wc_order_stats stats ON stats.order_id = lookup.order_id
+    WHERE lookup.product_id > 0 AND stats.status = 'wc-completed'
+      AND (stats.date_completed > FROM_UNIXTIME(%s)
+           OR (stats.date_completed = FROM_UNIXTIME(%s) AND lookup.order_id > %s))
+    ORDER BY stats.date_completed, lookup.order_id, lookup.order_item_id
+    LIMIT %s
+"""
+
+LATEST_COMPLETED_SQL = """
+    SELECT COALESCE(UNIX_TIMESTAMP(MAX(date_completed)), 0), COALESCE(MAX(order_id), 0)
+    FROM wp_wc_order_stats WHERE status = 'wc-completed'
+"""
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch over uint64 keys: SKETCH_DEPTH rows of counters, one
+    multiply-shift hash per row. An estimate is the minimum over the rows, so
+    it never undercounts. Memory is fixed (depth x width float64 counters)
+    whatever the number of distinct keys.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, seed=0):
+        if width & (width - 1):
+            raise ValueError("The sketch width must be a power of two.")
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.float64)
+        self._shift = np.uint64(64 - (width.bit_length() - 1))
+        rng = np.random.default_rng(seed)
+        # Odd multipliers make the multiply-shift hashes universal.
+        self._multipliers = rng.integers(1, 2 ** 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._increments = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+
+    def _buckets(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        return (keys[None, :] * self._multipliers[:, None] + self._increments[:, None]) >> self._shift
+
+    def add(self, keys, counts=1.0):
+        buckets = self._buckets(keys)
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.float64), buckets.shape[1:])
+        for row in range(self.depth):
+            np.add.at(self.table[row], buckets[row], counts)
+
+    def estimate(self, keys):
+        buckets = self._buckets(keys)
+        return self.table[np.arange(self.depth)[:, None], buckets].min(axis=0)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+def pair_keys(first, second):
+    """
+    uint64 sketch key of unordered product pairs (smaller product ID in the high half).
+    """
+    first = np.asarray(first, dtype=np.uint64)
+    second = np.asarray(second, dtype=np.uint64)
+    return (np.minimum(first, second) << np.uint64(32)) | np.maximum(first, second)
+
+
+class OnlineCooccurrence:
+    """
+    In-memory item and pair counts fed one completed order at a time.
+
+    Item counts are exact (one counter per product). Pair counts live in a
+    Count-Min sketch, so their memory does not grow with the number of
+    distinct pairs; next to it, every antecedent keeps its `n_candidates`
+    heaviest consequents (a pair replaces the lightest one once its estimate
+    is larger), which is where the top-k recommendations are read from.
+
+    Products touched since the last publication are remembered so that only
+    their recommendations are recomputed and merged into the live index. A
+    counter that was not seeded with the order history (see from_state())
+    counts but never publishes: its confidences would only reflect the
+    orders streamed since the server started.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, n_candidates=DEFAULT_CANDIDATES, seed=0):
+        self.vocabulary = ProductVocabulary()
+        self.item_counts = np.zeros(0, dtype=np.float64)
+        self.sketch = CountMinSketch(width=width, depth=depth, seed=seed)
+        self.n_candidates = n_candidates
+        self.candidates = {}
+        self.n_orders = 0.0
+        self.seeded = False
+        self._recent_orders = OrderedDict()
+        self._touched = set()
+        self._lock = threading.Lock()
+
+    # ---- seeding ----
+
+    @classmethod
+    def from_state(cls, state_path=DEFAULT_STATE_PATH, **kwargs):
+        """
+        Starts from the counts of the incremental refresh (see
+        incremental.AssociationCounts), so the streamed orders are added to the
+        whole history instead of a cold start. Time-decayed states are not
+        used: streamed orders carry no decay weight.
+        """
+        counter = cls(**kwargs)
+        counts = AssociationCounts.load(state_path)
+        if counts.empty:
+            logging.warning(f"No counts in {state_path}; the online counter will not publish "
+                            "until it is seeded by an incremental refresh.")
+            return counter
+        if counts.half_life_days:
+            logging.warning(f"{state_path} holds time-decayed counts; the online counter starts empty "
+                            "and will not publish.")
+            return counter
+
+        labels = counts.vocabulary.product_ids
+        counter.vocabulary.add(labels)
+        counter.item_counts = counts.item_counts.astype(np.float64)
+        counter.n_orders = float(counts.n_transactions)
+        pairs = counts.pair_counts.tocoo()
+        counter.sketch.add(pair_keys(labels[pairs.row], labels[pairs.col]), pairs.data)
+
+        # Heaviest n_candidates consequents of every antecedent, both directions.
+        lhs = np.concatenate([pairs.row, pairs.col])
+        rhs = np.concatenate([pairs.col, pairs.row])
+        both = np.concatenate([pairs.data, pairs.data]).astype(np.float64)
+        order = np.lexsort((-both, lhs))
+        lhs, rhs, both = lhs[order], rhs[order], both[order]
+        starts = np.flatnonzero(np.r_[True, lhs[1:] != lhs[:-1]])
+        rank = np.arange(len(lhs)) - np.repeat(starts, np.diff(np.append(starts, len(lhs))))
+        keep = rank < counter.n_candidates
+        for antecedent, consequent, count in zip(labels[lhs[keep]].tolist(), labels[rhs[keep]].tolist(),
+                                                  both[keep].tolist()):
+            counter.candidates.setdefault(antecedent, {})[consequent] = count
+        counter.seeded = True
+        logging.info(f"Online counter seeded from {state_path}: {len(labels)} products, "
+                     f"{pairs.nnz} pairs, {counter.n_orders:.0f} orders.")
+        return counter
+
+    # ---- ingestion ----
+
+    def _grow(self):
+        if len(self.vocabulary) > len(self.item_counts):
+            self.item_counts = np.concatenate([
+                self.item_counts, np.zeros(len(self.vocabulary) - len(self.item_counts), dtype=np.float64)])
+
+    def ingest(self, orders):
+        """
+        Adds completed orders to the counts.
+
+        Args:
+            orders (list): (order_id, product_ids) tuples. Orders already seen
+                           recently are skipped, so the same order can safely
+                           come from both the event endpoint and the tailer.
+
+        Returns:
+            int: Number of orders counted.
+        """
+        with self._lock:
+            baskets = []
+            for order_id, product_ids in orders:
+                order_id = int(order_id)
+                if order_id in self._recent_orders:
+                    continue
+                self._recent_orders[order_id] = None
+                if len(self._recent_orders) > RECENT_ORDERS:
+                    self._recent_orders.popitem(last=False)
+                basket = sorted({int(product_id) for product_id in product_ids if int(product_id) > 0})
+                if basket:
+                    baskets.append(basket)
+            if not baskets:
+                return 0
+
+            items = np.fromiter((item for basket in baskets for item in basket), dtype=np.int64)
+            self.vocabulary.add(items)
+            self._grow()
+            np.add.at(self.item_counts, self.vocabulary.encode(items), 1.0)
+            self.n_orders += len(baskets)
+
+            first, second = [], []
+            for basket in baskets:
+                for i, a in enumerate(basket):
+                    for b in basket[i + 1:]:
+                        first.append(a)
+                        second.append(b)
+            self._touched.update(items.tolist())
+            if first:
+                keys = pair_keys(first, second)
+                self.sketch.add(keys)
+                estimates = self.sketch.estimate(keys).tolist()
+                for a, b, estimate in zip(first, second, estimates):
+                    self._offer(a, b, estimate)
+                    self._offer(b, a, estimate)
+            return len(baskets)
+
+    def _offer(self, antecedent, consequent, estimate):
+        tracked = self.candidates.setdefault(antecedent, {})
+        if consequent in tracked or len(tracked) < self.n_candidates:
+            tracked[consequent] = estimate
+            return
+        lightest = min(tracked, key=tracked.get)
+        if estimate > tracked[lightest]:
+            del tracked[lightest]
+            tracked[consequent] = estimate
+
+    # ---- recommendations ----
+
+    def top_consequents(self, product_id, k=DEFAULT_TOP_K):
+        """
+        Current top-k consequents of one product by confidence.
+
+        Returns:
+            tuple: (consequent_ids, confidences) arrays, highest confidence first.
+                   Confidences are percentages, like the batch rules in the index.
+        """
+        tracked = self.candidates.get(int(product_id))
+        if not tracked or int(product_id) not in self.vocabulary:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        consequents = np.fromiter(tracked, dtype=np.int64, count=len(tracked))
+        # Fresh estimates: a tracked value may predate later orders.
+        pairs = self.sketch.estimate(pair_keys(np.full(len(consequents), int(product_id)), consequents))
+        antecedent_count = self.item_counts[self.vocabulary.encode([int(product_id)])[0]]
+        # The sketch only overcounts; a pair never occurs more often than either item.
+        pairs = np.minimum(pairs, np.minimum(antecedent_count, self.item_counts[self.vocabulary.encode(consequents)]))
+        confidences = (pairs / antecedent_count * 100).astype(np.float32)
+        best = np.argsort(-confidences, kind='stable')[:k]
+        return consequents[best], confidences[best]
+
+    def take_touched(self):
+        """
+        Returns the products touched since the last call and resets the set.
+        """
+        with self._lock:
+            touched, self._touched = self._touched, set()
+        return sorted(touched)
+
+    def publish(self, k=DEFAULT_TOP_K):
+        """
+        Merges the recomputed top-k of the touched products into the live
+        recommendation index (every other product keeps its batch rules).
+
+        A touched product keeps the batch consequents the counter does not
+        track; the ones it tracks get their online confidence. Nothing is
+        published before the counter is seeded.
+
+        Returns:
+            int: Number of products updated.
+        """
+        touched = self.take_touched()
+        if not touched or not self.seeded:
+            return 0
+        with self._lock:
+            updates = [self.top_consequents(product_id, k=k) for product_id in touched]
+        live = get_live_index()
+        merged = [merge_recommendations(*live.lookup(product_id), ids, confidences, k)
+                  for product_id, (ids, confidences) in zip(touched, updates)]
+        index = live.with_overrides(touched, [ids for ids, _ in merged],
+                                    [confidences for _, confidences in merged])
+        publish_index(index, snapshot_path=None)
+        return len(touched)
+
+
+def merge_recommendations(batch_ids, batch_confidences, online_ids, online_confidences, k):
+    """
+    Union of a product's batch and online recommendations, where the online
+    confidence wins for the consequents present in both.
+
+    Returns:
+        tuple: (consequent_ids, confidences) arrays, highest confidence first, at most k long.
+    """
+    kept = ~np.isin(batch_ids, online_ids)
+    ids = np.concatenate([np.asarray(online_ids, dtype=np.int64), np.asarray(batch_ids, dtype=np.int64)[kept]])
+    confidences = np.concatenate([np.asarray(online_confidences, dtype=np.float32),
+                                  np.asarray(batch_confidences, dtype=np.float32)[kept]])
+    best = np.argsort(-confidences, kind='stable')[:k]
+    return ids[best], confidences[best]
+
+
+class OnlinePublisher(threading.Thread):
+    """
+    Background thread publishing the touched products every `interval` seconds.
+    """
+
+    def __init__(self, counter, interval=DEFAULT_PUBLISH_INTERVAL, k=DEFAULT_TOP_K):
+        super().__init__(daemon=True, name='online-association-publisher')
+        self.counter = counter
+        self.interval = interval
+        self.k = k
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                updated = self.counter.publish(k=self.k)
+                if updated:
+                    logging.info(f"Online counts: published {updated} products.")
+            except Exception as e:
+                logging.error(f"Error publishing online association counts: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_online_counter = None
+_online_lock = threading.Lock()
+
+
+def get_online_counter(state_path=DEFAULT_STATE_PATH, interval=DEFAULT_PUBLISH_INTERVAL):
+    """
+    Returns the process-wide online counter, seeding it from the incremental
+    state and starting its publisher on first use.
+    """
+    global _online_counter
+    if _online_counter is None:
+        with _online_lock:
+            if _online_counter is None:
+                counter = OnlineCooccurrence.from_state(state_path)
+                OnlinePublisher(counter, interval=interval).start()
+                _online_counter = counter
+    return _online_counter
+
+
+# ---- Tailing completed orders ----
+
+def latest_completed_watermark(connection):
+    """
+    (date_completed, order_id) of the newest completed order, to start tailing from now.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(LATEST_COMPLETED_SQL)
+        completed_at, order_id = cursor.fetchone()
+        return int(completed_at), int(order_id)
+    finally:
+        cursor.close()
+
+
+def fetch_completed_orders(connection, watermark, limit=5000):
+    """
+    Reads the orders completed after `watermark` (at most about `limit` order lines).
+
+    Returns:
+        tuple: (orders as (order_id, product_ids) tuples, new watermark)
+    """
+    completed_at, last_order_id = watermark
+    cursor = connection.cursor()
+    try:
+        cursor.execute(COMPLETED_ORDER_PAIRS_SQL, (completed_at, completed_at, last_order_id, limit))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    kept = rows
+    if len(rows) == limit:
+        # The last order may be cut by the LIMIT; it is read again next time.
+        last = rows[-1][0]
+        kept = [row for row in rows if row[0] != last]
+        if not kept:
+            # One order has more than `limit` lines: skip it rather than count part of it.
+            logging.warning(f"Order {last} has more than {limit} lines; it is not streamed.")
+            return [], (int(rows[-1][2]), int(last))
+    orders = OrderedDict()
+    for order_id, product_id, order_completed_at in kept:
+        orders.setdefault(int(order_id), []).append(int(product_id))
+        watermark = (int(order_completed_at), int(order_id))
+    return list(orders.items()), watermark
+
+
+def tail_completed_orders(handle, watermark=None, poll_seconds=2.0, limit=5000):
+    """
+    Polls wp_wc_order_product_lookup for newly completed orders and passes each
+    batch to `handle(orders)`, forever. Starts from the newest completed order
+    when `watermark` is None.
+    """
+    from api.db import get_connection
+
+    while True:
+        connection = get_connection()
+        try:
+            if watermark is None:
+                watermark = latest_completed_watermark(connection)
+                print(f"Tailing orders completed after {watermark}.")
+            orders, watermark = fetch_completed_orders(connection, watermark, limit=limit)
+        finally:
+            connection.close()
+        if orders:
+            handle(orders)
+            print(f"Sent {len(orders)} orders (watermark {watermark}).")
+        else:
+            time.sleep(poll_seconds)
+
+
+def post_orders(server_url):
+    """
+    Returns a handler sending orders to the server's /api/orders/events endpoint.
+    """
+    import requests
+
+    def handle(orders):
+        payload = {'orders': [{'order_id': order_id, 'product_ids': product_ids} for order_id, product_ids in orders]}
+        response = requests.post(f"{server_url.rstrip('/')}/api/orders/events", json=payload, timeout=30)
+        response.raise_for_status()
+    return handle
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream completed orders to the recommendation server.")
+    parser.add_argument('--server', default='http://localhost:5000', help="Base URL of the Flask server.")
+    parser.add_argument('--since', type=int, default=None,
+                        help="Unix time to start from (default: only orders completed from now on).")
+    parser.add_argument('--poll-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tail_completed_orders(post_orders(args.server),
+                          watermark=(args.since, 0) if args.since is not None else None,
+                          poll_seconds=args.poll_seconds)
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.itemset_engines import as_item_matrix, transaction_weights
+
+# Orders per X.T @ X block; bounds the size of each intermediate product.
+DEFAULT_BLOCK_ROWS = 100000
+
+PAIR_COLUMNS = ['product_id_in', 'product_id_out', 'antecedent support', 'consequent support',
+                'support', 'confidence', 'lift']
+
+
+def cooccurrence_counts(matrix, block_rows=DEFAULT_BLOCK_ROWS, weights=None):
+    """
+    Counts items and item pairs with sparse X.T @ X products over blocks of
+    rows, so memory stays bounded by one block plus the pair counts.
+    Weighted rows (compacted baskets) are counted with X.T @ diag(w) @ X.
+
+    Args:
+        matrix (scipy.sparse matrix): Boolean transactions (rows = orders).
+        block_rows (int): Rows per block.
+        weights (np.ndarray): Optional number of orders behind each row (integers), or
+                              time-decayed float weights (the counts are then float64).
+
+    Returns:
+        tuple: (item_counts, pair_counts) where item_counts is an int64 array per
+               column and pair_counts is an upper-triangular CSR matrix holding
+               the number of transactions that contain both columns i < j.
+    """
+    matrix = sp.csr_matrix(matrix)
+    n_rows, n_columns = matrix.shape
+    dtype = np.float64 if weights is not None and weights.dtype.kind == 'f' else np.int64
+    item_counts = np.zeros(n_columns, dtype=dtype)
+    pair_counts = sp.csr_matrix((n_columns, n_columns), dtype=dtype)
+
+    for start in range(0, n_rows, block_rows):
+        block = matrix[start:start + block_rows].astype(dtype)
+        weighted = block
+        if weights is not None:
+            block_weights = np.asarray(weights[start:start + block_rows], dtype=dtype)
+            weighted = sp.diags(block_weights, dtype=dtype) @ block
+        item_counts += np.asarray(weighted.sum(axis=0)).ravel()
+        pair_counts = pair_counts + sp.triu(block.T @ weighted, k=1, format='csr')
+
+    pair_counts.eliminate_zeros()
+    return item_counts, pair_counts.tocsr()
+
+
+def pair_table(item_counts, pair_counts, n_transactions, labels, min_support, min_confidence, antecedents=None):
+    """
+    Derives every 1 -> 1 rule from item and pair counts with vectorized operations.
+
+    Args:
+        item_counts (np.ndarray): Count per column.
+        pair_counts (scipy.sparse matrix): Upper-triangular pair counts.
+        n_transactions (float): Number of transactions (the support denominator).
+        labels (np.ndarray): Product ID of each column.
+        min_support (float): Minimum support of the pair.
+        min_confidence (float): Minimum confidence of the rule.
+        antecedents (np.ndarray): Optional columns; keep only the rules whose antecedent is one of them.
+
+    Returns:
+        pd.DataFrame: One row per rule with PAIR_COLUMNS.
+    """
+    if n_transactions == 0 or pair_counts.nnz == 0:
+        return pd.DataFrame(columns=PAIR_COLUMNS)
+
+    coo = pair_counts.tocoo()
+    # Every stored pair (i, j) gives the rules i -> j and j -> i.
+    lhs = np.concatenate([coo.row, coo.col])
+    rhs = np.concatenate([coo.col, coo.row])
+    both = np.concatenate([coo.data, coo.data]).astype(float)
+
+    n = float(n_transactions)
+    support = both / n
+    confidence = both / item_counts[lhs]
+    keep = (support >= min_support) & (confidence >= min_confidence)
+    if antecedents is not None:
+        keep &= np.isin(lhs, antecedents)
+
+    lhs, rhs, support, confidence = lhs[keep], rhs[keep], support[keep], confidence[keep]
+    consequent_support = item_counts[rhs] / n
+    return pd.DataFrame({
+        'product_id_in': labels[lhs],
+        'product_id_out': labels[rhs],
+        'antecedent support': item_counts[lhs] / n,
+        'consequent support': consequent_support,
+        'support': support,
+        'confidence': confidence,
+        'lift': confidence / consequent_support,
+    }, columns=PAIR_COLUMNS)
+
+
+def pairs_to_rules(pairs):
+    """
+    Converts a pair table into the mlxtend rules layout (frozenset antecedents
+    and consequents), e.g. for predict() / RuleIndex.
+    """
+    rules = pairs.drop(columns=['product_id_in', 'product_id_out'])
+    rules.insert(0, 'antecedents', [frozenset((int(i),)) for i in pairs['product_id_in']])
+    rules.insert(1, 'consequents', [frozenset((int(i),)) for i in pairs['product_id_out']])
+    return rules
+
+
+def pairwise_rules(transactions, min_support, min_confidence, block_rows=DEFAULT_BLOCK_ROWS, workers=1):
+    """
+    Pairwise mode: all 1 -> 1 rules from one blocked X.T @ X co-occurrence
+    count, without frequent-itemset mining.
+
+    Args:
+        transactions (TransactionMatrix | scipy.sparse matrix | pd.DataFrame): The transactions.
+        min_support (float): Minimum support of the pair.
+        min_confidence (float): Minimum confidence of the rule.
+        block_rows (int): Rows per X.T @ X block.
+        workers (int): Processes counting row shards (see parallel_counting); 1 counts in-process.
+
+    Returns:
+        pd.DataFrame: One row per rule with PAIR_COLUMNS (product IDs, not frozensets).
+    """
+    matrix, labels = as_item_matrix(transactions)
+    weights = transaction_weights(transactions)
+    if workers > 1:
+        from api.association.parallel_counting import parallel_cooccurrence_counts
+        item_counts, pair_counts = parallel_cooccurrence_counts(
+            matrix, workers=workers, block_rows=block_rows, weights=weights)
+    else:
+        item_counts, pair_counts = cooccurrence_counts(matrix, block_rows=block_rows, weights=weights)
+    n_transactions = matrix.shape[0] if weights is None else weights.sum()
+    return pair_table(item_counts, pair_counts, n_transactions, labels, min_support, min_confidence)
@@ -0,0 +1,241 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.pairwise import DEFAULT_BLOCK_ROWS, cooccurrence_counts
+
+# Worker processes used for support counting (ASSOCIATION_WORKERS overrides it).
+DEFAULT_WORKERS = int(os.environ.get('ASSOCIATION_WORKERS', min(4, os.cpu_count() or 1)))
+# Below this many orders the pool start-up costs more than it saves.
+MIN_PARALLEL_ROWS = 50000
+
+
+def itemset_support_counts(matrix, itemsets, weights=None):
+    """
+    Counts the transactions that contain each itemset with one sparse product:
+    matrix @ C, where column c of C marks the items of itemset c, gives per
+    order the number of items of each itemset it holds; an order supports the
+    itemset when that number equals the itemset length.
+
+    Args:
+        matrix (scipy.sparse matrix): Boolean transactions (rows = orders).
+        itemsets (list): Itemsets as sequences of column indices.
+        weights (np.ndarray): Optional number of orders behind each row.
+
+    Returns:
+        np.ndarray: int64 count per itemset.
+    """
+    if not len(itemsets):
+        return np.zeros(0, dtype=np.int64)
+    lengths = np.fromiter((len(itemset) for itemset in itemsets), dtype=np.int64, count=len(itemsets))
+    columns = np.fromiter((item for itemset in itemsets for item in itemset), dtype=np.int64, count=int(lengths.sum()))
+    candidates = sp.csr_matrix(
+        (np.ones(len(columns), dtype=np.int32), (columns, np.repeat(np.arange(len(itemsets)), lengths))),
+        shape=(matrix.shape[1], len(itemsets)))
+
+    hits = (sp.csr_matrix(matrix, dtype=np.int32) @ candidates).tocsr()
+    complete = hits.data == lengths[hits.indices]
+    if weights is None:
+        return np.bincount(hits.indices[complete], minlength=len(itemsets)).astype(np.int64)
+    rows = np.repeat(np.arange(hits.shape[0]), np.diff(hits.indptr))
+    counts = np.bincount(hits.indices[complete], weights=weights[rows[complete]], minlength=len(itemsets))
+    return counts if weights.dtype.kind == 'f' else counts.astype(np.int64)
+
+
+# ---- Shared-memory transport of the CSR matrix ----
+
+def _share_array(array, blocks):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _attach_array(descriptor, blocks):
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _attach_shard(shared, start, end, blocks):
+    """
+    Rebuilds rows [start, end) of the shared matrix without copying its indices.
+
+    Returns:
+        tuple: (csr_matrix, weights of the rows or None)
+    """
+    indptr = _attach_array(shared['indptr'], blocks)
+    indices = _attach_array(shared['indices'], blocks)
+    shard_indptr = indptr[start:end + 1] - indptr[start]
+    shard_indices = indices[indptr[start]:indptr[end]]
+    data = np.ones(len(shard_indices), dtype=bool)
+    weights = None
+    if shared['weights'] is not None:
+        weights = _attach_array(shared['weights'], blocks)[start:end]
+    return sp.csr_matrix((data, shard_indices, shard_indptr), shape=(end - start, shared['n_columns'])), weights
+
+
+def _count_pairs_shard(shared, start, end, block_rows):
+    blocks = []
+    try:
+        shard, weights = _attach_shard(shared, start, end, blocks)
+        return cooccurrence_counts(shard, block_rows=block_rows, weights=weights)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def _count_itemsets_shard(shared, start, end, itemsets):
+    blocks = []
+    try:
+        shard, weights = _attach_shard(shared, start, end, blocks)
+        return itemset_support_counts(shard, itemsets, weights=weights)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def shard_bounds(matrix, n_shards):
+    """
+    Splits the rows into `n_shards` contiguous ranges holding about the same
+    number of non-zeros (the counting cost follows the items, not the orders).
+
+    Returns:
+        list: (start, end) row ranges, empty ranges removed.
+    """
+    indptr = matrix.indptr
+    targets = np.linspace(0, indptr[-1], n_shards + 1)
+    cuts = np.searchsorted(indptr, targets, side='left')
+    cuts[0], cuts[-1] = 0, matrix.shape[0]
+    cuts = np.maximum.accumulate(cuts)
+    return [(int(start), int(end)) for start, end in zip(cuts[:-1], cuts[1:]) if end > start]
+
+
+def _run_sharded(matrix, weights, workers, task, *task_args):
+    """
+    Publishes the CSR matrix in shared memory, runs `task(shared, start, end, *task_args)`
+    on every shard in a process pool and returns the partial results in shard order.
+    """
+    matrix = sp.csr_matrix(matrix)
+    blocks = []
+    try:
+        shared = {
+            'indptr': _share_array(matrix.indptr.astype(np.int64), blocks),
+            'indices': _share_array(matrix.indices, blocks),
+            'weights': _share_array(np.asarray(weights), blocks) if weights is not None else None,
+            'n_columns': matrix.shape[1],
+        }
+        bounds = shard_bounds(matrix, workers)
+        # 'spawn' keeps workers from inheriting the server's threads and locks.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(bounds), mp_context=context) as pool:
+            futures = [pool.submit(task, shared, start, end, *task_args) for start, end in bounds]
+            return [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def parallel_cooccurrence_counts(matrix, workers=DEFAULT_WORKERS, block_rows=DEFAULT_BLOCK_ROWS, weights=None):
+    """
+    Same result as pairwise.cooccurrence_counts(), counted over row shards in
+    `workers` processes and merged. Integer counts make the merge exact
+    (decayed float counts may differ in the last bits from the summation order).
+
+    Returns:
+        tuple: (item_counts, pair_counts) as in cooccurrence_counts().
+    """
+    if workers <= 1 or matrix.shape[0] < MIN_PARALLEL_ROWS:
+        return cooccurrence_counts(matrix, block_rows=block_rows, weights=weights)
+
+    partials = _run_sharded(matrix, weights, workers, _count_pairs_shard, block_rows)
+    item_counts = np.zeros(matrix.shape[1], dtype=partials[0][0].dtype)
+    pair_counts = sp.csr_matrix((matrix.shape[1], matrix.shape[1]), dtype=partials[0][0].dtype)
+    for shard_items, shard_pairs in partials:
+        item_counts += shard_items
+        pair_counts = pair_counts + shard_pairs
+    logging.info(f"Counted {matrix.shape[0]} orders in {len(partials)} shards.")
+    return item_counts, pair_counts.tocsr()
+
+
+def parallel_itemset_support_counts(matrix, itemsets, workers=DEFAULT_WORKERS, weights=None):
+    """
+    Same result as itemset_support_counts(), counted over row shards in
+    `workers` processes and summed.
+    """
+    if workers <= 1 or matrix.shape[0] < MIN_PARALLEL_ROWS or not len(itemsets):
+        return itemset_support_counts(matrix, itemsets, weights=weights)
+
+    itemsets = [tuple(int(item) for item in itemset) for itemset in itemsets]
+    partials = _run_sharded(matrix, weights, workers, _count_itemsets_shard, itemsets)
+    return np.sum(partials, axis=0)
+
+
+def apriori_candidates(frequent):
+    """
+    Apriori candidate generation: joins the sorted frequent (k-1)-itemsets that
+    share their first k-2 items and keeps the candidates whose every
+    (k-1)-subset is frequent.
+    """
+    frequent_set = set(frequent)
+    by_prefix = {}
+    for itemset in frequent:
+        by_prefix.setdefault(itemset[:-1], []).append(itemset[-1])
+    candidates = []
+    for prefix, lasts in by_prefix.items():
+        lasts.sort()
+        for i, first in enumerate(lasts):
+            for second in lasts[i + 1:]:
+                candidate = prefix + (first, second)
+                if all(candidate[:j] + candidate[j + 1:] in frequent_set for j in range(len(prefix))):
+                    candidates.append(candidate)
+    return candidates
+
+
+def mine_sharded(matrix, min_support, max_len=None, workers=DEFAULT_WORKERS, weights=None):
+    """
+    Level-wise frequent-itemset mining whose support counting is sharded over
+    `workers` processes: items and pairs come from parallel_cooccurrence_counts(),
+    longer candidates from parallel_itemset_support_counts(). Returns the same
+    itemsets and supports as the other engines (mlxtend schema, column indices).
+    """
+    n_rows = matrix.shape[0] if weights is None else int(weights.sum())
+    if n_rows == 0:
+        return pd.DataFrame(columns=['support', 'itemsets'])
+
+    item_counts, pair_counts = parallel_cooccurrence_counts(matrix, workers=workers, weights=weights)
+    frequent_items = np.flatnonzero(item_counts / n_rows >= min_support)
+    supports = list(item_counts[frequent_items] / n_rows)
+    itemsets = [frozenset((int(item),)) for item in frequent_items]
+
+    if max_len is not None and max_len < 2:
+        return pd.DataFrame({'support': np.asarray(supports, dtype=float), 'itemsets': itemsets})
+
+    pairs = pair_counts.tocoo()
+    keep = pairs.data / n_rows >= min_support
+    rows, columns, counts = pairs.row[keep], pairs.col[keep], pairs.data[keep]
+    level = list(zip(rows.tolist(), columns.tolist()))
+    supports.extend(counts / n_rows)
+    itemsets.extend(frozenset(itemset) for itemset in level)
+
+    length = 2
+    while level and (max_len is None or length < max_len):
+        candidates = apriori_candidates(level)
+        if not candidates:
+            break
+        counts = parallel_itemset_support_counts(matrix, candidates, workers=workers, weights=weights)
+        frequent = counts / n_rows >= min_support
+        level = [candidate for candidate, keep in zip(candidates, frequent) if keep]
+        supports.extend(counts[frequent] / n_rows)
+        itemsets.extend(frozenset(itemset) for itemset in level)
+        length += 1
+
+    return pd.DataFrame({'support': np.asarray(supports, dtype=float), 'itemsets': itemsets})
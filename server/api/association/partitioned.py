@@ -0,0 +1,201 @@
+import heapq
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.itemset_engines import FREQUENT_ITEMSET_ENGINES, as_item_matrix, transaction_weights
+from api.association.parallel_counting import DEFAULT_WORKERS, apriori_candidates, parallel_itemset_support_counts
+
+# Category key of products without a 'product_cat' term.
+UNCATEGORIZED = -1
+# Partition thresholds are lowered by this relative margin so that rounding in
+# the rescaled support never drops an itemset; the exact global test follows.
+RESCALE_MARGIN = 1e-9
+
+
+def column_categories(product_ids, categories):
+    """
+    One category per column: the first 'product_cat' term of the product
+    (UNCATEGORIZED when it has none).
+
+    Args:
+        product_ids (np.ndarray): Product ID of every column.
+        categories (dict): product ID -> list of term IDs (catalog_cache.get_product_categories()).
+    """
+    return np.array([(categories.get(int(product_id)) or [UNCATEGORIZED])[0] for product_id in product_ids],
+                    dtype=np.int64)
+
+
+def category_costs(matrix, column_keys, weights=None):
+    """
+    Estimated mining work of every category: the number of item pairs its
+    orders hold inside the category, sum over orders of c * (c - 1) / 2 where
+    c is the number of the order's items in the category, plus its items.
+
+    Returns:
+        tuple: (category keys, cost per category)
+    """
+    keys, column_groups = np.unique(column_keys, return_inverse=True)
+    indicator = sp.csr_matrix((np.ones(len(column_groups), dtype=np.int64),
+                               (np.arange(len(column_groups)), column_groups)), shape=(len(column_groups), len(keys)))
+    per_order = (sp.csr_matrix(matrix, dtype=np.int64) @ indicator).tocoo()
+    row_weights = np.ones(len(per_order.data)) if weights is None else weights[per_order.row]
+    work = row_weights * (per_order.data * (per_order.data - 1) / 2.0 + per_order.data)
+    return keys, np.bincount(per_order.col, weights=work, minlength=len(keys))
+
+
+def balance_partitions(costs, n_partitions):
+    """
+    Longest-processing-time-first packing: the categories, most expensive
+    first, each go to the partition with the least work so far.
+
+    Returns:
+        list: Per non-empty partition, the positions of its categories.
+    """
+    loads = [(0.0, partition) for partition in range(n_partitions)]
+    members = [[] for _ in range(n_partitions)]
+    for position in np.argsort(-np.asarray(costs), kind='stable'):
+        load, partition = heapq.heappop(loads)
+        members[partition].append(int(position))
+        heapq.heappush(loads, (load + float(costs[position]), partition))
+    return [partition for partition in members if partition]
+
+
+def _mine_partition(matrix, weights, min_count, max_len, engine):
+    """
+    Mines one partition (only its columns, only the orders that hold one of
+    them) at the support rescaled to its own row count.
+
+    Returns:
+        tuple: (itemsets as tuples of partition column indices, their counts)
+    """
+    n_rows = matrix.shape[0] if weights is None else weights.sum()
+    if n_rows == 0 or n_rows < min_count:
+        return [], np.zeros(0, dtype=np.int64)
+    rescaled = min(min_count / n_rows * (1 - RESCALE_MARGIN), 1.0)
+    frequent = FREQUENT_ITEMSET_ENGINES[engine](matrix, rescaled, max_len=max_len, weights=weights)
+    counts = np.rint(frequent['support'].to_numpy(dtype=float) * n_rows).astype(np.int64)
+    return [tuple(sorted(itemset)) for itemset in frequent['itemsets']], counts
+
+
+def partitioned_frequent_itemsets(transactions, min_support, categories, max_len=None, engine='eclat',
+                                  workers=DEFAULT_WORKERS, n_partitions=None, cross_min_support=None):
+    """
+    Frequent itemsets mined per group of product categories.
+
+    The columns are grouped by category, and the categories are packed into
+    `n_partitions` partitions of about equal estimated work
+    (balance_partitions()). Every partition is mined on its own columns in a
+    process pool, at min_support rescaled from all orders to the orders that
+    hold one of its products. This finds every frequent itemset that lies
+    inside one partition.
+
+    A cross pass then recovers the itemsets spanning partitions. Cross pairs
+    come from the off-diagonal blocks of X.T @ X. Longer cross itemsets come
+    from Apriori candidates over all frequent itemsets, keeping only the
+    candidates that span partitions. With cross_min_support == min_support
+    the result is the same as mining all products at once.
+
+    Args:
+        transactions (TransactionMatrix): The transactions (unweighted or compacted).
+        min_support (float): Minimum support within a partition.
+        categories (dict): product ID -> 'product_cat' term IDs.
+        max_len (int): Optional maximum itemset length.
+        engine (str): Engine mining the partitions (not 'sharded').
+        workers (int): Processes mining partitions / counting cross candidates.
+        n_partitions (int): Number of partitions (defaults to `workers`).
+        cross_min_support (float): Threshold of the cross pass (defaults to
+                                   min_support; higher drops rare cross-category
+                                   itemsets for speed).
+
+    Returns:
+        pd.DataFrame: 'support' and 'itemsets' (frozensets of product IDs), as
+                      itemset_engines.mine_frequent_itemsets().
+    """
+    if engine == 'sharded' or engine not in FREQUENT_ITEMSET_ENGINES:
+        raise ValueError(f"Engine '{engine}' cannot mine partitions.")
+    cross_min_support = min_support if cross_min_support is None else cross_min_support
+    if cross_min_support < min_support:
+        raise ValueError("cross_min_support cannot be lower than min_support.")
+
+    matrix, labels = as_item_matrix(transactions)
+    matrix = sp.csr_matrix(matrix)
+    weights = transaction_weights(transactions)
+    n_total = matrix.shape[0] if weights is None else int(weights.sum())
+    if n_total == 0:
+        return pd.DataFrame(columns=['support', 'itemsets'])
+    min_count = min_support * n_total
+
+    # ---- partitions ----
+    column_keys = column_categories(labels, categories)
+    keys, costs = category_costs(matrix, column_keys, weights)
+    groups = balance_partitions(costs, n_partitions or max(workers, 1))
+    column_partition = np.empty(matrix.shape[1], dtype=np.int64)
+    partition_columns = []
+    for partition, members in enumerate(groups):
+        columns = np.flatnonzero(np.isin(column_keys, keys[members]))
+        column_partition[columns] = partition
+        partition_columns.append(columns)
+    logging.info(f"Partitioned {len(keys)} categories into {len(groups)} partitions; "
+                 f"estimated work per partition: {[round(float(costs[m].sum())) for m in groups]}")
+
+    tasks = []
+    for columns in partition_columns:
+        sub = matrix[:, columns]
+        rows = np.flatnonzero(np.diff(sub.indptr))
+        tasks.append((sub[rows], None if weights is None else weights[rows], min_count, max_len, engine))
+    if workers > 1 and len(tasks) > 1:
+        # 'spawn' keeps workers from inheriting the server's threads and locks.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as pool:
+            results = list(pool.map(_mine_partition, *zip(*tasks)))
+    else:
+        results = [_mine_partition(*task) for task in tasks]
+
+    frequent = {}
+    for columns, (itemsets, counts) in zip(partition_columns, results):
+        for itemset, count in zip(itemsets, counts.tolist()):
+            # The exact global test, as a run over all products would do it.
+            if count / n_total >= min_support:
+                frequent[tuple(int(columns[item]) for item in itemset)] = count
+
+    # ---- cross pass: pairs ----
+    cross_level = []
+    if (max_len is None or max_len >= 2) and len(partition_columns) > 1:
+        weighted = matrix if weights is None else sp.diags(weights, dtype=np.int64) @ sp.csr_matrix(matrix, dtype=np.int64)
+        for partition, columns in enumerate(partition_columns[:-1]):
+            later = np.concatenate(partition_columns[partition + 1:])
+            block = (sp.csr_matrix(weighted[:, columns], dtype=np.int64).T
+                     @ sp.csr_matrix(matrix[:, later], dtype=np.int64)).tocoo()
+            keep = block.data / n_total >= cross_min_support
+            for first, second, count in zip(columns[block.row[keep]].tolist(), later[block.col[keep]].tolist(),
+                                            block.data[keep].tolist()):
+                pair = (first, second) if first < second else (second, first)
+                frequent[pair] = count
+                cross_level.append(pair)
+
+    # ---- cross pass: longer itemsets ----
+    length = 2
+    while cross_level and (max_len is None or length < max_len):
+        level = [itemset for itemset in frequent if len(itemset) == length]
+        candidates = [candidate for candidate in apriori_candidates(sorted(level))
+                      if len(set(column_partition[list(candidate)].tolist())) > 1]
+        if not candidates:
+            break
+        counts = parallel_itemset_support_counts(matrix, candidates, workers=workers, weights=weights)
+        cross_level = [candidate for candidate, count in zip(candidates, counts.tolist())
+                       if count / n_total >= cross_min_support]
+        for candidate, count in zip(candidates, counts.tolist()):
+            if count / n_total >= cross_min_support:
+                frequent[candidate] = count
+        length += 1
+
+    itemsets = list(frequent)
+    return pd.DataFrame({
+        'support': np.array([frequent[itemset] for itemset in itemsets], dtype=float) / n_total,
+        'itemsets': [frozenset(labels[list(itemset)].tolist()) for itemset in itemsets],
+    })
@@ -0,0 +1,71 @@
+import numpy as np
+
+# Recommendations kept per antecedent product; the storefront shows at most 6.
+DEFAULT_TOP_K = 20
+# Rule metrics a top-k can rank by (columns of the pair and rule tables).
+TOP_K_METRICS = ('confidence', 'lift', 'support')
+
+
+def top_k_per_group(groups, scores, k):
+    """
+    Positions of the `k` highest-scoring rows of every group, without sorting
+    the groups.
+
+    Groups of at most k rows are kept whole. Larger groups are laid out as the
+    rows of a padded 2D array (one array per power-of-two size class, so the
+    padding at most doubles the memory) and partitioned with one
+    np.argpartition(axis=1) call per size class. Ties at the k-th score are
+    broken arbitrarily.
+
+    Args:
+        groups (np.ndarray): Group key of each row (e.g. the antecedent product ID).
+        scores (np.ndarray): Score of each row; higher is better.
+        k (int): Rows kept per group.
+
+    Returns:
+        np.ndarray: Sorted positions of the kept rows.
+    """
+    groups = np.asarray(groups)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_rows = len(groups)
+    if k is None or n_rows == 0:
+        return np.arange(n_rows)
+
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, n_rows])
+
+    kept = [order[np.repeat(sizes, sizes) <= k]]
+    large = np.flatnonzero(sizes > k)
+    size_classes = np.ceil(np.log2(sizes[large])).astype(np.int64)
+    for size_class in np.unique(size_classes):
+        members = large[size_classes == size_class]
+        width = int(sizes[members].max())
+        padded = np.full((len(members), width), -np.inf)
+        member_rows = np.repeat(np.arange(len(members)), sizes[members])
+        offsets = np.arange(len(member_rows)) - np.repeat(np.cumsum(sizes[members]) - sizes[members], sizes[members])
+        sorted_positions = np.repeat(starts[members], sizes[members]) + offsets
+        padded[member_rows, offsets] = scores[order[sorted_positions]]
+        # The k smallest of -score are the k largest scores; padding is never picked.
+        best = np.argpartition(-padded, k - 1, axis=1)[:, :k]
+        kept.append(order[(starts[members][:, None] + best).ravel()])
+    return np.sort(np.concatenate(kept))
+
+
+def top_k_pairs(pairs, k=DEFAULT_TOP_K, metric='confidence'):
+    """
+    Keeps the `k` best consequents of every antecedent of a pair table
+    ('product_id_in', 'product_id_out' and the `metric` column).
+
+    Returns:
+        pd.DataFrame: The kept rows in their original order (all rows when k is None).
+    """
+    if metric not in TOP_K_METRICS:
+        raise ValueError(f"metric must be one of {TOP_K_METRICS}")
+    if k is None or pairs.empty:
+        return pairs
+    if metric not in pairs.columns:
+        raise ValueError(f"The pairs have no '{metric}' column to rank by.")
+    positions = top_k_per_group(pairs['product_id_in'].to_numpy(), pairs[metric].to_numpy(), k)
+    return pairs.iloc[positions].reset_index(drop=True)
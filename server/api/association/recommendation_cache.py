@@ -0,0 +1,164 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from api.association.pruning import DEFAULT_TOP_K
+from api.association.recommendation_index import add_publish_listener, get_live_index
+from api.catalog_cache import catalog_cache
+
+# Recommendations returned when the request has no ?k= (the storefront shows 6).
+DEFAULT_RESPONSE_K = 6
+# Largest ?k= served; the index keeps at most DEFAULT_TOP_K per product anyway.
+MAX_RESPONSE_K = DEFAULT_TOP_K
+# Responses kept in memory before the least recently used ones are evicted.
+DEFAULT_MAX_RESPONSES = 50000
+# Seconds the CDN and browsers may reuse a response before revalidating it.
+RESPONSE_MAX_AGE = 60
+# Products plus baskets accepted by one batch request.
+MAX_BATCH_SIZE = 100
+# Product IDs are WordPress post IDs (unsigned 32-bit in practice); larger
+# or non-positive values are rejected before they reach the index.
+MAX_PRODUCT_ID = 2 ** 31
+
+
+def is_product_id(value):
+    """
+    True for an int (not a bool) in 0 < value < MAX_PRODUCT_ID.
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value < MAX_PRODUCT_ID
+
+
+class CachedResponse:
+    """
+    A rendered JSON body, its ETag (unquoted; a hash of the body) and the
+    generation of the index it was rendered from.
+
+    The body only holds the product's recommendations, so its ETag stays the
+    same across publications that leave them unchanged (and across server
+    processes, whose generation counters differ).
+    """
+
+    def __init__(self, body, etag, generation):
+        self.body = body
+        self.etag = etag
+        self.generation = generation
+
+
+def render_product_recommendations(index, product_id, k):
+    """
+    JSON body of one product's recommendations: its `k` best consequents by
+    confidence with their titles.
+    """
+    consequent_ids, confidences = index.lookup(product_id, k=k)
+    titles = catalog_cache.get_product_titles(consequent_ids.tolist()) if len(consequent_ids) else {}
+    payload = {
+        'ok': True,
+        'product_id': product_id,
+        'recommendations': [
+            {'product_id': int(consequent_id), 'post_title': titles.get(int(consequent_id), 'Not Found'),
+             'confidence': round(float(confidence), 6)}
+            for consequent_id, confidence in zip(consequent_ids, confidences)
+        ],
+    }
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def render_batch_recommendations(index, product_ids=(), baskets=(), k=DEFAULT_RESPONSE_K, aggregate='max'):
+    """
+    Recommendations of many products and baskets (e.g. a listing page and a
+    cart) from one RecommendationIndex.recommend_many() pass. Repeated
+    products and baskets are resolved once, and the titles of all returned
+    products are fetched with one catalog lookup.
+
+    Args:
+        index (RecommendationIndex): The live index.
+        product_ids (list): Products to get recommendations for.
+        baskets (list): Product ID lists, each scored as one cart.
+        k (int): Recommendations per product / basket.
+        aggregate (str): How a basket's matches are combined ('max' or 'sum').
+
+    Returns:
+        dict: 'products' (product ID -> recommendations with their confidence)
+              and 'baskets' (per basket, in request order, recommendations with their score).
+    """
+    product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+    baskets = [tuple(sorted({int(item) for item in basket})) for basket in baskets]
+    unique_baskets = list(dict.fromkeys(baskets))
+    results = index.recommend_many([[product_id] for product_id in product_ids] + unique_baskets,
+                                   k=k, aggregate=aggregate)
+
+    returned = np.unique(np.concatenate([ids for ids, _ in results])) if results else np.empty(0, dtype=np.int64)
+    titles = catalog_cache.get_product_titles(returned.tolist()) if len(returned) else {}
+
+    def entries(ids, scores, score_name):
+        return [{'product_id': int(product_id), 'post_title': titles.get(int(product_id), 'Not Found'),
+                 score_name: round(float(score), 6)} for product_id, score in zip(ids, scores)]
+
+    basket_results = dict(zip(unique_baskets, results[len(product_ids):]))
+    return {
+        'ok': True,
+        'generation': index.generation,
+        'products': {str(product_id): entries(*result, 'confidence')
+                     for product_id, result in zip(product_ids, results)},
+        'baskets': [{'items': list(basket), 'recommendations': entries(*basket_results[basket], 'score')}
+                    for basket in baskets],
+    }
+
+
+class RecommendationResponseCache:
+    """
+    Rendered product recommendation responses keyed by
+    (index generation, product ID, k).
+
+    The generation in the key means a response is never served from an older
+    rule set, even between a swap and the invalidation; the whole cache is
+    dropped when a new index goes live (register() hooks it to
+    recommendation_index's publish listeners).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_RESPONSES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product_id, k):
+        """
+        Returns the CachedResponse of a product, rendering it on a miss.
+        """
+        index = get_live_index()
+        key = (index.generation, product_id, k)
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self.misses += 1
+
+        body = render_product_recommendations(index, product_id, k)
+        response = CachedResponse(body, hashlib.sha1(body).hexdigest()[:20], index.generation)
+        with self._lock:
+            self._entries[key] = response
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return response
+
+    def invalidate(self, index=None):
+        with self._lock:
+            self._entries.clear()
+
+    def register(self):
+        add_publish_listener(self.invalidate)
+        return self
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by the request threads of the server.
+response_cache = RecommendationResponseCache().register()
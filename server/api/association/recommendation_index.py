@@ -0,0 +1,378 @@
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+from api.association.pruning import top_k_per_group
+from api.association.rule_index import AGGREGATIONS
+from api.association.rule_snapshot import read_snapshot, snapshot_identity, write_snapshot
+from api.db import make_connection_with_db
+
+# Binary snapshot (see rule_snapshot.py) written by the association job and
+# memory-mapped by every server worker.
+DEFAULT_INDEX_SNAPSHOT_PATH = 'recommendation_index.bin'
+# Seconds between two checks of the snapshot file for a new version.
+SNAPSHOT_CHECK_INTERVAL = 1.0
+
+RECOMMENDATIONS_SQL = 'SELECT product_id_in, product_id_out, confidence FROM custom_products_association'
+
+
+class RecommendationIndex:
+    """
+    Read-optimized map of product_id -> recommended products.
+
+    Stored CSR style: `product_ids` is sorted, and the recommendations of
+    product_ids[i] are consequent_ids[offsets[i]:offsets[i + 1]] with their
+    confidences, presorted by confidence (highest first). A lookup is one
+    binary search plus two array slices.
+    """
+
+    def __init__(self, product_ids, offsets, consequent_ids, confidences, generation=0):
+        self.product_ids = product_ids
+        self.offsets = offsets
+        self.consequent_ids = consequent_ids
+        self.confidences = confidences
+        self.generation = generation
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                   np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+    @classmethod
+    def from_pairs(cls, product_id_in, product_id_out, confidence):
+        """
+        Builds the index from parallel arrays of (antecedent, consequent, confidence).
+        """
+        product_id_in = np.asarray(product_id_in, dtype=np.int64)
+        product_id_out = np.asarray(product_id_out, dtype=np.int64)
+        confidence = np.asarray(confidence, dtype=np.float32)
+        if len(product_id_in) == 0:
+            return cls.empty()
+
+        # Group by antecedent, strongest confidence first inside each group.
+        order = np.lexsort((-confidence, product_id_in))
+        product_id_in = product_id_in[order]
+        starts = np.flatnonzero(np.r_[True, product_id_in[1:] != product_id_in[:-1]])
+        return cls(
+            product_ids=product_id_in[starts],
+            offsets=np.append(starts, len(product_id_in)).astype(np.int64),
+            consequent_ids=product_id_out[order],
+            confidences=confidence[order],
+        )
+
+    @classmethod
+    def from_frame(cls, pairs):
+        """
+        Builds the index from a DataFrame with 'product_id_in', 'product_id_out'
+        and 'confidence' columns (e.g. best_confidence_pairs() output).
+        """
+        return cls.from_pairs(pairs['product_id_in'].to_numpy(), pairs['product_id_out'].to_numpy(),
+                              pairs['confidence'].to_numpy())
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    @property
+    def n_recommendations(self):
+        return len(self.consequent_ids)
+
+    def _slice(self, product_id):
+        position = np.searchsorted(self.product_ids, product_id)
+        if position >= len(self.product_ids) or self.product_ids[position] != product_id:
+            return 0, 0
+        return self.offsets[position], self.offsets[position + 1]
+
+    def lookup(self, product_id, k=None):
+        """
+        Returns the recommendations of one product.
+
+        Returns:
+            tuple: (consequent_ids, confidences) arrays sorted by confidence,
+                   at most `k` long; empty arrays for unknown products.
+        """
+        start, end = self._slice(int(product_id))
+        if k is not None:
+            end = min(end, start + k)
+        return self.consequent_ids[start:end], self.confidences[start:end]
+
+    def recommend_many(self, baskets, k=6, aggregate='max'):
+        """
+        Scores many baskets in one vectorized pass over the index: the
+        recommendations of every basket item are gathered at once, products
+        already in their basket are dropped, and each (basket, product) gets
+        the max (or sum) of its confidences, as RuleIndex.recommend() does.
+        Repeated items of a basket are counted once.
+        A single-product basket gives that product's lookup().
+
+        Returns:
+            list: Per basket, (consequent_ids, scores) arrays, best first, at most k long.
+        """
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f"aggregate must be one of {AGGREGATIONS}")
+        sizes = np.fromiter((len(basket) for basket in baskets), dtype=np.int64, count=len(baskets))
+        items = np.fromiter((int(item) for basket in baskets for item in basket), dtype=np.int64, count=sizes.sum())
+        item_baskets = np.repeat(np.arange(len(baskets)), sizes)
+        # A product repeated in a basket counts once (with 'sum' it would count twice).
+        order = np.lexsort((items, item_baskets))
+        items, item_baskets = items[order], item_baskets[order]
+        first = np.r_[True, (items[1:] != items[:-1]) | (item_baskets[1:] != item_baskets[:-1])]
+        items, item_baskets = items[first], item_baskets[first]
+
+        # Index slice of every basket item (empty for unknown products).
+        positions = np.searchsorted(self.product_ids, items)
+        found = positions < len(self.product_ids)
+        found[found] = self.product_ids[positions[found]] == items[found]
+        starts = np.where(found, self.offsets[np.minimum(positions, len(self.product_ids) - 1)], 0)
+        lengths = np.where(found, self.offsets[np.minimum(positions + 1, len(self.product_ids))] - starts, 0)
+        rows = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        row_baskets = np.repeat(item_baskets, lengths)
+        consequents = np.asarray(self.consequent_ids[rows], dtype=np.int64)
+        scores = np.asarray(self.confidences[rows], dtype=np.float64)
+
+        # (basket, product) keys over dense product codes, so they stay small
+        # whatever the IDs: drop the basket's own items, then aggregate.
+        products, codes = np.unique(np.concatenate([consequents, items]), return_inverse=True)
+        width = max(len(products), 1)
+        keys = row_baskets * width + codes[:len(consequents)]
+        keep = ~np.isin(keys, item_baskets * width + codes[len(consequents):])
+        keys, scores = keys[keep], scores[keep]
+        unique_keys, groups = np.unique(keys, return_inverse=True)
+        if aggregate == 'sum':
+            merged = np.bincount(groups, weights=scores, minlength=len(unique_keys))
+        else:
+            merged = np.full(len(unique_keys), -np.inf)
+            np.maximum.at(merged, groups, scores)
+        merged_baskets = unique_keys // width
+        kept = top_k_per_group(merged_baskets, merged, k)
+
+        # Best first inside each basket.
+        order = kept[np.lexsort((-merged[kept], merged_baskets[kept]))]
+        bounds = np.searchsorted(merged_baskets[order], np.arange(len(baskets) + 1))
+        return [(products[unique_keys[order[start:end]] % width], merged[order[start:end]])
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def with_overrides(self, product_ids, consequent_ids, confidences):
+        """
+        Returns a new index where the recommendations of `product_ids` are
+        replaced by the given ones (products not in the index are added).
+        The other groups are copied as they are, without re-sorting.
+
+        Args:
+            product_ids (list): Antecedents to replace.
+            consequent_ids (list): Per antecedent, its consequents sorted by confidence.
+            confidences (list): Per antecedent, the matching confidences.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        order = np.argsort(product_ids, kind='stable')
+        product_ids = product_ids[order]
+        new_lengths = np.fromiter((len(consequent_ids[i]) for i in order), dtype=np.int64, count=len(order))
+
+        all_ids = np.union1d(self.product_ids, product_ids)
+        old_lengths = np.diff(self.offsets)
+        lengths = np.zeros(len(all_ids), dtype=np.int64)
+        old_positions = np.searchsorted(all_ids, self.product_ids)
+        lengths[old_positions] = old_lengths
+        new_positions = np.searchsorted(all_ids, product_ids)
+        lengths[new_positions] = new_lengths
+        offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+        out_ids = np.empty(offsets[-1], dtype=self.consequent_ids.dtype)
+        out_confidences = np.empty(offsets[-1], dtype=np.float32)
+        # Rows of the groups that are not replaced move to their new offset.
+        row_groups = np.repeat(np.arange(len(self.product_ids)), old_lengths)
+        kept = ~np.isin(self.product_ids, product_ids)[row_groups]
+        rows = np.flatnonzero(kept)
+        targets = offsets[old_positions[row_groups[rows]]] + rows - self.offsets[row_groups[rows]]
+        out_ids[targets] = self.consequent_ids[rows]
+        out_confidences[targets] = self.confidences[rows]
+        if len(order):
+            targets = np.repeat(offsets[new_positions], new_lengths) + (
+                np.arange(new_lengths.sum()) - np.repeat(np.cumsum(new_lengths) - new_lengths, new_lengths))
+            out_ids[targets] = np.concatenate([np.asarray(consequent_ids[i], dtype=np.int64) for i in order])
+            out_confidences[targets] = np.concatenate([np.asarray(confidences[i], dtype=np.float32) for i in order])
+
+        # Products left without recommendations are dropped.
+        present = lengths > 0
+        return RecommendationIndex(all_ids[present], np.r_[0, np.cumsum(lengths[present])].astype(np.int64),
+                                   out_ids, out_confidences)
+
+    def save(self, path=DEFAULT_INDEX_SNAPSHOT_PATH):
+        """
+        Writes the index as a binary snapshot, atomically (temporary file + rename).
+        """
+        write_snapshot(path, self.product_ids, self.offsets, self.consequent_ids, self.confidences,
+                       generation=self.generation)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_SNAPSHOT_PATH):
+        """
+        Opens a snapshot without reading it: the arrays are views on a
+        read-only memory map shared with the other processes using the file.
+        """
+        data = read_snapshot(path)
+        return cls(data['product_ids'], data['offsets'], data['consequent_ids'], data['confidences'],
+                   generation=data['generation'])
+
+
+def load_index_from_db(fetch_size=50000):
+    """
+    Builds a RecommendationIndex from the 'custom_products_association' table
+    with one streamed query.
+
+    Returns:
+        RecommendationIndex: The index, or None if the table could not be read.
+    """
+    connection, cursor = make_connection_with_db(dictionary=False)
+    if connection is None or cursor is None:
+        logging.error("Database connection failed in load_index_from_db.")
+        return None
+    try:
+        cursor.execute(RECOMMENDATIONS_SQL)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunks.append(np.asarray(rows, dtype=np.float64).reshape(-1, 3))
+    except Exception as e:
+        logging.error(f"Error loading the recommendation index from the database: {e}", exc_info=True)
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
+    if not chunks:
+        return RecommendationIndex.empty()
+    rows = np.concatenate(chunks)
+    return RecommendationIndex.from_pairs(rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2])
+
+
+# ---- Process-wide live index ----
+
+_live_index = None
+_generation = 0
+_swap_lock = threading.Lock()
+# Identity of the snapshot file behind the live index, and when it was last checked.
+_snapshot = {'path': DEFAULT_INDEX_SNAPSHOT_PATH, 'identity': None, 'checked': 0.0}
+# Callables notified with every newly live index (e.g. to drop response caches).
+_publish_listeners = []
+
+
+def add_publish_listener(listener):
+    """
+    Registers `listener(index)`, called after every swap of the live index,
+    whether published in this process or reopened from a new snapshot.
+    """
+    _publish_listeners.append(listener)
+
+
+def _notify_listeners(index):
+    for listener in list(_publish_listeners):
+        try:
+            listener(index)
+        except Exception as e:
+            logging.error(f"Recommendation index listener failed: {e}", exc_info=True)
+
+
+def publish_index(index, snapshot_path=DEFAULT_INDEX_SNAPSHOT_PATH):
+    """
+    Atomically replaces the live index (readers keep using the old one until
+    they fetch the new reference) and, if `snapshot_path` is set, saves it so
+    the other server workers and the next server start pick it up without
+    touching MySQL.
+    """
+    global _live_index, _generation
+    with _swap_lock:
+        if snapshot_path:
+            # Continue from the file's generation, which may come from another process.
+            _generation = max(_generation, _snapshot_generation(snapshot_path))
+        _generation += 1
+        index.generation = _generation
+        if snapshot_path:
+            index.save(snapshot_path)
+            # This process already serves the new index; do not reopen its own file.
+            _snapshot.update(path=snapshot_path, identity=snapshot_identity(snapshot_path))
+        _live_index = index
+    logging.info(f"Published recommendation index generation {index.generation} "
+                 f"({len(index)} products, {index.n_recommendations} recommendations).")
+    _notify_listeners(index)
+    return index
+
+
+def reload_index(snapshot_path=DEFAULT_INDEX_SNAPSHOT_PATH, from_db=False):
+    """
+    Loads the index from the snapshot file (or the database when there is no
+    snapshot or `from_db` is set) and publishes it.
+    """
+    if not from_db and snapshot_path and os.path.exists(snapshot_path):
+        return _open_snapshot(snapshot_path)
+    index = load_index_from_db()
+    if index is None:
+        return None
+    return publish_index(index, snapshot_path=snapshot_path)
+
+
+def _snapshot_generation(snapshot_path):
+    try:
+        return read_snapshot(snapshot_path)['generation']
+    except (OSError, ValueError):
+        return 0
+
+
+def _open_snapshot(snapshot_path):
+    """
+    Maps the snapshot file and makes it the live index. Its generation is the
+    one the file was written with (so every worker reports the same one),
+    unless this process already went past it with in-process updates.
+    """
+    global _live_index, _generation
+    identity = snapshot_identity(snapshot_path)
+    index = RecommendationIndex.load(snapshot_path)
+    with _swap_lock:
+        _generation = max(_generation + 1, index.generation)
+        index.generation = _generation
+        _snapshot.update(path=snapshot_path, identity=identity, checked=time.monotonic())
+        _live_index = index
+    logging.info(f"Opened recommendation snapshot {snapshot_path} generation {index.generation} "
+                 f"({len(index)} products, {index.n_recommendations} recommendations).")
+    _notify_listeners(index)
+    return index
+
+
+def _check_snapshot():
+    """
+    Reopens the snapshot when another process renamed a new version over it
+    (checked at most every SNAPSHOT_CHECK_INTERVAL seconds).
+    """
+    now = time.monotonic()
+    if now - _snapshot['checked'] < SNAPSHOT_CHECK_INTERVAL:
+        return
+    _snapshot['checked'] = now
+    identity = snapshot_identity(_snapshot['path'])
+    if identity is not None and identity != _snapshot['identity']:
+        try:
+            _open_snapshot(_snapshot['path'])
+        except (OSError, ValueError) as e:
+            # Keep serving the current index; the next check retries.
+            logging.error(f"Could not reopen the recommendation snapshot: {e}", exc_info=True)
+
+
+def get_live_index():
+    """
+    Returns the current index, loading it on first use and switching to a new
+    snapshot file version when one appears.
+    """
+    if _live_index is not None:
+        _check_snapshot()
+    index = _live_index
+    if index is None:
+        with _swap_lock:
+            index = _live_index
+        if index is None:
+            # Publish an empty index when nothing can be loaded, so requests do
+            # not retry the database on every call; the next job publishes real data.
+            index = reload_index() or publish_index(RecommendationIndex.empty(), snapshot_path=None)
+    return index
@@ -0,0 +1,136 @@
+from itertools import combinations
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+AGGREGATIONS = ('max', 'sum')
+
+
+class RuleIndex:
+    """
+    Association rules compiled for scoring: a dict keyed by the antecedent
+    frozenset, each entry holding its consequents presorted by confidence.
+
+    Exact lookups are one dict access; subset matching (every rule whose
+    antecedent is contained in a cart) enumerates the cart's subsets up to the
+    longest antecedent, or scans the antecedents when that is cheaper.
+    """
+
+    def __init__(self, entries, max_antecedent_len):
+        self.entries = entries
+        self.max_antecedent_len = max_antecedent_len
+
+    @classmethod
+    def from_rules(cls, rules):
+        """
+        Compiles a rules DataFrame with 'antecedents', 'consequents' (frozensets)
+        and 'confidence' columns.
+        """
+        ordered = rules[['antecedents', 'consequents', 'confidence']].sort_values(
+            'confidence', ascending=False, kind='stable')
+        grouped = {}
+        for antecedents, consequents, confidence in zip(
+                ordered['antecedents'], ordered['consequents'], ordered['confidence']):
+            grouped.setdefault(antecedents, ([], []))
+            grouped[antecedents][0].append(consequents)
+            grouped[antecedents][1].append(confidence)
+
+        entries = {
+            antecedents: (consequents, np.asarray(confidences, dtype=float))
+            for antecedents, (consequents, confidences) in grouped.items()
+        }
+        max_antecedent_len = max((len(antecedents) for antecedents in entries), default=0)
+        return cls(entries, max_antecedent_len)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def predict(self, items, max_results=6):
+        """
+        Rules whose antecedent is exactly `items`, strongest first.
+
+        Returns:
+            pd.DataFrame: 'consequents' and 'confidence', at most max_results rows.
+        """
+        consequents, confidences = self.entries.get(frozenset(items), ([], np.empty(0)))
+        return pd.DataFrame({
+            'consequents': consequents[:max_results],
+            'confidence': confidences[:max_results],
+        }, columns=['consequents', 'confidence'])
+
+    def matching_antecedents(self, basket):
+        """
+        Returns every antecedent contained in `basket`.
+        """
+        basket = frozenset(basket)
+        longest = min(len(basket), self.max_antecedent_len)
+        n_subsets = sum(comb(len(basket), size) for size in range(1, longest + 1))
+        if n_subsets <= len(self.entries):
+            items = sorted(basket)
+            return [
+                frozenset(subset)
+                for size in range(1, longest + 1)
+                for subset in combinations(items, size)
+                if frozenset(subset) in self.entries
+            ]
+        return [antecedents for antecedents in self.entries if antecedents <= basket]
+
+    def recommend(self, basket, k=6, aggregate='max'):
+        """
+        Scores products for a cart using every rule whose antecedent it contains.
+        Each consequent product gets the max (or sum) of the confidences of the
+        matching rules that recommend it; products already in the cart are skipped.
+
+        Returns:
+            list: Up to k (product_id, score) tuples, best first.
+        """
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f"aggregate must be one of {AGGREGATIONS}")
+        basket = frozenset(basket)
+        scores = {}
+        for antecedents in self.matching_antecedents(basket):
+            consequents, confidences = self.entries[antecedents]
+            for consequent, confidence in zip(consequents, confidences.tolist()):
+                for product_id in consequent:
+                    if product_id in basket:
+                        continue
+                    if aggregate == 'sum':
+                        scores[product_id] = scores.get(product_id, 0.0) + confidence
+                    elif confidence > scores.get(product_id, -1.0):
+                        scores[product_id] = confidence
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+    def predict_many(self, baskets, k=6, match='exact', aggregate='max'):
+        """
+        Batch scoring.
+
+        Args:
+            baskets (list): Item collections to score.
+            k (int): Results per basket.
+            match (str): 'exact' uses only the rules whose antecedent equals the
+                         basket; 'subset' uses every rule contained in it.
+            aggregate (str): How subset matches are combined per product ('max' or 'sum').
+
+        Returns:
+            list: One list of (product_id, score) tuples per basket.
+        """
+        if match == 'subset':
+            return [self.recommend(basket, k=k, aggregate=aggregate) for basket in baskets]
+        if match != 'exact':
+            raise ValueError("match must be 'exact' or 'subset'")
+
+        results = []
+        for basket in baskets:
+            basket = frozenset(basket)
+            consequents, confidences = self.entries.get(basket, ([], np.empty(0)))
+            scored = {}
+            for consequent, confidence in zip(consequents, confidences):
+                for product_id in consequent:
+                    if product_id not in basket and product_id not in scored:
+                        scored[product_id] = float(confidence)
+                if len(scored) >= k:
+                    break
+            results.append(list(scored.items())[:k])
+        return results
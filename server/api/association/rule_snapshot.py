@@ -0,0 +1,91 @@
+import os
+import struct
+
+import numpy as np
+
+# File layout (little endian):
+#   header (HEADER_SIZE bytes): magic, format version, product count,
+#                               recommendation count, index generation
+#   offsets        int64[n_products + 1]
+#   product_ids    int32[n_products]          (sorted)
+#   consequent_ids int32[n_recommendations]   (grouped by product, best first)
+#   confidences    float32[n_recommendations]
+# Every section starts on a multiple of its item size, so the arrays are
+# views on one read-only mapping of the file.
+SNAPSHOT_MAGIC = b'RECSNAP1'
+SNAPSHOT_VERSION = 1
+HEADER_FORMAT = '<8sIQQQ'
+HEADER_SIZE = 64
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def _as_int32(values, name):
+    values = np.asarray(values)
+    if len(values) and (values.min() < 0 or values.max() > INT32_MAX):
+        raise ValueError(f"{name} do not fit in int32.")
+    return values.astype('<i4')
+
+
+def write_snapshot(path, product_ids, offsets, consequent_ids, confidences, generation=0):
+    """
+    Writes a rule snapshot atomically: the file is written and fsynced under
+    a temporary name, then renamed over `path`. Readers that mapped the old
+    file keep a consistent view of it until they reopen.
+    """
+    product_ids = _as_int32(product_ids, "Product IDs")
+    consequent_ids = _as_int32(consequent_ids, "Consequent IDs")
+    offsets = np.asarray(offsets).astype('<i8')
+    confidences = np.asarray(confidences).astype('<f4')
+    header = struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(product_ids), len(consequent_ids),
+                         int(generation))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\x00'))
+        for array in (offsets, product_ids, consequent_ids, confidences):
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Maps a snapshot read-only with numpy.memmap. Every process mapping the
+    same file shares its pages in the OS page cache.
+
+    Returns:
+        dict: 'product_ids', 'offsets', 'consequent_ids' and 'confidences'
+              (views on the mapping) and the 'generation' the file was written with.
+    """
+    mapping = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(mapping) < HEADER_SIZE:
+        raise ValueError(f"{path} is not a rule snapshot (file too short).")
+    magic, version, n_products, n_recommendations, generation = struct.unpack_from(HEADER_FORMAT, mapping)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} rule snapshot.")
+
+    arrays = {}
+    position = HEADER_SIZE
+    for name, dtype, count in (('offsets', '<i8', n_products + 1), ('product_ids', '<i4', n_products),
+                               ('consequent_ids', '<i4', n_recommendations),
+                               ('confidences', '<f4', n_recommendations)):
+        arrays[name] = np.ndarray((count,), dtype=np.dtype(dtype), buffer=mapping, offset=position)
+        position += count * np.dtype(dtype).itemsize
+    if position != len(mapping):
+        raise ValueError(f"{path} is truncated or corrupt ({len(mapping)} bytes, expected {position}).")
+    arrays['generation'] = generation
+    return arrays
+
+
+def snapshot_identity(path):
+    """
+    (inode, size, mtime) of the file at `path`, or None if it does not exist.
+    A rename over the path changes the inode, so this tells when to reopen.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
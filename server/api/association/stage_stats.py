@@ -0,0 +1,63 @@
+import time
+import logging
+from contextlib import contextmanager
+
+
+class StageStats:
+    """
+    Collects row counts and wall-clock timings for the stages of a pipeline run.
+
+    Usage:
+        stats = StageStats()
+        with stats.stage('query') as stage:
+            rows = cursor.fetchall()
+            stage['rows'] = len(rows)
+        stats.report()
+
+    An optional `listener(name, event, entry)` is called with event 'started'
+    before and 'finished' after every stage (e.g. to report job progress);
+    an exception raised on 'started' aborts the stage before its body runs.
+    """
+
+    def __init__(self, listener=None):
+        self.stages = {}
+        self.listener = listener
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the body of the `with` block and stores it under `name`.
+        The yielded dict can be filled with extra values (e.g. 'rows').
+        """
+        entry = {'rows': None, 'seconds': None}
+        self.stages[name] = entry
+        if self.listener is not None:
+            self.listener(name, 'started', entry)
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = time.perf_counter() - started
+            if self.listener is not None:
+                self.listener(name, 'finished', entry)
+
+    def as_dict(self):
+        """
+        Returns a plain copy of the collected stats (safe to JSON-encode).
+        """
+        return {name: dict(entry) for name, entry in self.stages.items()}
+
+    def total_seconds(self):
+        return sum(entry['seconds'] or 0.0 for entry in self.stages.values())
+
+    def report(self, title='Stage stats'):
+        """
+        Prints and logs one line per stage with its row count and duration.
+        """
+        print(f"📊 {title}:")
+        for name, entry in self.stages.items():
+            rows = entry.get('rows')
+            rows_text = f"{rows} rows" if rows is not None else "-"
+            line = f"   {name:<12} {rows_text:>16}  {entry['seconds'] or 0.0:8.3f}s"
+            print(line)
+            logging.info(f"{title} - {name}: rows={rows} seconds={entry['seconds']:.3f}")
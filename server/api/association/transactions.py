@@ -0,0 +1,244 @@
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from api.association.baskets import Baskets, group_baskets
+
+
+class ProductVocabulary:
+    """
+    Maps product IDs to compact int32 column indices (0, 1, 2, ...).
+
+    Indices are assigned in first-seen order and never change once assigned,
+    so the same vocabulary can be reused (and extended) across runs and the
+    column of a product stays stable.
+    """
+
+    def __init__(self, product_ids=None):
+        self.product_ids = np.empty(0, dtype=np.int64)
+        self._sorted_ids = self.product_ids
+        self._sorter = np.empty(0, dtype=np.int64)
+        if product_ids is not None:
+            self.add(product_ids)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def __contains__(self, product_id):
+        return bool(self._lookup(np.asarray([product_id], dtype=np.int64))[1][0])
+
+    def _lookup(self, product_ids):
+        positions = np.searchsorted(self._sorted_ids, product_ids)
+        positions = np.minimum(positions, max(len(self._sorted_ids) - 1, 0))
+        if len(self._sorted_ids) == 0:
+            return positions, np.zeros(len(product_ids), dtype=bool)
+        found = self._sorted_ids[positions] == product_ids
+        return positions, found
+
+    def add(self, product_ids):
+        """
+        Adds any product IDs not in the vocabulary yet.
+
+        Returns:
+            int: Number of new products added.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        # Unique IDs in first-seen order, so reloading a saved vocabulary
+        # reproduces the same indices.
+        _, first_seen = np.unique(product_ids, return_index=True)
+        product_ids = product_ids[np.sort(first_seen)]
+        _, found = self._lookup(product_ids)
+        new_ids = product_ids[~found]
+        if len(new_ids):
+            self.product_ids = np.concatenate([self.product_ids, new_ids])
+            self._sorter = np.argsort(self.product_ids, kind='stable')
+            self._sorted_ids = self.product_ids[self._sorter]
+        return len(new_ids)
+
+    def encode(self, product_ids):
+        """
+        Converts product IDs to column indices.
+
+        Raises:
+            KeyError: If any of the product IDs is not in the vocabulary.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positions, found = self._lookup(product_ids)
+        if not np.all(found):
+            missing = product_ids[~found][:5].tolist()
+            raise KeyError(f"Product IDs not in vocabulary: {missing}")
+        return self._sorter[positions].astype(np.int32)
+
+    def decode(self, indices):
+        """
+        Converts column indices back to product IDs.
+        """
+        return self.product_ids[np.asarray(indices, dtype=np.int64)]
+
+    def save(self, path):
+        np.save(path, self.product_ids)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+
+@dataclass
+class TransactionMatrix:
+    """
+    One-hot transactions as a scipy CSR matrix (rows = orders, columns = the
+    vocabulary indices of the products). Memory is proportional to the number
+    of order lines, not orders x products.
+
+    After compact_transactions() each row is a distinct basket and `weights`
+    holds how many orders it stands for; `order_ids` always lists the orders
+    the matrix was built from.
+    """
+    matrix: sp.csr_matrix
+    vocabulary: ProductVocabulary
+    order_ids: np.ndarray
+    weights: np.ndarray = None
+
+    @property
+    def n_transactions(self):
+        """
+        Number of orders represented (the support denominator).
+        """
+        if self.weights is None:
+            return self.matrix.shape[0]
+        total = self.weights.sum()
+        return float(total) if self.weights.dtype.kind == 'f' else int(total)
+
+    @property
+    def empty(self):
+        return self.matrix.shape[0] == 0 or self.matrix.nnz == 0
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def to_dataframe(self):
+        """
+        Returns a pandas sparse DataFrame accepted by the mlxtend miners.
+        Columns are the vocabulary indices (mlxtend requires sparse integer
+        column names to start at 0); map itemsets back with vocabulary.decode().
+        """
+        return mlxtend_frame(self.matrix, self.weights)
+
+
+def mlxtend_frame(matrix, weights=None):
+    """
+    Converts a CSR transaction matrix into the boolean sparse DataFrame the
+    mlxtend miners take. mlxtend has no row weights, so weighted rows are
+    expanded back into one row per order (which undoes compact_transactions()).
+    """
+    if weights is not None:
+        logging.info(f"Expanding {matrix.shape[0]} weighted rows into {int(weights.sum())} "
+                     f"for an mlxtend miner (it has no row weights).")
+        matrix = matrix[np.repeat(np.arange(matrix.shape[0]), weights)]
+    df = pd.DataFrame.sparse.from_spmatrix(matrix.astype(np.uint8).tocsc())
+    return df.astype(pd.SparseDtype(bool, False))
+
+
+def baskets_from_dataframe(df):
+    """
+    Converts the ragged "one row per order" DataFrame (NaN padded) into Baskets.
+    Row order becomes the basket order; products keep their column order.
+    """
+    values = df.to_numpy(dtype=float, na_value=np.nan)
+    rows, cols = np.nonzero(~np.isnan(values))
+    return group_baskets(rows, values[rows, cols].astype(np.int64))
+
+
+def build_transaction_matrix(baskets, vocabulary=None):
+    """
+    Builds the sparse one-hot transaction matrix straight from the baskets.
+
+    Args:
+        baskets (Baskets): Orders and their product IDs.
+        vocabulary (ProductVocabulary): Optional vocabulary to reuse; new products
+                                        are appended to it.
+
+    Returns:
+        TransactionMatrix: A boolean CSR matrix with int32 column indices.
+    """
+    vocabulary = vocabulary if vocabulary is not None else ProductVocabulary()
+    vocabulary.add(baskets.product_ids)
+
+    indices = vocabulary.encode(baskets.product_ids)
+    data = np.ones(len(indices), dtype=bool)
+    matrix = sp.csr_matrix(
+        (data, indices, baskets.indptr.astype(np.int64)),
+        shape=(len(baskets), len(vocabulary)),
+    )
+    # A product listed twice in the same order is still one item in the basket.
+    matrix.sum_duplicates()
+    return TransactionMatrix(matrix=matrix, vocabulary=vocabulary, order_ids=baskets.order_ids)
+
+
+def compact_transactions(transactions):
+    """
+    Collapses identical baskets into one weighted row.
+
+    Rows are grouped by basket length; within a group the sorted column indices
+    of each row form a fixed-width key, and np.unique over those keys finds the
+    distinct baskets and their counts. The keys are the baskets themselves, so
+    unlike hashing there are no collisions to resolve.
+
+    Args:
+        transactions (TransactionMatrix): Transactions, possibly already weighted.
+
+    Returns:
+        TransactionMatrix: One row per distinct basket with `weights` (int64, or
+                           float64 when the input weights are decayed floats)
+                           (the summed weights of the merged rows).
+    """
+    matrix = transactions.matrix.tocsr()
+    matrix.sort_indices()
+    weights = transactions.weights
+    if weights is None:
+        weights = np.ones(matrix.shape[0], dtype=np.int64)
+
+    lengths = np.diff(matrix.indptr)
+    keys_by_length = []
+    weights_by_length = []
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        if length == 0:
+            keys, inverse = np.empty((1, 0), dtype=matrix.indices.dtype), np.zeros(len(rows), dtype=np.int64)
+        else:
+            starts = matrix.indptr[rows]
+            keys = matrix.indices[starts[:, None] + np.arange(length)]
+            keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        keys_by_length.append(keys)
+        weights_by_length.append(np.bincount(inverse.ravel(), weights=weights[rows], minlength=len(keys)))
+
+    indices = np.concatenate([keys.ravel() for keys in keys_by_length]) if keys_by_length else np.empty(0, dtype=np.int32)
+    row_lengths = np.concatenate([np.full(len(keys), keys.shape[1]) for keys in keys_by_length]) \
+        if keys_by_length else np.empty(0, dtype=np.int64)
+    compacted = sp.csr_matrix(
+        (np.ones(len(indices), dtype=bool), indices, np.r_[0, np.cumsum(row_lengths)].astype(np.int64)),
+        shape=(len(row_lengths), matrix.shape[1]),
+    )
+    weight_dtype = weights.dtype if weights.dtype.kind == 'f' else np.int64
+    row_weights = np.concatenate(weights_by_length).astype(weight_dtype) if weights_by_length \
+        else np.empty(0, dtype=weight_dtype)
+    return TransactionMatrix(matrix=compacted, vocabulary=transactions.vocabulary,
+                             order_ids=transactions.order_ids, weights=row_weights)
+
+
+def as_transaction_matrix(transactions):
+    """
+    Accepts Baskets, a ragged per-order DataFrame or a TransactionMatrix and
+    returns a TransactionMatrix.
+    """
+    if isinstance(transactions, TransactionMatrix):
+        return transactions
+    if isinstance(transactions, Baskets):
+        return build_transaction_matrix(transactions)
+    if isinstance(transactions, pd.DataFrame):
+        return build_transaction_matrix(baskets_from_dataframe(transactions))
+    raise TypeError(f"Unsupported transactions type: {type(transactions).__name__}")
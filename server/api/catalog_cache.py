@@ -0,0 +1,270 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import mysql.connector
+
+from api.db import make_connection_with_db
+
+# Rows per IN (...) query.
+DEFAULT_CHUNK_SIZE = 1000
+# Entries kept per cache before the least recently used ones are evicted.
+DEFAULT_MAX_ENTRIES = 200000
+# Seconds between two checks of wp_posts.post_modified for changed products.
+DEFAULT_REFRESH_INTERVAL = 60
+
+# Marker stored for IDs that do not exist, so they are not queried again.
+_MISSING = object()
+
+
+class _LRU:
+    """
+    Small LRU map on top of OrderedDict (callers hold the cache lock).
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        value = self.entries.get(key, default)
+        if value is not default:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ProductCatalogCache:
+    """
+    Process-wide cache of product titles ('wp_posts') and 'product_cat'
+    categories ('wp_term_relationships' / 'wp_terms').
+
+    Misses are resolved in bulk with chunked IN (...) queries on one connection,
+    IDs that do not exist are cached as missing, and products whose
+    post_modified moved since the last check are evicted so their next lookup
+    reloads them.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, chunk_size=DEFAULT_CHUNK_SIZE,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, connection_factory=None):
+        self.chunk_size = chunk_size
+        self.refresh_interval = refresh_interval
+        self.connection_factory = connection_factory or make_connection_with_db
+        self._titles = _LRU(max_entries)
+        self._categories = _LRU(max_entries)
+        self._category_names = _LRU(max_entries)
+        self._lock = threading.RLock()
+        self._modified_watermark = None
+        self._last_refresh = 0.0
+        self._refreshing = False
+
+    # ---- internal helpers ----
+
+    def _query_in_chunks(self, cursor, sql, ids):
+        rows = []
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            cursor.execute(sql.format(', '.join(['%s'] * len(chunk))), chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def _load(self, cache, ids, loader):
+        """
+        Returns {id: cached value} for `ids`, loading the misses with `loader(cursor, missing_ids)`.
+        Missing IDs are stored as _MISSING (negative caching).
+        """
+        self.refresh_if_due(wait=False)
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        found = {}
+        with self._lock:
+            for i in ids:
+                value = cache.get(i, None)
+                if value is not None:
+                    found[i] = value
+        missing = [i for i in ids if i not in found]
+        if not missing:
+            return found
+
+        connection, cursor = None, None
+        try:
+            connection, cursor = self.connection_factory()
+            if connection is None or cursor is None:
+                logging.error("Database connection failed in ProductCatalogCache.")
+                return found
+            loaded = loader(cursor, missing)
+        except mysql.connector.Error as err:
+            logging.error(f"Database error in ProductCatalogCache: {err}")
+            return found
+        finally:
+            if cursor:
+                cursor.close()
+            if connection:
+                connection.close()
+
+        with self._lock:
+            for i in missing:
+                value = loaded.get(i, _MISSING)
+                cache.put(i, value)
+                found[i] = value
+        return found
+
+    def _load_titles(self, cursor, ids):
+        sql = 'SELECT ID, post_title, post_modified FROM wp_posts WHERE ID IN ({});'
+        rows = self._query_in_chunks(cursor, sql, ids)
+        return {int(row['ID']): row['post_title'] for row in rows}
+
+    def _load_categories(self, cursor, ids):
+        sql = """
+        SELECT wp_term_relationships.object_id, wp_term_taxonomy.term_id
+        FROM wp_term_relationships
+        JOIN wp_term_taxonomy ON wp_term_taxonomy.term_taxonomy_id = wp_term_relationships.term_taxonomy_id
+        WHERE wp_term_taxonomy.taxonomy = 'product_cat' AND wp_term_relationships.object_id IN ({})
+        ORDER BY wp_term_taxonomy.term_id ASC
+        """
+        categories = {i: [] for i in ids}
+        for row in self._query_in_chunks(cursor, sql, ids):
+            categories[int(row['object_id'])].append(int(row['term_id']))
+        # A product without categories is a valid (cached) answer: an empty tuple.
+        return {i: tuple(term_ids) for i, term_ids in categories.items()}
+
+    def _load_category_names(self, cursor, ids):
+        sql = """
+        SELECT wp_terms.term_id, wp_terms.name
+        FROM wp_terms
+        JOIN wp_term_taxonomy ON wp_term_taxonomy.term_id = wp_terms.term_id
+        WHERE wp_term_taxonomy.taxonomy = 'product_cat' AND wp_terms.term_id IN ({})
+        """
+        return {int(row['term_id']): row['name'] for row in self._query_in_chunks(cursor, sql, ids)}
+
+    # ---- public API ----
+
+    def get_product_titles(self, product_ids):
+        """
+        Returns:
+            dict: product ID -> title, for the products that exist.
+        """
+        loaded = self._load(self._titles, product_ids, self._load_titles)
+        return {i: title for i, title in loaded.items() if title is not _MISSING}
+
+    def get_product_title(self, product_id, default='Not Found'):
+        return self.get_product_titles([product_id]).get(int(product_id), default)
+
+    def get_product_categories(self, product_ids):
+        """
+        Returns:
+            dict: product ID -> list of 'product_cat' term IDs (empty list if none).
+        """
+        loaded = self._load(self._categories, product_ids, self._load_categories)
+        return {i: list(term_ids) if term_ids is not _MISSING else [] for i, term_ids in loaded.items()}
+
+    def get_category_names(self, category_ids):
+        """
+        Returns:
+            dict: term ID -> category name, for the categories that exist.
+        """
+        loaded = self._load(self._category_names, category_ids, self._load_category_names)
+        return {i: name for i, name in loaded.items() if name is not _MISSING}
+
+    def get_category_name(self, category_id, default='Not Found'):
+        return self.get_category_names([category_id]).get(int(category_id), default)
+
+    def invalidate(self, product_ids=None):
+        """
+        Drops the given products (or everything when None) from the cache.
+        """
+        with self._lock:
+            if product_ids is None:
+                self._titles.clear()
+                self._categories.clear()
+                self._category_names.clear()
+                return
+            for product_id in product_ids:
+                self._titles.pop(int(product_id))
+                self._categories.pop(int(product_id))
+
+    def refresh_if_due(self, force=False, wait=True):
+        """
+        Evicts the products and variations whose 'post_modified' is newer than
+        the last check. Runs at most once per refresh_interval unless forced,
+        and never twice at the same time. New products show up here too, which
+        clears their negative cache entries.
+
+        The first run only records the newest 'post_modified' as the starting
+        watermark (the first lookup of any kind triggers it, so a process that
+        only reads categories is refreshed as well).
+
+        With `wait=False` (the lookup path) the check runs in a background
+        thread, so requests never wait for it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing:
+                return
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+            self._refreshing = True
+        if wait:
+            self._refresh()
+        else:
+            threading.Thread(target=self._refresh, daemon=True, name='catalog-cache-refresh').start()
+
+    def _refresh(self):
+        try:
+            if self._modified_watermark is None:
+                rows = self._query_posts("SELECT MAX(post_modified) AS post_modified FROM wp_posts "
+                                         "WHERE post_type IN ('product', 'product_variation');")
+                with self._lock:
+                    self._modified_watermark = rows[0]['post_modified'] if rows else None
+                return
+            rows = self._query_posts("SELECT ID, post_modified FROM wp_posts "
+                                     "WHERE post_type IN ('product', 'product_variation') AND post_modified > %s;",
+                                     (self._modified_watermark,))
+            if rows:
+                self.invalidate(int(row['ID']) for row in rows)
+                with self._lock:
+                    # Category names have no modification date; drop them with any change.
+                    self._category_names.clear()
+                    self._modified_watermark = max(row['post_modified'] for row in rows)
+                logging.info(f"ProductCatalogCache evicted {len(rows)} modified products.")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _query_posts(self, sql, params=()):
+        # The post_type filter lets MySQL use the type_status_date index
+        # instead of scanning wp_posts.
+        connection, cursor = None, None
+        try:
+            connection, cursor = self.connection_factory()
+            if connection is None or cursor is None:
+                return []
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        except mysql.connector.Error as err:
+            logging.error(f"Database error while refreshing ProductCatalogCache: {err}")
+            return []
+        finally:
+            if cursor:
+                cursor.close()
+            if connection:
+                connection.close()
+
+
+# Shared instance used by every module of the server.
+catalog_cache = ProductCatalogCache()
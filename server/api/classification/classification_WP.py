@@ -16,6 +16,9 @@ import m2cgen as m2c
 import arabic_reshaper
 from bidi.algorithm import get_display
 
+from api.catalog_cache import catalog_cache
+from api.db import make_connection_with_db
+
 # Configure logging
 # Create a file handler
 file_handler = logging.FileHandler("model_training.log", encoding='utf-8')
@@ -34,89 +37,21 @@ logging.basicConfig(level=logging.INFO,
 
 # --- Your existing functions go here, with logging integrated ---
 
-def make_connection_with_db():
-    try:
-        connection = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="wp_ecommerce")
-        cursor = connection.cursor(dictionary=True)
-        logging.info("✅ Database connection established.") # This emoji was causing issues
-        return connection, cursor
-    except mysql.connector.Error as err:
-        logging.error(f"❌ Database connection failed: {err}") # This emoji was causing issues
-        return None, None
-
 def get_product_categories(product_id):
-    connection, cursor = None, None
-    trem_ids = []
-    try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            logging.error("Database connection failed in get_product_categories.")
-            return [] # Return an empty list if connection fails
-
-        sql = """
-        SELECT wp_term_relationships.object_id ,wp_term_taxonomy.term_id
-        FROM `wp_term_relationships`
-        JOIN wp_term_taxonomy on wp_term_taxonomy.term_taxonomy_id = wp_term_relationships.term_taxonomy_id
-        WHERE wp_term_taxonomy.taxonomy='product_cat' and wp_term_relationships.object_id=(%s)
-        ORDER BY `wp_term_taxonomy`.`term_id` ASC
-        """
-        cursor.execute(sql, (product_id,))
-        results = cursor.fetchall()
-
-        if results:
-            trem_ids = [row['term_id'] for row in results]
-            logging.debug(f"Retrieved categories for product ID {product_id}: {trem_ids}")
-        else:
-            logging.info(f"No categories found for product ID {product_id}.")
-
-    except mysql.connector.Error as err:
-        logging.error(f"Database error in get_product_categories: {err}. Could not retrieve categories for product ID: {product_id}")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred in get_product_categories: {e}. Could not retrieve categories for product ID: {product_id}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+    # Served from the shared product catalog cache (bulk loads, no connection per call).
+    trem_ids = catalog_cache.get_product_categories([product_id]).get(int(product_id), [])
+    if trem_ids:
+        logging.debug(f"Retrieved categories for product ID {product_id}: {trem_ids}")
+    else:
+        logging.info(f"No categories found for product ID {product_id}.")
     return trem_ids
 
 def get_category_by_id(category_id):
-    connection, cursor = None, None
-    category_name = "Not Found"
-    try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            logging.error("Database connection failed in get_category_by_id.")
-            return category_name # Return default if connection fails
-
-        sql = """
-        SELECT name
-        FROM `wp_terms`
-        JOIN wp_term_taxonomy on wp_term_taxonomy.term_id = wp_terms.term_id
-        WHERE wp_term_taxonomy.taxonomy='product_cat' and wp_terms.term_id =(%s)
-        """
-        cursor.execute(sql, (category_id,))
-        results = cursor.fetchall()
-
-        if results:
-            category_name = results[0]['name']
-            logging.debug(f"Retrieved category name for ID {category_id}: {category_name}")
-        else:
-            logging.info(f"No category name found for ID {category_id}.")
-
-    except mysql.connector.Error as err:
-        logging.error(f"Database error in get_category_by_id: {err}. Could not retrieve category name for ID: {category_id}")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred in get_category_by_id: {e}. Could not retrieve category name for ID: {category_id}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+    category_name = catalog_cache.get_category_name(category_id)
+    if category_name == "Not Found":
+        logging.info(f"No category name found for ID {category_id}.")
+    else:
+        logging.debug(f"Retrieved category name for ID {category_id}: {category_name}")
     return category_name
 
 def build_customer_data_v2():
@@ -291,45 +226,66 @@ def label_encoder_to_db(table, col_name, col_type, le):
             cursor.close()
         if connection:
             connection.close()
-            
-            
-            
-            
-if __name__ == '__main__':
+
+def train_category_classifier(stats=None, model_path='classification_model.pkl'):
+    """
+    Trains the customer -> favourite product category classifier: loads the
+    customer data, label-encodes it, oversamples the classes, picks the best
+    of three models by 10-fold cross-validation, then saves it (pickle and
+    PHP export) together with the label encoder tables.
+
+    Args:
+        stats (StageStats): Optional collector for the stage timings (e.g. one
+                            reporting job progress).
+        model_path (str): Where the trained model is pickled.
+
+    Returns:
+        dict: The selected model name, its accuracy and the training rows.
+
+    Raises:
+        RuntimeError: If the data cannot be loaded or no model can be trained.
+    """
+    from api.association.stage_stats import StageStats
+
+    stats = stats if stats is not None else StageStats()
     logging.info("--- Starting customer data analysis and model training script ---")
 
-    customer_df = build_customer_data_v2()
+    with stats.stage('load') as stage:
+        customer_df = build_customer_data_v2()
+        stage['rows'] = len(customer_df)
     if customer_df.empty:
         logging.critical("Exiting script because customer data could not be loaded.")
-        exit()
+        raise RuntimeError("Customer data could not be loaded.")
 
     logging.info(f"Customer Data Head:\n{customer_df.head()}")
     logging.info(f"Customer Data Info:\n{customer_df.info()}")
     logging.info(f"Missing values before dropna:\n{customer_df.isnull().sum()}")
 
-    initial_rows = len(customer_df)
-    customer_df = customer_df.dropna()
-    rows_dropped = initial_rows - len(customer_df)
-    if rows_dropped > 0:
-        logging.warning(f"Dropped {rows_dropped} rows due to missing values.")
+    with stats.stage('encode') as stage:
+        initial_rows = len(customer_df)
+        customer_df = customer_df.dropna()
+        rows_dropped = initial_rows - len(customer_df)
+        if rows_dropped > 0:
+            logging.warning(f"Dropped {rows_dropped} rows due to missing values.")
 
-    duplicated_rows = customer_df.duplicated().sum()
-    if duplicated_rows > 0:
-        logging.warning(f"Found {duplicated_rows} duplicated rows.")
+        duplicated_rows = customer_df.duplicated().sum()
+        if duplicated_rows > 0:
+            logging.warning(f"Found {duplicated_rows} duplicated rows.")
 
-    logging.info(f"Customer Data Description:\n{customer_df.describe()}")
+        logging.info(f"Customer Data Description:\n{customer_df.describe()}")
 
-    # Label encoding
-    country_le = LabelEncoder()
-    gender_le = LabelEncoder()
+        # Label encoding
+        country_le = LabelEncoder()
+        gender_le = LabelEncoder()
 
-    try:
-        customer_df['country'] = country_le.fit_transform(customer_df['country'])
-        customer_df['gender'] = gender_le.fit_transform(customer_df['gender'])
-        logging.info("Label encoding successful for 'country' and 'gender'.")
-    except Exception as e:
-        logging.critical(f"Error during label encoding: {e}", exc_info=True)
-        exit()
+        try:
+            customer_df['country'] = country_le.fit_transform(customer_df['country'])
+            customer_df['gender'] = gender_le.fit_transform(customer_df['gender'])
+            logging.info("Label encoding successful for 'country' and 'gender'.")
+        except Exception as e:
+            logging.critical(f"Error during label encoding: {e}", exc_info=True)
+            raise RuntimeError(f"Error during label encoding: {e}") from e
+        stage['rows'] = len(customer_df)
 
     # Optional Pie Chart
     try:
@@ -354,21 +310,18 @@ if __name__ == '__main__':
     logging.info(f"Class distribution BEFORE oversampling: {dict(Counter(y))}")
 
     # Oversampling
-    try:
-        oversample = RandomOverSampler(random_state=42)
-        X_resampled, y_resampled = oversample.fit_resample(X, y)
-        logging.info(f"Class distribution AFTER oversampling: {dict(Counter(y_resampled))}")
-        logging.info(f"Resampled dataset: {len(X_resampled)} samples.")
-    except Exception as e:
-        logging.critical(f"Error during oversampling: {e}", exc_info=True)
-        exit()
+    with stats.stage('oversample') as stage:
+        try:
+            oversample = RandomOverSampler(random_state=42)
+            X_resampled, y_resampled = oversample.fit_resample(X, y)
+            logging.info(f"Class distribution AFTER oversampling: {dict(Counter(y_resampled))}")
+            logging.info(f"Resampled dataset: {len(X_resampled)} samples.")
+        except Exception as e:
+            logging.critical(f"Error during oversampling: {e}", exc_info=True)
+            raise RuntimeError(f"Error during oversampling: {e}") from e
+        stage['rows'] = len(X_resampled)
 
     # Model selection
-    from sklearn.model_selection import cross_val_score
-    from sklearn.tree import DecisionTreeClassifier
-    from sklearn.naive_bayes import CategoricalNB
-    from sklearn.neighbors import KNeighborsClassifier
-
     models = {
         "Decision Tree": DecisionTreeClassifier(),
         "Naive Bayes": CategoricalNB(),
@@ -379,54 +332,66 @@ if __name__ == '__main__':
     best_model_name = None
     best_score = 0.0
 
-    for name, model in models.items():
-        try:
-            scores = cross_val_score(model, X_resampled, y_resampled, cv=10, scoring='accuracy')
-            mean_score = scores.mean()
-            logging.info(f"{name} Accuracy: {round(mean_score * 100):.0f}%")
-            if mean_score > best_score:
-                best_score = mean_score
-                best_model = model
-                best_model_name = name
-        except Exception as e:
-            logging.error(f"Error evaluating {name}: {e}", exc_info=True)
+    with stats.stage('select') as stage:
+        for name, model in models.items():
+            try:
+                scores = cross_val_score(model, X_resampled, y_resampled, cv=10, scoring='accuracy')
+                mean_score = scores.mean()
+                logging.info(f"{name} Accuracy: {round(mean_score * 100):.0f}%")
+                if mean_score > best_score:
+                    best_score = mean_score
+                    best_model = model
+                    best_model_name = name
+            except Exception as e:
+                logging.error(f"Error evaluating {name}: {e}", exc_info=True)
+        stage['rows'] = len(models)
 
     if best_model is None:
         logging.critical("No model was successfully evaluated. Exiting.")
-        exit()
+        raise RuntimeError("No model was successfully evaluated.")
 
     logging.info(f"✅ Best model selected: {best_model_name} with accuracy: {round(best_score * 100):.0f}%")
 
     # Train final model
-    try:
-        best_model.fit(X_resampled, y_resampled)
-        filename = 'classification_model.pkl'
-        with open(filename, 'wb') as f:
-            pickle.dump(best_model, f)
-        logging.info(f"{best_model_name} model trained and saved to '{filename}'.")
-    except Exception as e:
-        logging.critical(f"Error training or saving model: {e}", exc_info=True)
-        exit()
+    with stats.stage('train') as stage:
+        try:
+            best_model.fit(X_resampled, y_resampled)
+            with open(model_path, 'wb') as f:
+                pickle.dump(best_model, f)
+            logging.info(f"{best_model_name} model trained and saved to '{model_path}'.")
+        except Exception as e:
+            logging.critical(f"Error training or saving model: {e}", exc_info=True)
+            raise RuntimeError(f"Error training or saving model: {e}") from e
+        stage['rows'] = len(X_resampled)
 
     # Test prediction
-    predicted_category_code = get_category_code(filename, 2, 40, 1)
+    predicted_category_code = get_category_code(model_path, 2, 40, 1)
     if predicted_category_code is not None:
         predicted_category_name = get_category_by_id(predicted_category_code)
         logging.info(f"Example prediction — ID: {predicted_category_code}, Name: {predicted_category_name}")
     else:
         logging.warning("Example prediction failed.")
 
-    # Export to PHP
-    try:
-        model_to_php = m2c.export_to_php(best_model)
-        with open('predict_category.php', 'w', encoding='utf-8') as f:
-            f.write(model_to_php)
-        logging.info("✅ Model exported to 'predict_category.php'.")
-    except Exception as e:
-        logging.error(f"Error exporting model to PHP: {e}", exc_info=True)
+    with stats.stage('export'):
+        # Export to PHP
+        try:
+            model_to_php = m2c.export_to_php(best_model)
+            with open('predict_category.php', 'w', encoding='utf-8') as f:
+                f.write(model_to_php)
+            logging.info("✅ Model exported to 'predict_category.php'.")
+        except Exception as e:
+            logging.error(f"Error exporting model to PHP: {e}", exc_info=True)
 
-    # Save LabelEncoder mappings
-    label_encoder_to_db('custom_country_code', 'country', 'VARCHAR(255)', country_le)
-    label_encoder_to_db('custom_gender_code', 'gender', 'VARCHAR(10)', gender_le)
+        # Save LabelEncoder mappings
+        label_encoder_to_db('custom_country_code', 'country', 'VARCHAR(255)', country_le)
+        label_encoder_to_db('custom_gender_code', 'gender', 'VARCHAR(10)', gender_le)
 
     logging.info("--- Script execution finished ---")
+    return {'model': best_model_name, 'accuracy': float(best_score), 'rows': int(len(X_resampled))}
+
+
+if __name__ == '__main__':
+    try:
+        train_category_classifier()
+    except RuntimeError:
+        exit(1)
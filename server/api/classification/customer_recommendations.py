@@ -0,0 +1,423 @@
+import os
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import mysql.connector
+
+from api.association.stage_stats import StageStats
+from api.catalog_cache import catalog_cache
+from api.db import execute_prepared, make_connection_with_db
+
+# Category classifier written by classification_WP.train_category_classifier().
+DEFAULT_MODEL_PATH = 'classification_model.pkl'
+# Products stored per customer; requests can ask for fewer.
+DEFAULT_TOP_N = 10
+# Products returned when a request does not say (as get_customer_products()).
+DEFAULT_CUSTOMER_N = 3
+# Rows per executemany() batch.
+EXPORT_BATCH_SIZE = 5000
+# Seconds an unknown customer ID is remembered, so requests for it do not
+# reach the database again (new customers show up after this delay).
+UNKNOWN_CUSTOMER_TTL = 300
+# Unknown customer IDs remembered before the oldest ones are forgotten.
+MAX_UNKNOWN_CUSTOMERS = 100000
+
+# Live table read by the API and the staging table the batch job fills before swapping it in.
+CUSTOMER_RECOMMENDATIONS_TABLE = 'custom_customer_recommendations'
+CUSTOMER_RECOMMENDATIONS_STAGING_TABLE = 'custom_customer_recommendations_staging'
+CUSTOMER_RECOMMENDATIONS_OLD_TABLE = 'custom_customer_recommendations_old'
+
+CUSTOMER_RECOMMENDATIONS_TABLE_SQL = """
+    CREATE TABLE {table} (
+        customer_id BIGINT NOT NULL,
+        rank_position SMALLINT NOT NULL,   -- 1 = best
+        product_id BIGINT NOT NULL,
+        post_title TEXT NOT NULL,
+        category_id BIGINT NULL,           -- Predicted category (NULL: store-wide best sellers)
+        computed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (customer_id, rank_position)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+CUSTOMER_RECOMMENDATIONS_INSERT_SQL = """
+    INSERT INTO {table} (customer_id, rank_position, product_id, post_title, category_id)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+CUSTOMER_RECOMMENDATIONS_SELECT_SQL = f"""
+    SELECT product_id, post_title, category_id FROM {CUSTOMER_RECOMMENDATIONS_TABLE}
+    WHERE customer_id = %s ORDER BY rank_position LIMIT %s
+"""
+
+CUSTOMER_EXISTS_SQL = "SELECT 1 AS found FROM wp_wc_customer_lookup WHERE customer_id = %s"
+
+# Country, age and gender of customers, one row per customer.
+CUSTOMERS_SQL = """
+    SELECT wccl.customer_id, wccl.country,
+           MAX(CASE WHEN wum.meta_key = 'age' THEN wum.meta_value END) AS age,
+           MAX(CASE WHEN wum.meta_key = 'gender' THEN wum.meta_value END) AS gender
+    FROM wp_wc_customer_lookup wccl
+    LEFT JOIN wp_usermeta wum ON wum.user_id = wccl.user_id AND wum.meta_key IN ('age', 'gender')
+    {where}
+    GROUP BY wccl.customer_id, wccl.country
+"""
+
+CATEGORY_SALES_SQL = """
+    SELECT wtt.term_id AS category_id, wwopl.product_id, SUM(wwopl.product_qty) AS sumsales
+    FROM wp_wc_order_product_lookup wwopl
+    JOIN wp_term_relationships wtr ON wtr.object_id = wwopl.product_id
+    JOIN wp_term_taxonomy wtt ON wtt.term_taxonomy_id = wtr.term_taxonomy_id
+    WHERE wtt.taxonomy = 'product_cat' AND wtt.term_id IN ({placeholders})
+    GROUP BY wtt.term_id, wwopl.product_id
+"""
+
+STORE_SALES_SQL = """
+    SELECT product_id, SUM(product_qty) AS sumsales
+    FROM wp_wc_order_product_lookup
+    GROUP BY product_id
+    ORDER BY sumsales DESC, product_id
+    LIMIT %s
+"""
+
+# Gender values as stored in custom_gender_code (see find_products_for_customer.get_gender_code).
+GENDER_ALIASES = {'male': 'ذكر', 'female': 'انثى'}
+
+_model_cache = {'path': None, 'mtime': None, 'model': None}
+_model_lock = threading.Lock()
+
+# Customer ID -> monotonic time until which it is known to have no recommendations.
+_unknown_customers = OrderedDict()
+_unknown_customers_lock = threading.Lock()
+
+
+def load_model(model_path=DEFAULT_MODEL_PATH):
+    """
+    Returns the pickled category classifier, loading it again only when the
+    file changed (e.g. after a classification job).
+    """
+    mtime = os.stat(model_path).st_mtime_ns
+    with _model_lock:
+        if _model_cache['path'] != model_path or _model_cache['mtime'] != mtime:
+            with open(model_path, 'rb') as f:
+                _model_cache.update(path=model_path, mtime=mtime, model=pickle.load(f))
+        return _model_cache['model']
+
+
+def load_customers(cursor, customer_ids=None):
+    """
+    Returns:
+        pd.DataFrame: 'customer_id', 'country', 'age' and 'gender' of the given
+                      customers (of all customers when customer_ids is None).
+    """
+    if customer_ids is None:
+        cursor.execute(CUSTOMERS_SQL.format(where=''))
+    else:
+        placeholders = ', '.join(['%s'] * len(customer_ids))
+        cursor.execute(CUSTOMERS_SQL.format(where=f"WHERE wccl.customer_id IN ({placeholders})"),
+                       tuple(int(customer_id) for customer_id in customer_ids))
+    return pd.DataFrame(cursor.fetchall(), columns=['customer_id', 'country', 'age', 'gender'])
+
+
+def load_codes(cursor, table, column):
+    """
+    Returns:
+        dict: value -> code of a label encoding saved by classification_WP.label_encoder_to_db().
+    """
+    cursor.execute(f"SELECT code, {column} FROM {table}")
+    return {row[column]: int(row['code']) for row in cursor.fetchall()}
+
+
+def encode_customers(customers, country_codes, gender_codes):
+    """
+    The classifier's input features ('country', 'age', 'gender' codes), encoded
+    as find_products_for_customer.get_customer_products() does for one customer.
+
+    Returns:
+        pd.DataFrame: The features, NaN where a country or gender has no code.
+    """
+    gender = customers['gender'].fillna('').astype(str).str.lower()
+    return pd.DataFrame({
+        'country': customers['country'].fillna('').astype(str).str.upper().map(country_codes),
+        'age': pd.to_numeric(customers['age'], errors='coerce').fillna(0).astype(int),
+        'gender': gender.replace(GENDER_ALIASES).map(gender_codes),
+    }, index=customers.index)
+
+
+def predict_categories(model, features):
+    """
+    Predicts the category of every customer with complete features in one
+    predict() call.
+
+    Returns:
+        pd.Series: Category ID per customer (NA where it could not be predicted).
+    """
+    categories = pd.Series(pd.NA, index=features.index, dtype='Int64')
+    complete = features.notna().all(axis=1)
+    if complete.any():
+        categories[complete] = model.predict(features[complete].astype(int)).astype(np.int64)
+    return categories
+
+
+def best_sellers(cursor, category_ids, n):
+    """
+    The `n` best-selling products of every category, from one GROUP BY query,
+    plus the store-wide best sellers under the category None.
+
+    Returns:
+        dict: category ID (or None) -> list of product IDs, best first.
+    """
+    ranked = {}
+    if category_ids:
+        placeholders = ', '.join(['%s'] * len(category_ids))
+        cursor.execute(CATEGORY_SALES_SQL.format(placeholders=placeholders), tuple(int(c) for c in category_ids))
+        sales = pd.DataFrame(cursor.fetchall(), columns=['category_id', 'product_id', 'sumsales'])
+        sales = sales.sort_values(['category_id', 'sumsales', 'product_id'], ascending=[True, False, True])
+        for category_id, group in sales.groupby('category_id', sort=False):
+            ranked[int(category_id)] = group['product_id'].head(n).astype(int).tolist()
+    cursor.execute(STORE_SALES_SQL, (n,))
+    ranked[None] = [int(row['product_id']) for row in cursor.fetchall()]
+    return ranked
+
+
+def compute_customer_recommendations(customer_ids=None, n=DEFAULT_TOP_N, model_path=DEFAULT_MODEL_PATH, stats=None):
+    """
+    Top-N products of customers: the best sellers of the category the
+    classifier predicts from their country, age and gender. Customers whose
+    category cannot be predicted get the store-wide best sellers.
+
+    Everything is loaded in bulk on one connection: the customers, the label
+    codes and the category sales; the model is unpickled once.
+
+    Args:
+        customer_ids (list): Customers to compute (all customers when None).
+        n (int): Products per customer.
+        model_path (str): The pickled classifier.
+        stats (StageStats): Optional collector of the stage timings.
+
+    Returns:
+        pd.DataFrame: 'customer_id', 'rank_position', 'product_id', 'post_title'
+                      and 'category_id' rows, or None if the database could not be read.
+    """
+    stats = stats if stats is not None else StageStats()
+    connection, cursor = make_connection_with_db()
+    if connection is None or cursor is None:
+        logging.error("Database connection failed in compute_customer_recommendations.")
+        return None
+    try:
+        with stats.stage('load') as stage:
+            customers = load_customers(cursor, customer_ids)
+            country_codes = load_codes(cursor, 'custom_country_code', 'country')
+            gender_codes = load_codes(cursor, 'custom_gender_code', 'gender')
+            stage['rows'] = len(customers)
+
+        with stats.stage('predict') as stage:
+            features = encode_customers(customers, country_codes, gender_codes)
+            try:
+                categories = predict_categories(load_model(model_path), features)
+            except FileNotFoundError:
+                logging.error(f"Model file not found at {model_path}; using store-wide best sellers.")
+                categories = pd.Series(pd.NA, index=customers.index, dtype='Int64')
+            stage['rows'] = int(categories.notna().sum())
+
+        with stats.stage('rank') as stage:
+            ranked = best_sellers(cursor, sorted(categories.dropna().astype(int).unique().tolist()), n)
+            stage['rows'] = len(ranked)
+    except mysql.connector.Error as err:
+        logging.error(f"Database error in compute_customer_recommendations: {err}")
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
+    with stats.stage('assemble') as stage:
+        rows = []
+        for customer_id, category_id in zip(customers['customer_id'].astype(int), categories):
+            category_id = None if pd.isna(category_id) else int(category_id)
+            products = ranked.get(category_id)
+            if not products:
+                # No prediction, or a category without sales: store-wide best sellers.
+                category_id, products = None, ranked[None]
+            for position, product_id in enumerate(products[:n], start=1):
+                rows.append((customer_id, position, product_id, category_id))
+        frame = pd.DataFrame(rows, columns=['customer_id', 'rank_position', 'product_id', 'category_id'])
+        titles = catalog_cache.get_product_titles(frame['product_id'].unique().tolist()) if len(frame) else {}
+        frame['post_title'] = [titles.get(product_id, 'Not Found') for product_id in frame['product_id']]
+        stage['rows'] = len(frame)
+    return frame[['customer_id', 'rank_position', 'product_id', 'post_title', 'category_id']]
+
+
+def _insert_rows(cursor, table, frame):
+    insert_sql = CUSTOMER_RECOMMENDATIONS_INSERT_SQL.format(table=table)
+    rows = [(int(customer_id), int(position), int(product_id), title, None if pd.isna(category_id) else int(category_id))
+            for customer_id, position, product_id, title, category_id in frame.itertuples(index=False)]
+    for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+        cursor.executemany(insert_sql, rows[start:start + EXPORT_BATCH_SIZE])
+
+
+def export_customer_recommendations(frame):
+    """
+    Replaces the 'custom_customer_recommendations' table: the rows are
+    bulk-inserted into a staging table that is then swapped in with one
+    atomic RENAME TABLE, as the association export does.
+
+    Returns:
+        bool: True if the export completed, False otherwise.
+    """
+    connection, cursor = None, None
+    exported = False
+    try:
+        connection, cursor = make_connection_with_db()
+        if connection is None or cursor is None:
+            logging.error("Database connection failed in export_customer_recommendations.")
+            return exported
+
+        cursor.execute(f"DROP TABLE IF EXISTS {CUSTOMER_RECOMMENDATIONS_STAGING_TABLE}")
+        cursor.execute(CUSTOMER_RECOMMENDATIONS_TABLE_SQL.format(table=CUSTOMER_RECOMMENDATIONS_STAGING_TABLE))
+        _insert_rows(cursor, CUSTOMER_RECOMMENDATIONS_STAGING_TABLE, frame)
+        connection.commit()
+
+        # First run: make sure there is a live table to swap with.
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {CUSTOMER_RECOMMENDATIONS_TABLE} "
+                       f"LIKE {CUSTOMER_RECOMMENDATIONS_STAGING_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {CUSTOMER_RECOMMENDATIONS_OLD_TABLE}")
+        cursor.execute(f"RENAME TABLE {CUSTOMER_RECOMMENDATIONS_TABLE} TO {CUSTOMER_RECOMMENDATIONS_OLD_TABLE}, "
+                       f"{CUSTOMER_RECOMMENDATIONS_STAGING_TABLE} TO {CUSTOMER_RECOMMENDATIONS_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {CUSTOMER_RECOMMENDATIONS_OLD_TABLE}")
+        exported = True
+        logging.info(f"Exported {len(frame)} customer recommendations.")
+
+    except Exception:
+        logging.error("An error occurred during export_customer_recommendations", exc_info=True)
+        if connection:
+            connection.rollback()  # The live table is untouched until the RENAME succeeds
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+    return exported
+
+
+def build_customer_recommendations(n=DEFAULT_TOP_N, model_path=DEFAULT_MODEL_PATH, stats=None):
+    """
+    Batch job: computes the top-N products of every customer and swaps them
+    into 'custom_customer_recommendations'.
+
+    Returns:
+        dict: Customers and rows exported.
+
+    Raises:
+        RuntimeError: If the customers could not be read or the export failed.
+    """
+    stats = stats if stats is not None else StageStats()
+    frame = compute_customer_recommendations(n=n, model_path=model_path, stats=stats)
+    if frame is None:
+        raise RuntimeError("Could not read the customers from the database.")
+    with stats.stage('export') as stage:
+        if not export_customer_recommendations(frame):
+            raise RuntimeError("Export of the customer recommendations failed; the live table is unchanged.")
+        stage['rows'] = len(frame)
+    stats.report("Customer recommendations")
+    return {'customers': int(frame['customer_id'].nunique()), 'rows': len(frame)}
+
+
+def _store_customer(frame):
+    """
+    Adds lazily computed rows to the live table (created if the batch job never ran).
+    """
+    connection, cursor = None, None
+    try:
+        connection, cursor = make_connection_with_db()
+        if connection is None or cursor is None:
+            return
+        cursor.execute(CUSTOMER_RECOMMENDATIONS_TABLE_SQL.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS')
+                       .format(table=CUSTOMER_RECOMMENDATIONS_TABLE))
+        cursor.execute(f"DELETE FROM {CUSTOMER_RECOMMENDATIONS_TABLE} WHERE customer_id = %s",
+                       (int(frame['customer_id'].iloc[0]),))
+        _insert_rows(cursor, CUSTOMER_RECOMMENDATIONS_TABLE, frame)
+        connection.commit()
+    except mysql.connector.Error as err:
+        logging.error(f"Could not store the recommendations of a customer: {err}")
+        if connection:
+            connection.rollback()
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+def _is_unknown_customer(customer_id):
+    with _unknown_customers_lock:
+        expires = _unknown_customers.get(customer_id)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del _unknown_customers[customer_id]
+        return False
+
+
+def _remember_unknown_customer(customer_id):
+    with _unknown_customers_lock:
+        _unknown_customers[customer_id] = time.monotonic() + UNKNOWN_CUSTOMER_TTL
+        _unknown_customers.move_to_end(customer_id)
+        while len(_unknown_customers) > MAX_UNKNOWN_CUSTOMERS:
+            _unknown_customers.popitem(last=False)
+
+
+def get_customer_recommendations(customer_id, n=DEFAULT_TOP_N, model_path=DEFAULT_MODEL_PATH):
+    """
+    Top-N products of one customer, read from 'custom_customer_recommendations'
+    with one prepared query. Customers the batch job has not seen yet are
+    computed on the spot and added to the table, so the next call is a read.
+
+    Only customers of 'wp_wc_customer_lookup' are computed; unknown IDs (and
+    customers nothing could be computed for) are remembered for
+    UNKNOWN_CUSTOMER_TTL seconds, so repeated requests for them stay cheap.
+
+    Returns:
+        dict: 'source' ('table' or 'computed') and 'recommendations' (product ID,
+              title and category of each product), or None for an unknown customer.
+    """
+    customer_id = int(customer_id)
+    if _is_unknown_customer(customer_id):
+        return None
+    try:
+        rows = execute_prepared(CUSTOMER_RECOMMENDATIONS_SELECT_SQL, (customer_id, int(n)))
+    except mysql.connector.Error as err:
+        # The table does not exist before the first batch run.
+        logging.warning(f"Could not read {CUSTOMER_RECOMMENDATIONS_TABLE}: {err}")
+        rows = []
+    if rows:
+        return {'source': 'table', 'recommendations': [
+            {'product_id': int(row['product_id']), 'post_title': row['post_title'],
+             'category_id': None if row['category_id'] is None else int(row['category_id'])}
+            for row in rows]}
+
+    try:
+        exists = execute_prepared(CUSTOMER_EXISTS_SQL, (customer_id,))
+    except mysql.connector.Error as err:
+        logging.error(f"Could not look up customer {customer_id}: {err}")
+        return None
+    if not exists:
+        _remember_unknown_customer(customer_id)
+        return None
+
+    frame = compute_customer_recommendations([customer_id], n=max(n, DEFAULT_TOP_N), model_path=model_path)
+    if frame is None:
+        return None
+    if frame.empty:
+        _remember_unknown_customer(customer_id)
+        return None
+    _store_customer(frame)
+    return {'source': 'computed', 'recommendations': [
+        {'product_id': int(product_id), 'post_title': title,
+         'category_id': None if pd.isna(category_id) else int(category_id)}
+        for product_id, title, category_id in frame[['product_id', 'post_title', 'category_id']].head(n)
+        .itertuples(index=False)]}
@@ -4,26 +4,16 @@ import logging
 import pickle
 import sys
 import io
+
+from api.catalog_cache import catalog_cache
+from api.db import execute_prepared, make_connection_with_db
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 # ============ Logging Setup ============
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # ============ Database Connection ============
-def make_connection_with_db():
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="wp_ecommerce"
-        )
-        cursor = connection.cursor(dictionary=True)
-        logging.info("Database connection established.")
-        return connection, cursor
-    except mysql.connector.Error as err:
-        logging.error(f"Database connection failed: {err}")
-        return None, None
+# Connections come from the shared pool in api/db.py.
 
 # ============ Helper Functions ============
 
@@ -63,47 +53,20 @@ def category_best_seller_produtcts(category_id, n=3):
     return products_ids
 
 def get_product_name_from_id(product_id):
-    product_name = 'Not Found'
-    try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            logging.error("Database connection failed.")
-            return product_name
-
-        sql = 'SELECT post_title as product_title FROM wp_posts WHERE ID = %s;'
-        cursor.execute(sql, (product_id,))
-        results = cursor.fetchall()
-        if results:
-            product_name = results[0]['product_title']
-
-    except mysql.connector.Error as err:
-        logging.error(f"Database error: {err}. Product ID: {product_id}")
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}. Product ID: {product_id}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-    return product_name
+    # Served from the shared product catalog cache (no connection per call).
+    return catalog_cache.get_product_title(product_id)
 
 def get_gender_code(gender):
     gender_code = 'Not Found'
     try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            logging.error("Database connection failed.")
-            return gender_code
-
         gender = gender.lower()
         if gender == 'male':
             gender = 'ذكر'
         elif gender == 'female':
             gender = 'انثى'
 
-        sql = 'SELECT code FROM custom_gender_code WHERE gender = %s;'
-        cursor.execute(sql, (gender,))
-        results = cursor.fetchall()
+        # Prepared once per pooled connection and reused on every call.
+        results = execute_prepared('SELECT code FROM custom_gender_code WHERE gender = %s', (gender,))
         if results:
             gender_code = results[0]['code']
 
@@ -111,25 +74,14 @@ def get_gender_code(gender):
         logging.error(f"Database error: {err}. Gender: {gender}")
     except Exception as e:
         logging.error(f"Unexpected error: {e}. Gender: {gender}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
     return gender_code
 
 def get_country_code(country):
     country_code = 'Not Found'
     try:
-        connection, cursor = make_connection_with_db()
-        if connection is None or cursor is None:
-            logging.error("Database connection failed.")
-            return country_code
-
         country = country.upper()
-        sql = 'SELECT code FROM custom_country_code WHERE country = %s;'
-        cursor.execute(sql, (country,))
-        results = cursor.fetchall()
+        # Prepared once per pooled connection and reused on every call.
+        results = execute_prepared('SELECT code FROM custom_country_code WHERE country = %s', (country,))
         if results:
             country_code = results[0]['code']
 
@@ -137,11 +89,6 @@ def get_country_code(country):
         logging.error(f"Database error: {err}. Country: {country}")
     except Exception as e:
         logging.error(f"Unexpected error: {e}. Country: {country}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
     return country_code
 
 def get_category_code(filename, country, age, gender): 
@@ -213,8 +160,9 @@ def get_customer_products(customer_id, n=3):
 
         products_df = category_best_seller_produtcts(category_code, n=n)
         if isinstance(products_df, pd.DataFrame):
+            titles = catalog_cache.get_product_titles(products_df['product_id'].tolist())
             for product_id in products_df['product_id']:
-                products.append(get_product_name_from_id(product_id))
+                products.append(titles.get(int(product_id), 'Not Found'))
         else:
             logging.warning("No products found for given category.")
 
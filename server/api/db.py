@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+import weakref
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import pooling
+
+# Connection settings, overridable through the environment.
+DB_CONFIG = {
+    'host': os.environ.get('WP_DB_HOST', 'localhost'),        # Database host (e.g., 'localhost' or an IP address)
+    'port': int(os.environ.get('WP_DB_PORT', 3306)),
+    'user': os.environ.get('WP_DB_USER', 'root'),             # Database username
+    'password': os.environ.get('WP_DB_PASSWORD', ''),         # Database password (leave empty if no password)
+    'database': os.environ.get('WP_DB_NAME', 'wp_ecommerce'), # Name of the database to connect to
+}
+
+POOL_NAME = 'wp_ecommerce_pool'
+# mysql.connector caps a pool at 32 connections.
+POOL_SIZE = int(os.environ.get('WP_DB_POOL_SIZE', 8))
+# Seconds to wait for a free connection when the pool is exhausted.
+POOL_TIMEOUT = float(os.environ.get('WP_DB_POOL_TIMEOUT', 10))
+
+_pool = None
+_pool_settings = {'pool_size': POOL_SIZE, 'timeout': POOL_TIMEOUT}
+_pool_lock = threading.Lock()
+# Prepared cursors per checked-out connection. The pool hands out a new
+# connection object on every checkout, so an entry lasts one checkout (the
+# session reset on return deallocates the statements) and dies with it.
+_prepared_cursors = weakref.WeakKeyDictionary()
+
+
+def configure_pool(pool_size=None, timeout=None, **config):
+    """
+    Changes the pool size, checkout timeout or connection settings.
+    Takes effect for the next pool created; call it before the first query
+    (e.g. at server start-up).
+    """
+    global _pool
+    with _pool_lock:
+        if pool_size is not None:
+            _pool_settings['pool_size'] = pool_size
+        if timeout is not None:
+            _pool_settings['timeout'] = timeout
+        DB_CONFIG.update(config)
+        _pool = None
+
+
+def get_pool():
+    """
+    Returns the process-wide MySQLConnectionPool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=POOL_NAME,
+                    pool_size=_pool_settings['pool_size'],
+                    # Reset the session when a connection goes back to the pool:
+                    # this rolls back a transaction the borrower left open, so
+                    # the next borrower does not read from its stale REPEATABLE
+                    # READ snapshot.
+                    pool_reset_session=True,
+                    # Rows a borrower left unread are discarded, not handed on.
+                    consume_results=True,
+                    **DB_CONFIG,
+                )
+                logging.info(f"MySQL connection pool created (size={_pool_settings['pool_size']}).")
+    return _pool
+
+
+def get_connection():
+    """
+    Takes a connection from the pool, waiting up to the pool timeout when all
+    connections are busy. The connection is health-checked with a ping (and
+    reconnected if the server dropped it). Calling close() returns it to the
+    pool, which resets its session (rolling back any open transaction).
+    """
+    deadline = time.monotonic() + _pool_settings['timeout']
+    while True:
+        try:
+            connection = get_pool().get_connection()
+            break
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+
+    try:
+        connection.ping(reconnect=True, attempts=2, delay=0)
+    except mysql.connector.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def make_connection_with_db(dictionary=True):
+    """
+    Establishes a connection to the MySQL database through the shared pool.
+
+    Returns:
+        tuple: A tuple containing the connection object and cursor object,
+               or (None, None) if the connection fails.
+    """
+    try:
+        connection = get_connection()
+        # Use dictionary=True to fetch results as dictionaries (column_name: value)
+        cursor = connection.cursor(dictionary=dictionary)
+        return connection, cursor
+    except (mysql.connector.Error, pooling.PoolError) as err:
+        logging.error(f"Error connecting to database: {err}", exc_info=True)
+        print(f"Error connecting to database: {err}")
+        return None, None
+
+
+@contextmanager
+def db_cursor(dictionary=True, commit=False):
+    """
+    Context manager yielding a cursor on a pooled connection; the connection
+    goes back to the pool on exit (after a commit when `commit` is True, or a
+    rollback if the block raised).
+    """
+    connection = get_connection()
+    cursor = connection.cursor(dictionary=dictionary)
+    try:
+        yield cursor
+        if commit:
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def prepared_cursor(connection, sql):
+    """
+    Returns a server-side prepared (dictionary) cursor for `sql`, reused for
+    the rest of the current checkout of the pooled connection (the session
+    reset on return deallocates it).
+
+    Do not close the returned cursor; fetch all of its rows before the
+    connection goes back to the pool.
+    """
+    cursors = _prepared_cursors.setdefault(connection, {})
+    cursor = cursors.get(sql)
+    if cursor is None:
+        cursor = connection.cursor(prepared=True, dictionary=True)
+        cursors[sql] = cursor
+    return cursor
+
+
+def execute_prepared(sql, params=()):
+    """
+    Runs `sql` as a server-side prepared statement on a pooled connection.
+
+    Returns:
+        list: The fetched rows as dictionaries.
+    """
+    connection = get_connection()
+    try:
+        cursor = prepared_cursor(connection, sql)
+        try:
+            cursor.execute(sql, params)
+        except mysql.connector.Error:
+            # The statement handle dies with the session (e.g. after a
+            # reconnect); prepare it again once on a fresh cursor.
+            _prepared_cursors[connection].pop(sql, None)
+            cursor = prepared_cursor(connection, sql)
+            cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        connection.close()
@@ -0,0 +1,548 @@
+import os
+import json
+import time
+import uuid
+import queue
+import signal
+import logging
+import sqlite3
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: memory limits are not applied there.
+    resource = None
+
+from api.association.stage_stats import StageStats
+
+# Local SQLite file holding every job and its progress.
+DEFAULT_JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', 'jobs.sqlite3')
+# Address-space limit of a job's worker process, in MB (0 for none).
+DEFAULT_MEMORY_LIMIT_MB = int(os.environ.get('JOB_MEMORY_LIMIT_MB', 8192))
+# Seconds between two checks of a worker process for progress, cancel and timeout.
+WORKER_POLL_INTERVAL = 0.5
+# Seconds a terminated worker gets to exit before it is killed.
+WORKER_KILL_GRACE = 5.0
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        params TEXT NOT NULL,          -- JSON keyword arguments of the job function
+        status TEXT NOT NULL,
+        created REAL NOT NULL,         -- Unix times
+        started REAL,
+        finished REAL,
+        stages TEXT NOT NULL,          -- JSON: stage name -> status, rows, seconds
+        message TEXT,
+        result TEXT,                   -- JSON return value of the job function
+        error TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+INSERT_JOB_SQL = 'INSERT INTO jobs (id, type, params, status, created, stages) VALUES (?, ?, ?, ?, ?, ?)'
+
+JSON_COLUMNS = ('params', 'stages', 'result')
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job when a cancel was requested (at its next stage boundary).
+    """
+
+
+class JobStore:
+    """
+    Jobs persisted in a local SQLite file, so they survive a server restart.
+    One connection shared by the runner threads, serialized by a lock.
+    """
+
+    def __init__(self, path=DEFAULT_JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(JOBS_TABLE_SQL)
+            self._connection.execute('CREATE INDEX IF NOT EXISTS idx_jobs_type_status ON jobs (type, status)')
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._connection:
+            return self._connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _decode(row):
+        job = dict(row)
+        for column in JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] is not None else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    def create(self, job_type, params):
+        job_id = uuid.uuid4().hex
+        self._execute(INSERT_JOB_SQL, (job_id, job_type, json.dumps(params), QUEUED, time.time(), '{}'))
+        return job_id
+
+    def create_unless_active(self, job_type, params):
+        """
+        Creates a job unless one of the same type is queued or running. The
+        check and the insert share one write transaction, so two concurrent
+        submissions (from any process using the file) cannot both get through.
+
+        Returns:
+            str: The new job's ID, or None if a job of this type is already active.
+        """
+        with self._lock, self._connection:
+            self._connection.execute('BEGIN IMMEDIATE')
+            active = self._connection.execute(
+                f"SELECT 1 FROM jobs WHERE type = ? AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))}) LIMIT 1",
+                (job_type, *ACTIVE_STATUSES)).fetchall()
+            if active:
+                return None
+            job_id = uuid.uuid4().hex
+            self._connection.execute(INSERT_JOB_SQL,
+                                     (job_id, job_type, json.dumps(params), QUEUED, time.time(), '{}'))
+        return job_id
+
+    def get(self, job_id):
+        rows = self._execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        return self._decode(rows[0]) if rows else None
+
+    def list(self, job_type=None, status=None, limit=50):
+        """
+        Most recent jobs first, optionally filtered by type and/or status
+        (a status or a tuple of statuses).
+        """
+        clauses, params = [], []
+        if job_type is not None:
+            clauses.append('type = ?')
+            params.append(job_type)
+        if status is not None:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._execute(f'SELECT * FROM jobs {where} ORDER BY created DESC LIMIT ?', (*params, int(limit)))
+        return [self._decode(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        for column in JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column])
+        assignments = ', '.join(f'{column} = ?' for column in fields)
+        self._execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def start(self, job_id):
+        """
+        Marks a queued job as running. Returns False if it is no longer queued
+        (e.g. cancelled while waiting).
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute('UPDATE jobs SET status = ?, started = ? WHERE id = ? AND status = ?',
+                                              (RUNNING, time.time(), job_id, QUEUED))
+            return cursor.rowcount == 1
+
+    def request_cancel(self, job_id):
+        """
+        Cancels a queued job right away; flags a running one so it stops at
+        its next stage. Returns the job's status afterwards (None if unknown).
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE jobs SET status = ?, finished = ?, message = ? WHERE id = ? AND status = ?',
+                (CANCELLED, time.time(), "Cancelled before it started.", job_id, QUEUED))
+            self._connection.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?',
+                                     (job_id, RUNNING))
+            rows = self._connection.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchall()
+        return rows[0]['status'] if rows else None
+
+    def cancel_requested(self, job_id):
+        rows = self._execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,))
+        return bool(rows and rows[0]['cancel_requested'])
+
+    def recover(self):
+        """
+        After a restart: jobs that were running are marked failed (their
+        process is gone); the queued ones are returned, oldest first, to be
+        queued again.
+        """
+        self._execute('UPDATE jobs SET status = ?, finished = ?, error = ? WHERE status = ?',
+                      (FAILED, time.time(), "Interrupted by a server restart.", RUNNING))
+        rows = self._execute('SELECT id, type FROM jobs WHERE status = ? ORDER BY created', (QUEUED,))
+        return [(row['id'], row['type']) for row in rows]
+
+
+class JobContext:
+    """
+    Handle passed to a running job function: stage progress and cancellation.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.stages = {}
+
+    def record_stage(self, name, event, entry):
+        if event == 'started':
+            self.stages[name] = {'status': RUNNING, 'started': time.time(), 'rows': None, 'seconds': None}
+        else:
+            self.stages.setdefault(name, {}).update(status='done', rows=entry.get('rows'),
+                                                    seconds=entry.get('seconds'))
+        self.store.update(self.job_id, stages=self.stages, message=f"Stage '{name}' {event}.")
+
+    def _on_stage(self, name, event, entry):
+        if event == 'started':
+            self.check_cancelled()
+        self.record_stage(name, event, entry)
+
+    def stats(self):
+        """
+        A StageStats whose stages are recorded as the job's progress. Stage
+        starts are also where a requested cancel takes effect.
+        """
+        return StageStats(listener=self._on_stage)
+
+    def progress(self, message):
+        self.store.update(self.job_id, message=message)
+
+    def check_cancelled(self):
+        if self.store.cancel_requested(self.job_id):
+            raise JobCancelled(f"Job {self.job_id} cancelled.")
+
+
+class WorkerContext:
+    """
+    The JobContext of a job running in a worker process: progress goes back
+    to the supervising server thread over `events`. Cancellation is done by
+    the supervisor terminating the process.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def _on_stage(self, name, event, entry):
+        self.events.put(('stage', name, event, dict(entry)))
+
+    def stats(self):
+        return StageStats(listener=self._on_stage)
+
+    def progress(self, message):
+        self.events.put(('message', message))
+
+    def check_cancelled(self):
+        pass
+
+
+def limit_memory(memory_limit_mb):
+    """
+    Caps the address space of the current process, so a runaway job gets a
+    MemoryError instead of pushing the server into swap or the OOM killer.
+    """
+    if resource is None or not memory_limit_mb:
+        return
+    limit = int(memory_limit_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(run, params, events, memory_limit_mb):
+    """
+    Entry point of a job's worker process: runs the job function and sends
+    back ('result', value) or ('error', message).
+
+    On POSIX the worker leads its own process group, which the process pools
+    of the mining stages join, so the supervisor can stop all of them at
+    once; SIGTERM exits through the job's cleanup (pool shutdown, shared
+    memory unlink).
+    """
+    if hasattr(os, 'setsid'):
+        os.setsid()
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    limit_memory(memory_limit_mb)
+    try:
+        events.put(('result', run(WorkerContext(events), **params)))
+    except MemoryError:
+        events.put(('error', f"Out of memory (worker limit {memory_limit_mb} MB)."))
+    except Exception as e:
+        logging.error(f"Job worker failed: {e}", exc_info=True)
+        events.put(('error', f"{type(e).__name__}: {e}"))
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+class JobType:
+    """
+    A kind of job: the function running it (called as `run(job, **params)`)
+    and how many jobs of this kind may run at the same time.
+
+    With `isolated` (the default), every job runs in its own worker process,
+    so its CPU work does not hold the server's GIL and a crash or a memory
+    blow-up only takes the worker down. `run` must then be a module-level
+    function (it is pickled to the 'spawn'ed worker), and `timeout` (seconds)
+    and `memory_limit_mb` bound the worker. `on_success(result)` runs in the
+    server process after a job succeeded (e.g. to reload what the job wrote).
+
+    `allowed_params` lists the keyword arguments a submitted job may set (None
+    allows any); file paths are left out so a client cannot point a job at
+    arbitrary files. An `exclusive` type is never queued while another job of
+    that type is queued or running (e.g. jobs swapping the same table).
+    """
+
+    def __init__(self, name, run, max_concurrent=1, isolated=True, timeout=None,
+                 memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, on_success=None, allowed_params=None, exclusive=False):
+        self.name = name
+        self.run = run
+        self.max_concurrent = max_concurrent
+        self.isolated = isolated
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.on_success = on_success
+        self.allowed_params = frozenset(allowed_params) if allowed_params is not None else None
+        self.exclusive = exclusive
+
+
+class JobRunner:
+    """
+    Runs submitted jobs from one FIFO queue per job type, drained by
+    `max_concurrent` threads of that type. A thread runs an isolated job by
+    supervising its worker process (see JobType), other jobs directly.
+    """
+
+    def __init__(self, store=None, job_types=()):
+        self.store = store or JobStore()
+        self.job_types = {}
+        self._queues = {}
+        self._started = False
+        self._lock = threading.Lock()
+        for job_type in job_types:
+            self.register(job_type)
+
+    def register(self, job_type):
+        with self._lock:
+            self.job_types[job_type.name] = job_type
+            self._queues[job_type.name] = queue.Queue()
+            if self._started:
+                self._start_workers(job_type)
+
+    def _start_workers(self, job_type):
+        for number in range(job_type.max_concurrent):
+            threading.Thread(target=self._work, args=(job_type,), daemon=True,
+                             name=f"job-{job_type.name}-{number}").start()
+
+    def start(self):
+        """
+        Starts the worker threads and re-queues the jobs left queued by the
+        previous server run.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for job_type in self.job_types.values():
+                self._start_workers(job_type)
+        for job_id, job_type in self.store.recover():
+            if job_type in self._queues:
+                self._queues[job_type].put(job_id)
+            else:
+                self.store.update(job_id, status=FAILED, finished=time.time(),
+                                  error=f"Unknown job type '{job_type}'.")
+
+    def submit(self, job_type, params=None):
+        """
+        Queues a job. Returns its ID, or None (nothing queued) for an
+        exclusive job type that already has a job queued or running.
+
+        Raises:
+            ValueError: For an unknown job type or a parameter it does not allow.
+        """
+        if job_type not in self.job_types:
+            raise ValueError(f"Unknown job type '{job_type}'. Use one of: {', '.join(self.job_types)}")
+        allowed = self.job_types[job_type].allowed_params
+        unknown = sorted(set(params or {}) - allowed) if allowed is not None else []
+        if unknown:
+            raise ValueError(f"Unknown parameters for '{job_type}': {', '.join(unknown)}. "
+                             f"Allowed: {', '.join(sorted(allowed)) or 'none'}.")
+        if self.job_types[job_type].exclusive:
+            job_id = self.store.create_unless_active(job_type, params or {})
+            if job_id is None:
+                return None
+        else:
+            job_id = self.store.create(job_type, params or {})
+        self._queues[job_type].put(job_id)
+        logging.info(f"Job {job_id} ({job_type}) queued.")
+        return job_id
+
+    def cancel(self, job_id):
+        return self.store.request_cancel(job_id)
+
+    def _work(self, job_type):
+        job_queue = self._queues[job_type.name]
+        while True:
+            job_id = job_queue.get()
+            try:
+                self._run(job_type, job_id)
+            finally:
+                job_queue.task_done()
+
+    def _run(self, job_type, job_id):
+        if not self.store.start(job_id):
+            return
+        job = self.store.get(job_id)
+        context = JobContext(self.store, job_id)
+        print(f"[INFO] Job {job_id} ({job_type.name}) started.")
+        try:
+            if job_type.isolated:
+                result = self._supervise(job_type, context, job['params'])
+            else:
+                result = job_type.run(context, **job['params'])
+            if job_type.on_success is not None:
+                job_type.on_success(result)
+            self.store.update(job_id, status=SUCCEEDED, finished=time.time(), result=result,
+                              message=f"{job_type.name} job completed successfully.")
+        except JobCancelled:
+            self.store.update(job_id, status=CANCELLED, finished=time.time(), message="Cancelled while running.")
+        except Exception as e:
+            logging.error(f"Job {job_id} ({job_type.name}) failed: {e}", exc_info=True)
+            print(f"[ERROR] {e}")
+            self.store.update(job_id, status=FAILED, finished=time.time(), error=str(e), message=f"Error: {e}")
+        print(f"[INFO] Job {job_id} ({job_type.name}) ended.")
+
+    def _supervise(self, job_type, context, params):
+        """
+        Runs a job in a 'spawn'ed worker process and relays its progress into
+        the store until it finishes, crashes, times out or is cancelled.
+        """
+        mp_context = multiprocessing.get_context('spawn')
+        events = mp_context.Queue()
+        # Not a daemon: the mining stages start process pools of their own.
+        process = mp_context.Process(target=_worker_main, name=f"job-{context.job_id}",
+                                     args=(job_type.run, params, events, job_type.memory_limit_mb))
+        process.start()
+        deadline = time.monotonic() + job_type.timeout if job_type.timeout else None
+        outcome = None
+        next_check = 0.0
+        try:
+            while outcome is None:
+                try:
+                    event = events.get(timeout=WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    event = None
+                if event is not None:
+                    if event[0] == 'stage':
+                        context.record_stage(*event[1:])
+                    elif event[0] == 'message':
+                        context.progress(event[1])
+                    else:
+                        outcome = event
+                        break
+                now = time.monotonic()
+                if deadline is not None and now > deadline:
+                    raise RuntimeError(f"Timed out after {job_type.timeout} seconds.")
+                if now < next_check:
+                    continue
+                next_check = now + WORKER_POLL_INTERVAL
+                if self.store.cancel_requested(context.job_id):
+                    raise JobCancelled(f"Job {context.job_id} cancelled.")
+                if not process.is_alive() and events.empty():
+                    raise RuntimeError(f"Worker process exited with code {process.exitcode}.")
+        finally:
+            if outcome is None:
+                self._stop(process)
+            process.join()
+            events.close()
+        if outcome[0] == 'error':
+            raise RuntimeError(outcome[1])
+        return outcome[1]
+
+    @staticmethod
+    def _stop(process):
+        """
+        Terminates a worker and the processes it started (its process group,
+        see _worker_main), killing them after WORKER_KILL_GRACE seconds.
+        """
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            # No process groups here, or the worker has not created its group yet.
+            process.terminate()
+        process.join(WORKER_KILL_GRACE)
+        if not process.is_alive():
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            process.kill()
+
+
+# ---- Job types of the server ----
+
+def run_association_job(job, mode='full', seed=None, **options):
+    """
+    Association rules: 'full' (start_generate_association), 'incremental'
+    (start_incremental_association) or 'approximate'. Extra options are
+    passed to the selected function, whose RuntimeError fails the job.
+    """
+    from api.association.association_build import start_generate_association, start_incremental_association
+
+    if mode == 'incremental':
+        result = start_incremental_association(stats=job.stats(), **options)
+    elif mode == 'approximate':
+        result = start_generate_association(approximate=True, seed=seed, stats=job.stats(), **options)
+    elif mode == 'full':
+        result = start_generate_association(seed=seed, stats=job.stats(), **options)
+    else:
+        raise ValueError(f"Unknown association mode '{mode}'.")
+    return {'mode': mode, **result}
+
+
+def run_classification_job(job, **options):
+    from api.classification.classification_WP import train_category_classifier
+
+    return train_category_classifier(stats=job.stats(), **options)
+
+
+def run_forecast_job(job, **options):
+    from api.timeSeries.time_series_wp import run_sales_forecast
+
+    return run_sales_forecast(stats=job.stats(), **options)
+
+
+def run_customer_recommendations_job(job, **options):
+    from api.classification.customer_recommendations import build_customer_recommendations
+
+    return build_customer_recommendations(stats=job.stats(), **options)
+
+
+def reload_live_index(result=None):
+    """
+    Switches the server's recommendation index to the snapshot the
+    association worker just published.
+    """
+    from api.association.recommendation_index import reload_index
+
+    reload_index()
+
+
+# Job options a client may set (paths such as checkpoint_dir, state_path and
+# model_path stay at their server-side defaults).
+ASSOCIATION_PARAMS = ('mode', 'seed', 'engine', 'pairwise', 'max_len', 'memory_budget_mb', 'time_budget_seconds',
+                      'workers', 'support_error', 'from_stage', 'half_life_days', 'top_k', 'top_k_metric',
+                      'partition_by_category', 'cross_min_support')
+
+DEFAULT_JOB_TYPES = (
+    JobType('association', run_association_job, max_concurrent=1, timeout=2 * 3600, on_success=reload_live_index,
+            allowed_params=ASSOCIATION_PARAMS, exclusive=True),
+    JobType('classification', run_classification_job, max_concurrent=1, timeout=3600, allowed_params=()),
+    JobType('forecast', run_forecast_job, max_concurrent=1, timeout=3600,
+            allowed_params=('forecast_days', 'history_days')),
+    JobType('customer_recommendations', run_customer_recommendations_job, max_concurrent=1, timeout=3600,
+            allowed_params=('n',), exclusive=True),
+)
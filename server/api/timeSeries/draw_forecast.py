@@ -4,25 +4,7 @@ import matplotlib.pyplot as plt # Import matplotlib for plotting
 from datetime import datetime # Ensure datetime is imported for date operations
 import sys
 
-
-# Assume make_connection_with_db is defined elsewhere or above this function
-def make_connection_with_db():
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="wp_ecommerce"
-        )
-        cursor = connection.cursor(dictionary=True) # Ensure this is dictionary=True
-        # print("Database connection established.") # Keep or remove, depending on verbosity needs
-        return connection, cursor
-    except mysql.connector.Error as err:
-        print(f"Database connection failed: {err}")
-        return None, None
-
-
-
+from api.db import make_connection_with_db
 
 
 def draw_forecast_from_db() -> pd.DataFrame:
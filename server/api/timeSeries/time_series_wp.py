@@ -10,20 +10,7 @@ import time
 from datetime import datetime 
 from datetime import timedelta 
 
-def make_connection_with_db():
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="wp_ecommerce"
-        )
-        cursor = connection.cursor(dictionary=True)
-        print("Database connection established.")
-        return connection, cursor
-    except mysql.connector.Error as err:
-        print(f"Database connection failed: {err}")
-        return None, None
+from api.db import make_connection_with_db
 
 def get_daily_sales_between_2_dates(start_date, end_date):
     connection, cursor = None, None
@@ -155,19 +142,64 @@ def save_forecast_in_db(forecast):
             cursor.close()
         if connection:
             connection.close()
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
\ No newline at end of file
+
+
+def run_sales_forecast(forecast_days=30, history_days=365, stats=None):
+    """
+    Forecasts the daily sales of the next `forecast_days` days with AutoTS,
+    trained on the last `history_days` days of sales, and saves the forecast
+    in 'custom_forecast_ts' (read by draw_forecast.py).
+
+    Args:
+        forecast_days (int): Days to forecast after the last day with sales.
+        history_days (int): Days of sales history to train on.
+        stats (StageStats): Optional collector for the stage timings (e.g. one
+                            reporting job progress).
+
+    Returns:
+        dict: The forecast range and the number of training days.
+
+    Raises:
+        RuntimeError: If there is no sales history or the forecast cannot be saved.
+    """
+    from api.association.stage_stats import StageStats
+
+    stats = stats if stats is not None else StageStats()
+
+    with stats.stage('load') as stage:
+        last_date = get_sales_of_last_date()
+        start_date = last_date - timedelta(days=history_days)
+        sales = get_daily_sales_between_2_dates(start_date.strftime('%Y-%m-%d'),
+                                                (last_date + timedelta(days=1)).strftime('%Y-%m-%d'))
+        stage['rows'] = len(sales)
+    if sales.empty:
+        raise RuntimeError("No sales history to forecast from.")
+
+    with stats.stage('fit') as stage:
+        sales['date'] = pd.to_datetime(sales['date'])
+        sales['total'] = sales['total'].astype(float)
+        model = AutoTS(
+            forecast_length=forecast_days,
+            frequency='D',
+            ensemble='simple',
+            model_list='fast',
+            max_generations=5,
+            num_validations=2,
+        )
+        model = model.fit(sales, date_col='date', value_col='total', id_col=None)
+        stage['rows'] = len(sales)
+
+    with stats.stage('predict') as stage:
+        forecast = model.predict().forecast
+        stage['rows'] = len(forecast)
+
+    with stats.stage('save') as stage:
+        if not save_forecast_in_db(forecast):
+            raise RuntimeError("The forecast could not be saved.")
+        stage['rows'] = len(forecast)
+
+    return {
+        'from': forecast.index.min().strftime('%Y-%m-%d'),
+        'to': forecast.index.max().strftime('%Y-%m-%d'),
+        'training_days': len(sales),
+    }
@@ -1,28 +1,35 @@
-from flask import Flask, jsonify
-import threading
-import time
+from flask import Flask, jsonify, request
+import os
 import sys
 
 # Ensure UTF-8 output in terminal
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Import the background task
+# Import the background tasks
 try:
-    from api.association.association_build import start_generate_association
+    from api.association.online_counts import get_online_counter
+    from api.association.recommendation_cache import (DEFAULT_RESPONSE_K, MAX_BATCH_SIZE, MAX_PRODUCT_ID,
+                                                      MAX_RESPONSE_K, RESPONSE_MAX_AGE, is_product_id,
+                                                      render_batch_recommendations, response_cache)
+    from api.association.recommendation_index import get_live_index
+    from api.association.rule_index import AGGREGATIONS
+    from api.classification.customer_recommendations import DEFAULT_CUSTOMER_N, DEFAULT_TOP_N, get_customer_recommendations
+    from api.jobs import ACTIVE_STATUSES, DEFAULT_JOB_TYPES, JobRunner, JobStore
 except ImportError as e:
-    print(f"[ERROR] Cannot import association module: {e}")
+    print(f"[ERROR] Cannot import background task modules: {e}")
     sys.exit(1)
 
 # Flask app initialization
 app = Flask(__name__)
 
-# Shared task state (thread-safe using a lock)
-task_status = {
-    "is_running": False,
-    "last_message": "No association process has run yet.",
-    "error": None
-}
-status_lock = threading.Lock()
+# Background jobs (association, classification, forecast), persisted in SQLite.
+job_runner = JobRunner(JobStore(), DEFAULT_JOB_TYPES)
+
+
+def get_job_runner():
+    # Started on first use, so that only the process serving requests runs jobs.
+    job_runner.start()
+    return job_runner
 
 # ---- ROUTES ----
 
@@ -36,55 +43,154 @@ def hello(name):
 
 @app.route('/api/association', methods=['GET', 'POST'])
 def association_trigger():
-    with status_lock:
-        if task_status["is_running"]:
-            return jsonify({
-                'ok': False,
-                'message': "Custom product generation is already in progress. Please wait."
-            }), 409
-
-        # Mark as running
-        task_status["is_running"] = True
-        task_status["last_message"] = "Starting custom product generation..."
-        task_status["error"] = None
-
-    # Start async task
-    threading.Thread(target=process_association_task, daemon=True).start()
+    # ?mode=incremental folds in only the orders since the last run;
+    # ?mode=approximate mines a sample of the orders (optional &seed= to reproduce a run).
+    mode = request.args.get('mode', 'full')
+    if mode not in ('full', 'incremental', 'approximate'):
+        return jsonify({'ok': False, 'message': f"Unknown mode '{mode}'. Use 'full', 'incremental' or 'approximate'."}), 400
+    seed = request.args.get('seed', type=int)
 
+    job_id = get_job_runner().submit('association', {'mode': mode, 'seed': seed})
+    if job_id is None:
+        return jsonify({
+            'ok': False,
+            'message': "Custom product generation is already in progress. Please wait."
+        }), 409
     return jsonify({
         'ok': True,
+        'job_id': job_id,
         'message': "Custom product generation started in background."
     })
 
-def process_association_task():
-    print("[INFO] Background task started.")
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    # {"type": "association" | "classification" | "forecast" | "customer_recommendations", "params": {...}}
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('params', {}), dict):
+        return jsonify({'ok': False, 'message': "Expected a JSON object with 'type' and optional 'params'."}), 400
+    try:
+        job_id = get_job_runner().submit(payload.get('type'), payload.get('params', {}))
+    except ValueError as e:
+        return jsonify({'ok': False, 'message': str(e)}), 400
+    if job_id is None:
+        return jsonify({'ok': False, 'message': f"A '{payload.get('type')}' job is already queued or running."}), 409
+    return jsonify({'ok': True, 'job_id': job_id}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    # Optional filters: ?type=association&status=running&limit=20
+    jobs = get_job_runner().store.list(job_type=request.args.get('type'), status=request.args.get('status'),
+                                       limit=request.args.get('limit', 50, type=int))
+    return jsonify({'ok': True, 'jobs': jobs})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'message': f"Unknown job '{job_id}'."}), 404
+    return jsonify({'ok': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    # Queued jobs are cancelled at once; running ones stop at their next stage.
+    status = get_job_runner().cancel(job_id)
+    if status is None:
+        return jsonify({'ok': False, 'message': f"Unknown job '{job_id}'."}), 404
+    return jsonify({'ok': True, 'job_id': job_id, 'status': status})
+
+@app.route('/api/orders/events', methods=['POST'])
+def order_events():
+    # Completed orders pushed by the shop (or by online_counts.py tailing the
+    # order tables): {"order_id": 1, "product_ids": [...]} or {"orders": [...]}.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'ok': False, 'message': "Expected a JSON object."}), 400
+    events = payload.get('orders', [payload])
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return jsonify({'ok': False, 'message': "'orders' must be a list of JSON objects."}), 400
     try:
-        time.sleep(5)  # Simulated processing
-        start_generate_association()
-        msg = "Custom product generation completed successfully."
-        err = None
-    except Exception as e:
-        msg = f"Error: {e}"
-        err = str(e)
-        print(f"[ERROR] {e}")
-    finally:
-        with status_lock:
-            task_status["is_running"] = False
-            task_status["last_message"] = msg
-            task_status["error"] = err
-        print("[INFO] Background task ended.")
+        orders = [(int(event['order_id']), [int(product_id) for product_id in event['product_ids']])
+                  for event in events
+                  if event.get('status', 'completed') in ('completed', 'wc-completed')]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'ok': False, 'message': "Every order needs an integer 'order_id' and a 'product_ids' list."}), 400
+
+    counted = get_online_counter().ingest(orders)
+    return jsonify({'ok': True, 'received': len(events), 'counted': counted})
+
+@app.route('/api/recommendations/product/<int:product_id>', methods=['GET'])
+def product_recommendations(product_id):
+    # ?k= recommendations (best confidence first). Cached per rule-set
+    # generation; the ETag only changes with the product's recommendations,
+    # so clients revalidate with If-None-Match and get a 304.
+    k = request.args.get('k', DEFAULT_RESPONSE_K, type=int)
+    if not 1 <= k <= MAX_RESPONSE_K:
+        return jsonify({'ok': False, 'message': f"k must be between 1 and {MAX_RESPONSE_K}."}), 400
+
+    cached = response_cache.get(product_id, k)
+    response = app.response_class(cached.body, mimetype='application/json')
+    response.set_etag(cached.etag)
+    response.headers['X-Recommendation-Generation'] = str(cached.generation)
+    response.cache_control.public = True
+    response.cache_control.max_age = RESPONSE_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def batch_recommendations():
+    # {"product_ids": [...], "baskets": [[...], ...], "k": 6, "aggregate": "max"}:
+    # listing pages send product_ids, carts send baskets; both resolve in one pass.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'ok': False, 'message': "Expected a JSON object."}), 400
+    product_ids = payload.get('product_ids', [])
+    baskets = payload.get('baskets', [])
+    k = payload.get('k', DEFAULT_RESPONSE_K)
+    aggregate = payload.get('aggregate', 'max')
+    if not isinstance(product_ids, list) or not isinstance(baskets, list) \
+            or not all(isinstance(basket, list) for basket in baskets):
+        return jsonify({'ok': False, 'message': "'product_ids' must be a list and 'baskets' a list of lists."}), 400
+    if len(product_ids) + len(baskets) > MAX_BATCH_SIZE:
+        return jsonify({'ok': False, 'message': f"At most {MAX_BATCH_SIZE} products and baskets per request."}), 400
+    if not isinstance(k, int) or not 1 <= k <= MAX_RESPONSE_K:
+        return jsonify({'ok': False, 'message': f"k must be between 1 and {MAX_RESPONSE_K}."}), 400
+    if aggregate not in AGGREGATIONS:
+        return jsonify({'ok': False, 'message': f"aggregate must be one of {AGGREGATIONS}."}), 400
+    if not all(is_product_id(product_id) for product_id in product_ids) \
+            or not all(is_product_id(item) for basket in baskets for item in basket):
+        return jsonify({'ok': False, 'message': f"Product IDs must be integers between 1 and {MAX_PRODUCT_ID - 1}."}), 400
+
+    result = render_batch_recommendations(get_live_index(), product_ids, baskets, k=k, aggregate=aggregate)
+    return jsonify(result)
+
+@app.route('/api/recommendations/customer/<int:customer_id>', methods=['GET'])
+def customer_recommendations(customer_id):
+    # ?n= products, read from the table the 'customer_recommendations' job
+    # builds; customers it has not covered yet are computed and stored on the fly.
+    n = request.args.get('n', DEFAULT_CUSTOMER_N, type=int)
+    if not 1 <= n <= DEFAULT_TOP_N:
+        return jsonify({'ok': False, 'message': f"n must be between 1 and {DEFAULT_TOP_N}."}), 400
+
+    result = get_customer_recommendations(customer_id, n=n)
+    if result is None:
+        return jsonify({'ok': False, 'message': f"No customer found with ID: {customer_id}"}), 404
+    return jsonify({'ok': True, 'customer_id': customer_id, **result})
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    with status_lock:
-        return jsonify({
-            'status': 'Server is running',
-            'custom_product_generation_in_progress': task_status["is_running"],
-            'last_task_message': task_status["last_message"],
-            'last_task_error': task_status["error"],
-            'ok': True
-        })
+    latest = get_job_runner().store.list(job_type='association', limit=1)
+    job = latest[0] if latest else None
+    return jsonify({
+        'status': 'Server is running',
+        'custom_product_generation_in_progress': bool(job and job['status'] in ACTIVE_STATUSES),
+        'last_task_message': job['message'] if job else "No association process has run yet.",
+        'last_task_error': job['error'] if job else None,
+        'last_job_id': job['id'] if job else None,
+        'ok': True
+    })
 
 # ---- MAIN ----
 if __name__ == '__main__':
+    # The debug reloader runs the app in a child process; resume queued jobs there only.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_job_runner()
     app.run(debug=True, port=5000)